@@ -1,41 +1,50 @@
 import os
 import sys
+import time
+import uuid
 import asyncio
-from typing import Dict, List, Any, Optional, AsyncGenerator, Literal
+from contextlib import nullcontext
+from typing import Dict, Any, Optional, AsyncGenerator, Callable, Awaitable, Tuple
 from datetime import datetime
-import httpx
-from tavily import TavilyClient
 
 # 添加当前目录到 Python 路径，以便导入本地 deepagents
 current_dir = os.path.dirname(os.path.abspath(__file__))
 if current_dir not in sys.path:
     sys.path.insert(0, current_dir)
 
-# 导入本地 deepagents 模块
-from deepagents import create_deep_agent, SubAgent
-
-# Tavily 搜索工具 - 参照 research_agent.py 的实现
-tavily_client = TavilyClient(api_key=os.environ.get("TAVILY_API_KEY"))
-
-def internet_search(
-    query: str,
-    max_results: int = 10,  # 增加到10条结果
-    topic: Literal["general", "news", "finance"] = "general",
-    include_raw_content: bool = True,  # 获取完整内容
-):
-    """Run a web search - 增强版本，获取更多更详细的信息"""
-    try:
-        search_docs = tavily_client.search(
-            query,
-            max_results=max_results,
-            include_raw_content=include_raw_content,
-            topic=topic,
-        )
-        return search_docs
-    except Exception as e:
-        print(f"Tavily搜索失败: {e}")
-        # 返回空结果而不是抛出异常
-        return {"results": []}
+from .custom_model import CustomChatModel, response_cache_stats
+from .search import internet_search, search_cache
+from .cassette import cassette
+from .session_store import create_session_store
+from .checkpoint import (
+    create_checkpointer, thread_config, copy_thread, list_threads, delete_thread,
+    close_dangling_tool_calls, close_checkpointer,
+)
+from .summarizer import create_summarizer
+from .scheduler import RunScheduler, QueueFullError, QueueTimeoutError
+from .single_flight import StreamFlight, flight_key
+from .sanitizer import sanitize, StreamSanitizer
+from .metrics import (
+    RUN_SECONDS, QUEUE_WAIT_SECONDS, TIME_TO_FIRST_EVENT_SECONDS, SANITIZE_SECONDS,
+    ERRORS, RUNS_CANCELLED, REQUESTS_COALESCED, metrics_callback,
+)
+from .tracing import tracer
+from .agent_registry import AgentRegistry
+
+def current_date_context() -> str:
+    """每次模型调用时注入的日期（只精确到天，同一天内不变，上游可以复用整段对话前缀）"""
+    now = datetime.now()
+    return f"Current date: {now.strftime('%Y-%m-%d')} ({now.strftime('%A')}, Beijing Time)."
+
+
+def create_deep_agent(*args, **kwargs):
+    """导入本地 deepagents 并创建代理；langgraph 导入较慢，推迟到首次编译代理时"""
+    from deepagents import create_deep_agent as _create_deep_agent
+    return _create_deep_agent(*args, **kwargs)
+
+
+AGENT_NAMES = {"research": "研究代理", "critique": "评审代理", "general": "通用代理"}
+
 
 class DeepAgentManager:
     """Deep Agent 管理器 - 基于 research_agent.py 的实现"""
@@ -45,20 +54,48 @@ class DeepAgentManager:
         self.custom_api_key = os.getenv("CUSTOM_API_KEY")
         self.tavily_api_key = os.getenv("TAVILY_API_KEY")
         
-        # 会话管理
-        self.sessions: Dict[str, Dict] = {}
         self.stats = {
             "total_requests": 0,
             "active_sessions": 0,
+            "cancelled_runs": 0,  # 客户端断开后被取消的运行
+            "coalesced_requests": 0,  # 合并到相同进行中运行的请求
             "last_activity": None
         }
         
         # 添加保护措施
-        self.max_session_history = 20  # 最大会话历史长度
-        self.max_sessions = 100  # 最大会话数量
-        self.session_timeout = 3600  # 会话超时时间（秒）
+        self.max_session_history = int(os.getenv("MAX_SESSION_HISTORY", "20"))  # 最大会话历史长度
+        self.max_sessions = int(os.getenv("MAX_SESSIONS", "100"))  # 最大会话数量
+        self.session_timeout = float(os.getenv("SESSION_TIMEOUT", "3600"))  # 会话超时时间（秒）
+        self.session_cleanup_interval = float(os.getenv("SESSION_CLEANUP_INTERVAL", "60"))  # 过期清理间隔（秒）
+        self._cleanup_task: Optional[asyncio.Task] = None
+        self.disconnect_poll_interval = 1.0  # 流式请求检测客户端断开的间隔（秒）
         
-        # 初始化代理
+        # 单飞：相同代理类型 + 相同消息的无历史请求共享一次进行中的运行
+        self.single_flight_enabled = os.getenv("SINGLE_FLIGHT_ENABLED", "True").lower() == "true"
+        self._stream_flights: Dict[str, StreamFlight] = {}
+        self._call_flights: Dict[str, Tuple[asyncio.Task, str]] = {}  # 键 -> (运行任务, 发起者会话)
+        
+        # 会话管理：SESSION_STORE=sqlite 时可在同一主机的多个 worker 之间共享
+        self.session_store = create_session_store(
+            max_sessions=self.max_sessions,
+            session_timeout=self.session_timeout,
+            max_history=self.max_session_history,
+        )
+        # 多轮记忆：每个会话对应一个 LangGraph 线程，后续提问恢复之前的消息、文件和待办事项
+        self.checkpointer = create_checkpointer()
+        # 运行调度：按代理类型限制并发运行数，超出的请求排队等待
+        self.scheduler = RunScheduler()
+        # 同一轮中并行执行的子代理 task 调用上限
+        self.subagent_max_concurrency = int(os.getenv("SUBAGENT_MAX_CONCURRENCY", "4"))
+        # 服务启动后在后台预编译的代理类型（逗号分隔），其余类型在首次使用时编译
+        self.warmup_agent_types = [
+            name.strip() for name in os.getenv("AGENT_WARMUP", "").split(",") if name.strip()
+        ]
+        self._warmup_task: Optional[asyncio.Task] = None
+        
+        # 注册代理（延迟编译）；摘要器在 _setup_agents 中与代理共用模型实例
+        self.agents = AgentRegistry()
+        self.summarizer = None
         self._setup_agents()
     
     def _setup_agents(self):
@@ -67,127 +104,19 @@ class DeepAgentManager:
         try:
             print("🤖 初始化 Deep Agents...")
             
-            # 创建自定义模型来替代默认的 Anthropic 模型
-            from langchain_core.language_models.chat_models import BaseChatModel
-            from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
-            from langchain_core.outputs import ChatResult, ChatGeneration
-            from langchain_core.callbacks import CallbackManagerForLLMRun
-            from typing import Optional, List, Any
-            import httpx
-            
-            class CustomChatModel(BaseChatModel):
-                """自定义 LangChain 兼容的聊天模型"""
-                
-                def __init__(self, **kwargs):
-                    super().__init__(**kwargs)
-                    # 使用类变量而不是实例变量来避免 Pydantic 验证问题
-                    self._base_url = os.getenv("CUSTOM_API_BASE_URL").rstrip('/')
-                    self._api_key = os.getenv("CUSTOM_API_KEY")
-                    self._model_name = os.getenv("MODEL_NAME", "Qwen3-235B")
-                    # 增加超时时间并设置重试
-                    self._client = httpx.AsyncClient(
-                        timeout=httpx.Timeout(120.0, connect=30.0, read=120.0),
-                        limits=httpx.Limits(max_connections=10, max_keepalive_connections=5)
-                    )
-                
-                @property
-                def _llm_type(self) -> str:
-                    return "custom_chat_model"
-                
-                def bind_tools(self, tools, **kwargs):
-                    """绑定工具 - LangChain 要求的方法"""
-                    # 返回自身，因为我们的模型不需要特殊的工具绑定
-                    return self
-                
-                def _generate(
-                    self,
-                    messages: List[BaseMessage],
-                    stop: Optional[List[str]] = None,
-                    run_manager: Optional[CallbackManagerForLLMRun] = None,
-                    **kwargs: Any,
-                ) -> ChatResult:
-                    """同步生成方法"""
-                    import asyncio
-                    try:
-                        loop = asyncio.get_event_loop()
-                    except RuntimeError:
-                        loop = asyncio.new_event_loop()
-                        asyncio.set_event_loop(loop)
-                    
-                    return loop.run_until_complete(self._agenerate(messages, stop, run_manager, **kwargs))
-                
-                async def _agenerate(
-                    self,
-                    messages: List[BaseMessage],
-                    stop: Optional[List[str]] = None,
-                    run_manager: Optional[CallbackManagerForLLMRun] = None,
-                    **kwargs: Any,
-                ) -> ChatResult:
-                    """异步生成方法"""
-                    try:
-                        # 转换 LangChain 消息格式为 API 格式
-                        formatted_messages = []
-                        for msg in messages:
-                            if isinstance(msg, HumanMessage):
-                                formatted_messages.append({"role": "user", "content": msg.content})
-                            elif isinstance(msg, AIMessage):
-                                formatted_messages.append({"role": "assistant", "content": msg.content})
-                            elif isinstance(msg, SystemMessage):
-                                formatted_messages.append({"role": "system", "content": msg.content})
-                            else:
-                                formatted_messages.append({"role": "user", "content": str(msg.content)})
-                        
-                        # 调用自定义 API，添加重试机制
-                        max_retries = 3
-                        for attempt in range(max_retries):
-                            try:
-                                response = await self._client.post(
-                                    f"{self._base_url}/chat/completions",
-                                    json={
-                                        "messages": formatted_messages,
-                                        "model": self._model_name,
-                                        "temperature": 0.7,
-                                        "max_tokens": 2000,
-                                        "stream": False
-                                    },
-                                    headers={
-                                        "Authorization": f"Bearer {self._api_key}",
-                                        "Content-Type": "application/json"
-                                    }
-                                )
-                                response.raise_for_status()
-                                result = response.json()
-                                break  # 成功则跳出重试循环
-                            except (httpx.ReadTimeout, httpx.ConnectTimeout) as timeout_error:
-                                if attempt < max_retries - 1:
-                                    print(f"API 调用超时，重试 {attempt + 1}/{max_retries}: {timeout_error}")
-                                    await asyncio.sleep(2 ** attempt)  # 指数退避
-                                    continue
-                                else:
-                                    raise timeout_error
-                            except Exception as api_error:
-                                print(f"API 调用错误: {api_error}")
-                                raise api_error
-                        
-                        content = result["choices"][0]["message"]["content"]
-                        
-                        # 返回 LangChain 格式的结果
-                        message = AIMessage(content=content)
-                        generation = ChatGeneration(message=message)
-                        return ChatResult(generations=[generation])
-                        
-                    except Exception as e:
-                        import traceback
-                        error_details = traceback.format_exc()
-                        print(f"自定义模型调用失败: {e}")
-                        print(f"错误详情: {error_details}")
-                        # 返回错误消息
-                        error_message = AIMessage(content=f"抱歉，生成回答时出现错误：{str(e)}")
-                        generation = ChatGeneration(message=error_message)
-                        return ChatResult(generations=[generation])
-            
-            # 创建自定义模型实例
-            custom_model = CustomChatModel()
+            # 创建自定义模型来替代默认的 Anthropic 模型；LLM 响应缓存可按代理类型关闭
+            cache_disabled_agents = {
+                name.strip() for name in os.getenv("LLM_CACHE_DISABLED_AGENTS", "").split(",") if name.strip()
+            }
+
+            # 缓存设置相同的代理共用一个模型实例，子代理图才能在父代理之间共享
+            models: Dict[bool, CustomChatModel] = {}
+
+            def create_model(agent_type: str) -> CustomChatModel:
+                use_response_cache = agent_type not in cache_disabled_agents
+                if use_response_cache not in models:
+                    models[use_response_cache] = CustomChatModel(use_response_cache=use_response_cache)
+                return models[use_response_cache]
             
             # Sub-agent prompts - 直接从 research_agent.py 复制
             sub_research_prompt = """You are a dedicated researcher. Your job is to conduct thorough, comprehensive research based on the user's questions.
@@ -243,13 +172,10 @@ Things to check:
                 "prompt": sub_critique_prompt,
             }
 
-            # Research instructions - 添加当前时间信息
-            current_time = datetime.now().strftime("%Y年%m月%d日 %H:%M:%S")
-            current_date = datetime.now().strftime("%Y-%m-%d")
-            
-            research_instructions = f"""You are an expert researcher. Your job is to conduct thorough research and provide comprehensive answers directly to users.
+            # Research instructions - 静态文本作为可缓存的提示前缀，当前日期由 current_date_context 每次运行注入
+            research_instructions = """You are an expert researcher. Your job is to conduct thorough research and provide comprehensive answers directly to users.
 
-IMPORTANT: Current date and time is {current_time} (Beijing Time). When users ask for "today's news", "latest", "recent", or "current" information, they are referring to information from {current_date} or very recent dates. Make sure to search for and prioritize the most recent information available.
+IMPORTANT: The current date (Beijing Time) is given in the system message that follows these instructions. When users ask for "today's news", "latest", "recent", or "current" information, they are referring to information from that date or very recent dates. Make sure to search for and prioritize the most recent information available.
 
 CRITICAL: You must provide your final answer directly to the user. Do not mention any internal processes, file operations, or system instructions. Simply provide a comprehensive, well-researched answer.
 
@@ -343,18 +269,28 @@ You have access to a few tools.
 Use this to run an internet search for a given query. You can specify the number of results, the topic, and whether raw content should be included.
 """
 
-            # 创建研究代理 - 完全参照 research_agent.py
-            self.research_agent = create_deep_agent(
+            # 指标和追踪回调挂在每个代理及其子代理上
+            callbacks = [metrics_callback] + ([tracer] if tracer is not None else [])
+            # 编译好的子代理图在父代理之间共享（如研究代理和评审代理共用 research-agent）
+            subagent_graphs: Dict[Any, Any] = {}
+            
+            # 研究代理 - 完全参照 research_agent.py
+            self.agents.register("research", lambda: create_deep_agent(
                 [internet_search],
                 research_instructions,
-                model=custom_model,
+                model=create_model("research"),
                 subagents=[critique_sub_agent, research_sub_agent],
-            ).with_config({"recursion_limit": 1000})
+                max_concurrency=self.subagent_max_concurrency,
+                callbacks=callbacks,
+                subagent_graphs=subagent_graphs,
+                context=current_date_context,
+                checkpointer=self.checkpointer,
+            ).with_config({"recursion_limit": 1000}))
             
             # 创建评审代理
-            critique_instructions = f"""You are a professional editor and reviewer. Your task is to analyze and improve content quality.
+            critique_instructions = """You are a professional editor and reviewer. Your task is to analyze and improve content quality.
 
-IMPORTANT: Current date and time is {current_time} (Beijing Time). When reviewing content, consider the timeliness and relevance of information.
+IMPORTANT: The current date (Beijing Time) is given in the system message that follows these instructions. When reviewing content, consider the timeliness and relevance of information.
 
 Check the following aspects:
 - Content accuracy and completeness
@@ -364,72 +300,159 @@ Check the following aspects:
 
 Provide constructive improvement suggestions and detailed analysis."""
 
-            self.critique_agent = create_deep_agent(
+            self.agents.register("critique", lambda: create_deep_agent(
                 [internet_search],
                 critique_instructions,
-                model=custom_model,
+                model=create_model("critique"),
                 subagents=[research_sub_agent],
-            ).with_config({"recursion_limit": 1000})
+                max_concurrency=self.subagent_max_concurrency,
+                callbacks=callbacks,
+                subagent_graphs=subagent_graphs,
+                context=current_date_context,
+                checkpointer=self.checkpointer,
+            ).with_config({"recursion_limit": 1000}))
             
-            # 创建通用代理
-            general_instructions = f"""You are a friendly, professional AI assistant. You can answer various questions, provide useful advice and information, help solve problems, and engage in meaningful conversations.
+            # 通用代理
+            general_instructions = """You are a friendly, professional AI assistant. You can answer various questions, provide useful advice and information, help solve problems, and engage in meaningful conversations.
 
-IMPORTANT: Current date and time is {current_time} (Beijing Time). When users ask about "today", "now", "recent", or "latest" information, they are referring to {current_date} or very recent dates.
+IMPORTANT: The current date (Beijing Time) is given in the system message that follows these instructions. When users ask about "today", "now", "recent", or "latest" information, they are referring to that date or very recent dates.
 
 Please communicate with users in a friendly and professional tone, providing accurate and valuable information."""
 
-            self.general_agent = create_deep_agent(
+            self.agents.register("general", lambda: create_deep_agent(
                 [internet_search],
                 general_instructions,
-                model=custom_model,
-            ).with_config({"recursion_limit": 1000})
+                model=create_model("general"),
+                max_concurrency=self.subagent_max_concurrency,
+                callbacks=callbacks,
+                subagent_graphs=subagent_graphs,
+                context=current_date_context,
+                checkpointer=self.checkpointer,
+            ).with_config({"recursion_limit": 1000}))
             
-            print("✓ Deep Agents 初始化成功")
+            # 较早的轮次在后台合并为滚动摘要，每次请求的提示长度不随对话变长
+            if self.checkpointer is not None:
+                self.summarizer = create_summarizer(create_model("summary"))
+            
+            print(f"✓ Deep Agents 已注册: {', '.join(self.agents.types())}（首次使用时编译）")
             
         except Exception as e:
+            # 未注册的代理类型在使用时视为不可用
             print(f"❌ Deep Agents 初始化失败: {e}")
             import traceback
             print(f"错误详情: {traceback.format_exc()}")
-            # 如果 deepagents 初始化失败，设置为 None
-            self.research_agent = None
-            self.critique_agent = None
-            self.general_agent = None
+    
+    async def _flight_key(self, message: str, session_id: str, agent_type: str) -> Optional[str]:
+        """可合并请求的键；会话已有历史的请求上下文不同，不参与合并"""
+        if not self.single_flight_enabled or await self.session_store.aget_history(session_id):
+            return None
+        return flight_key(agent_type, message)
+    
+    def _run_config(self, run_id: uuid.UUID, session_id: str) -> Dict[str, Any]:
+        """代理运行配置；启用检查点时以会话 ID 作为线程 ID"""
+        if self.checkpointer is None:
+            return {"run_id": run_id}
+        return {"run_id": run_id, **thread_config(session_id)}
+    
+    async def _prepare_thread(self, agent, session_id: str):
+        """
+        运行前补全上一次运行（被取消或出错）遗留的没有结果的工具调用
+
+        上一次运行可能在其他 worker 或重启前的进程中，因此每次都检查；线程不存在时只是一次读取。
+        """
+        if self.checkpointer is None:
+            return
+        closed = await close_dangling_tool_calls(agent, session_id)
+        if closed:
+            print(f"🩹 会话 {session_id} 补全了 {closed} 个未完成的工具调用")
+    
+    async def _ensure_session(self, session_id: str):
+        """确保会话存在并更新活动时间（超出容量时由存储淘汰最旧的会话）；新会话不继承同名旧线程"""
+        if await self.session_store.aensure(session_id):
+            self.stats["active_sessions"] = await self.session_store.acount()
+            await self._forget_thread(session_id)
+    
+    def _summary_guard(self, agent, session_id: str):
+        """包裹一次代理运行：运行期间摘要不写入线程，运行结束后在后台更新会话摘要"""
+        if self.summarizer is None:
+            return nullcontext()
+        return self.summarizer.run(agent, thread_config(session_id), session_id)
+    
+    async def _forget_thread(self, session_id: str):
+        """删除会话对应的检查点线程"""
+        if self.summarizer is not None:
+            self.summarizer.cancel(session_id)
+        if self.checkpointer is not None:
+            await delete_thread(self.checkpointer, session_id)
+    
+    async def _prune_threads(self):
+        """删除会话已过期或被淘汰的线程；遍历检查点中的全部线程，包括其他 worker 或之前的进程创建的"""
+        if self.checkpointer is None:
+            return
+        for session_id in await list_threads(self.checkpointer):
+            if not await self.session_store.aexists(session_id):
+                await self._forget_thread(session_id)
+    
+    async def _join_flight(self, message: str, session_id: str, agent_type: str):
+        """跟随者加入已有运行：刷新自己的会话，并计入合并统计"""
+        self.stats["coalesced_requests"] += 1
+        REQUESTS_COALESCED.inc(agent_type=getattr(agent_type, "value", agent_type))
+        if await self.session_store.aensure(session_id):
+            self.stats["active_sessions"] = await self.session_store.acount()
+        print(f"🔗 合并到进行中的相同请求: {message[:50]}...")
+    
+    async def _follow_leader(self, session_id: str, message: str, assistant_message: str, leader_session_id: str):
+        """运行只写入发起者的会话，跟随者在拿到最终回答后写入自己的会话历史，并复制发起者的线程"""
+        await self.session_store.aappend_history(session_id, [
+            {"role": "user", "content": message},
+            {"role": "assistant", "content": assistant_message}
+        ])
+        if self.checkpointer is not None and session_id != leader_session_id:
+            try:
+                await copy_thread(self.checkpointer, leader_session_id, session_id)
+            except Exception as e:
+                print(f"⚠️ 复制会话线程失败: {e}")
     
     async def process_message(self, message: str, session_id: str = "default", agent_type: str = "research") -> Dict[str, Any]:
-        """处理消息"""
+        """处理消息；队列已满时抛出 QueueFullError，排队超时抛出 QueueTimeoutError"""
+        key = await self._flight_key(message, session_id, agent_type)
+        flight = self._call_flights.get(key) if key else None
+        if flight is None:
+            task = asyncio.create_task(self._admitted_process(message, session_id, agent_type))
+            if key:
+                self._call_flights[key] = (task, session_id)
+                task.add_done_callback(lambda _: self._call_flights.pop(key, None))
+            return await asyncio.shield(task)
+        
+        task, leader_session_id = flight
+        await self._join_flight(message, session_id, agent_type)
+        result = await asyncio.shield(task)
+        await self._follow_leader(session_id, message, result["message"], leader_session_id)
+        return result
+    
+    async def _admitted_process(self, message: str, session_id: str, agent_type: str) -> Dict[str, Any]:
+        """经过运行调度后处理消息"""
+        label = getattr(agent_type, "value", agent_type)
+        slot = self.scheduler.reserve(agent_type)
+        try:
+            with QUEUE_WAIT_SECONDS.time(agent_type=label):
+                await slot.acquire()
+            with RUN_SECONDS.time(agent_type=label, mode="invoke"):
+                return await self._process_message(message, session_id, agent_type)
+        finally:
+            slot.release()
+    
+    async def _process_message(self, message: str, session_id: str, agent_type: str) -> Dict[str, Any]:
+        """处理消息（已获得执行名额）"""
         self.stats["total_requests"] += 1
         self.stats["last_activity"] = datetime.now().isoformat()
         
-        # 清理过期会话
-        self._cleanup_expired_sessions()
-        
-        # 确保会话存在
-        if session_id not in self.sessions:
-            # 如果会话数量过多，清理最旧的会话
-            if len(self.sessions) >= self.max_sessions:
-                oldest_session = min(self.sessions.keys(), 
-                                   key=lambda k: self.sessions[k]["created_at"])
-                del self.sessions[oldest_session]
-            
-            self.sessions[session_id] = {
-                "history": [],
-                "created_at": datetime.now().isoformat(),
-                "last_activity": datetime.now().isoformat()
-            }
-            self.stats["active_sessions"] = len(self.sessions)
-        
-        # 更新会话活动时间
-        self.sessions[session_id]["last_activity"] = datetime.now().isoformat()
+        # 确保会话存在并更新会话活动时间（超出容量时由存储淘汰最旧的会话）
+        await self._ensure_session(session_id)
         
         try:
-            # 选择对应的代理
-            agent = None
-            if agent_type == "research" and self.research_agent:
-                agent = self.research_agent
-            elif agent_type == "critique" and self.critique_agent:
-                agent = self.critique_agent
-            elif agent_type == "general" and self.general_agent:
-                agent = self.general_agent
+            # 选择对应的代理（首次使用时编译）
+            agent = await self.agents.aget(agent_type)
             
             # 如果有可用的 deepagent，使用它
             if agent:
@@ -439,13 +462,15 @@ Please communicate with users in a friendly and professional tone, providing acc
                     # 使用 deepagent 处理消息
                     from langchain_core.messages import HumanMessage
                     
-                    # 创建初始状态
+                    # 创建初始状态（会话线程中之前的消息、文件和待办事项由检查点恢复）
                     initial_state = {"messages": [HumanMessage(content=message)]}
                     
-                    # 调用代理（同步方式，因为 deepagents 可能不支持异步）
-                    import asyncio
-                    loop = asyncio.get_event_loop()
-                    result = await loop.run_in_executor(None, agent.invoke, initial_state)
+                    # 在当前事件循环中异步执行代理，不占用线程池；run_id 用于查询追踪
+                    # 检查点只在运行结束时写入一次，不保存中间步骤
+                    run_id = uuid.uuid4()
+                    await self._prepare_thread(agent, session_id)
+                    with self._summary_guard(agent, session_id):
+                        result = await agent.ainvoke(initial_state, self._run_config(run_id, session_id), durability="exit")
                     
                     # 提取响应 - 寻找最终的人类可读响应
                     assistant_message = ""
@@ -470,70 +495,30 @@ Please communicate with users in a friendly and professional tone, providing acc
                         assistant_message = "代理处理完成，但未返回具体内容。"
                     
                     # 清理响应内容，移除工具调用和内部指令相关的内容
+                    sanitize_started = time.perf_counter()
                     if assistant_message:
-                        import re
-                        
-                        # 移除内部指令相关的内容
-                        internal_patterns = [
-                            r'写入.*?\.txt.*?文件.*?中',
-                            r'将.*?写入.*?文件',
-                            r'写入.*?文件',
-                            r'保存到.*?文件',
-                            r'创建.*?文件',
-                            r'question\.txt',
-                            r'final_report\.md',
-                            r'使用.*?代理',
-                            r'调用.*?代理',
-                            r'research-agent',
-                            r'critique-agent',
-                        ]
-                        
-                        for pattern in internal_patterns:
-                            assistant_message = re.sub(pattern, '', assistant_message, flags=re.IGNORECASE)
-                        
-                        # 移除 Python 代码块
-                        assistant_message = re.sub(r'```python.*?```', '', assistant_message, flags=re.DOTALL)
-                        # 移除其他代码块
-                        assistant_message = re.sub(r'```.*?```', '', assistant_message, flags=re.DOTALL)
-                        # 移除单行代码
-                        assistant_message = re.sub(r'`[^`]*`', '', assistant_message)
-                        
-                        # 移除以特定词开头的句子（通常是内部指令）
-                        lines = assistant_message.split('\n')
-                        filtered_lines = []
-                        for line in lines:
-                            line = line.strip()
-                            if line and not any(line.startswith(prefix) for prefix in [
-                                '将原始用户问题', '写入', '保存', '创建', '调用', '使用'
-                            ]):
-                                filtered_lines.append(line)
-                        
-                        assistant_message = '\n'.join(filtered_lines)
-                        
-                        # 清理多余的空行
-                        assistant_message = re.sub(r'\n\s*\n', '\n\n', assistant_message.strip())
+                        assistant_message = sanitize(assistant_message)
                         
                         # 如果清理后内容为空或太短，提供默认回复
                         if not assistant_message or len(assistant_message.strip()) < 10:
                             assistant_message = "我正在为您分析这个问题，请稍等片刻..."
+                    SANITIZE_SECONDS.observe(time.perf_counter() - sanitize_started, mode="invoke")
                     
-                    # 更新会话历史，限制长度
-                    self.sessions[session_id]["history"].extend([
+                    # 更新会话历史（存储内部截断到 max_session_history）
+                    await self.session_store.aappend_history(session_id, [
                         {"role": "user", "content": message},
                         {"role": "assistant", "content": assistant_message}
                     ])
                     
-                    # 限制会话历史长度
-                    if len(self.sessions[session_id]["history"]) > self.max_session_history:
-                        self.sessions[session_id]["history"] = self.sessions[session_id]["history"][-self.max_session_history:]
-                    
                     return {
                         "message": assistant_message,
                         "agent_type": agent_type,
-                        "sources": []
+                        "sources": [],
+                        "run_id": str(run_id)
                     }
                     
                 except Exception as e:
+                    ERRORS.inc(component="agent")
                     print(f"DeepAgent 处理失败，回退到简化模式: {e}")
                     import traceback
                     print(f"错误详情: {traceback.format_exc()}")
@@ -545,7 +530,7 @@ Please communicate with users in a friendly and professional tone, providing acc
             ]
             
             # 添加历史对话
-            session_history = self.sessions[session_id]["history"]
+            session_history = await self.session_store.aget_history(session_id)
             if session_history:
                 # 只添加最近的对话历史，避免上下文过长
                 recent_history = session_history[-8:]  # 最近4轮对话（8条消息）
@@ -567,7 +552,7 @@ Please communicate with users in a friendly and professional tone, providing acc
                     max_retries = 2
                     for attempt in range(max_retries + 1):
                         try:
-                            search_results = internet_search(message, max_results=10)
+                            search_results = await internet_search.ainvoke({"query": message, "max_results": 10})
                             print(f"🔍 搜索结果类型: {type(search_results)}, 内容: {search_results}")
                             break
                         except Exception as search_error:
@@ -604,16 +589,12 @@ Please communicate with users in a friendly and professional tone, providing acc
             
 
             
-            # 更新会话历史，限制长度
-            self.sessions[session_id]["history"].extend([
+            # 更新会话历史（存储内部截断到 max_session_history）
+            await self.session_store.aappend_history(session_id, [
                 {"role": "user", "content": message},
                 {"role": "assistant", "content": assistant_message}
             ])
             
-            # 限制会话历史长度
-            if len(self.sessions[session_id]["history"]) > self.max_session_history:
-                self.sessions[session_id]["history"] = self.sessions[session_id]["history"][-self.max_session_history:]
-            
             # 格式化源信息
             sources = []
             try:
@@ -653,8 +634,106 @@ Please communicate with users in a friendly and professional tone, providing acc
                 "sources": []
             }
     
-    async def stream_message(self, message: str, session_id: str = "default", agent_type: str = "research") -> AsyncGenerator[Dict[str, Any], None]:
-        """流式处理消息"""
+    async def stream_message(
+        self,
+        message: str,
+        session_id: str = "default",
+        agent_type: str = "research",
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """流式处理消息
+
+        代理运行在独立任务中，事件经队列转发。相同的无历史请求订阅同一次运行，
+        中途加入的请求会先回放已发布的事件。is_disconnected 返回 True（客户端关闭页面或点击停止）
+        或调用方关闭本生成器时退订；所有订阅者都离开后取消运行，取消会传递到进行中的
+        模型/搜索 HTTP 请求和子代理 task 调用。
+        """
+        requested_at = time.perf_counter()
+        first_content = True
+        key = await self._flight_key(message, session_id, agent_type)
+        flight = self._stream_flights.get(key) if key else None
+        leader = flight is None
+        if leader:
+            flight = StreamFlight(key, session_id)
+            flight.task = asyncio.create_task(self._produce_events(flight, message, session_id, agent_type))
+            if key:
+                self._stream_flights[key] = flight
+        else:
+            await self._join_flight(message, session_id, agent_type)
+        
+        queue = flight.subscribe()
+        try:
+            while True:
+                if queue.empty():
+                    try:
+                        event = await asyncio.wait_for(queue.get(), self.disconnect_poll_interval)
+                    except asyncio.TimeoutError:
+                        if is_disconnected is not None and await is_disconnected():
+                            break
+                        continue
+                else:
+                    event = queue.get_nowait()
+                if event is None:
+                    break
+                if first_content and event.get("type") == "content":
+                    first_content = False
+                    TIME_TO_FIRST_EVENT_SECONDS.observe(
+                        time.perf_counter() - requested_at, agent_type=getattr(agent_type, "value", agent_type)
+                    )
+                if not leader and event.get("type") == "complete" and event.get("content"):
+                    await self._follow_leader(session_id, message, event["content"], flight.session_id)
+                yield event
+        finally:
+            flight.unsubscribe(queue)
+            if not flight.subscribers and not flight.task.done():
+                flight.task.cancel()
+                self._drop_flight(flight)
+                self.stats["cancelled_runs"] += 1
+                RUNS_CANCELLED.inc(agent_type=getattr(agent_type, "value", agent_type))
+                print(f"🛑 客户端已断开，取消运行: {session_id}")
+                # 等待运行退出：检查点在退出时写入，同一会话紧接着的下一次请求才能看到这一轮
+                await asyncio.gather(flight.task, return_exceptions=True)
+    
+    def _drop_flight(self, flight: StreamFlight):
+        if flight.key and self._stream_flights.get(flight.key) is flight:
+            del self._stream_flights[flight.key]
+    
+    async def _produce_events(self, flight: StreamFlight, message: str, session_id: str, agent_type: str):
+        """运行代理并把事件广播给所有订阅者，结束时发送 None"""
+        try:
+            async for event in self._admitted_stream(message, session_id, agent_type):
+                flight.publish(event)
+        except Exception as e:
+            ERRORS.inc(component="agent")
+            flight.publish({"type": "error", "message": f"💥 系统错误：{str(e)}"})
+        finally:
+            self._drop_flight(flight)
+            flight.finish()
+    
+    async def _admitted_stream(self, message: str, session_id: str, agent_type: str) -> AsyncGenerator[Dict[str, Any], None]:
+        """经过运行调度后流式处理消息；排队期间通过 queued 事件报告队列位置"""
+        label = getattr(agent_type, "value", agent_type)
+        try:
+            slot = self.scheduler.reserve(agent_type)
+        except QueueFullError as e:
+            yield {"type": "error", "message": f"⏳ {e}", "retry_after": e.retry_after}
+            return
+        try:
+            try:
+                with QUEUE_WAIT_SECONDS.time(agent_type=label):
+                    async for position in slot.wait_positions():
+                        yield {"type": "queued", "message": f"⏳ 排队中，前方还有 {position - 1} 个请求...", "position": position}
+            except QueueTimeoutError as e:
+                yield {"type": "error", "message": f"⏳ {e}", "retry_after": e.retry_after}
+                return
+            with RUN_SECONDS.time(agent_type=label, mode="stream"):
+                async for event in self._stream_message(message, session_id, agent_type):
+                    yield event
+        finally:
+            slot.release()
+    
+    async def _stream_message(self, message: str, session_id: str, agent_type: str) -> AsyncGenerator[Dict[str, Any], None]:
+        """流式处理消息（已获得执行名额）"""
         try:
             print(f"🚀 开始流式处理消息: {message[:50]}...")
             
@@ -662,40 +741,22 @@ Please communicate with users in a friendly and professional tone, providing acc
             self.stats["total_requests"] += 1
             self.stats["last_activity"] = datetime.now().isoformat()
             
-            # 先发送开始信号
-            yield {"type": "start", "message": "🤖 Deep Agent 正在启动..."}
-            await asyncio.sleep(0.5)
+            # 先发送开始信号；run_id 用于查询本次运行的追踪
+            run_id = uuid.uuid4()
+            yield {"type": "start", "message": "🤖 Deep Agent 正在启动...", "run_id": str(run_id)}
             
-            # 初始化会话
-            if session_id not in self.sessions:
-                self.sessions[session_id] = {
-                    "history": [],
-                    "created_at": datetime.now().isoformat(),
-                    "last_activity": datetime.now().isoformat()
-                }
-                self.stats["active_sessions"] = len(self.sessions)
-            
-            self.sessions[session_id]["last_activity"] = datetime.now().isoformat()
-            
-            # 选择代理
-            agent = None
-            agent_name = ""
-            if agent_type == "research" and self.research_agent:
-                agent = self.research_agent
-                agent_name = "研究代理"
-            elif agent_type == "critique" and self.critique_agent:
-                agent = self.critique_agent
-                agent_name = "评审代理"
-            elif agent_type == "general" and self.general_agent:
-                agent = self.general_agent
-                agent_name = "通用代理"
+            # 初始化会话并更新活动时间
+            await self._ensure_session(session_id)
+            
+            # 选择代理（首次使用时编译）
+            agent = await self.agents.aget(agent_type)
+            agent_name = AGENT_NAMES.get(getattr(agent_type, "value", agent_type), str(agent_type))
             
             if not agent:
                 yield {"type": "error", "message": f"❌ {agent_name} 不可用，请检查系统配置"}
                 return
             
             yield {"type": "agent_selected", "message": f"✅ 已选择 {agent_name}"}
-            await asyncio.sleep(0.3)
             
             # 智能判断是否需要搜索
             needs_search = (
@@ -716,7 +777,7 @@ Please communicate with users in a friendly and professional tone, providing acc
                 max_retries = 2
                 for attempt in range(max_retries + 1):
                     try:
-                        search_results = internet_search(message, max_results=10)
+                        search_results = await internet_search.ainvoke({"query": message, "max_results": 10})
                         print(f"✅ 搜索成功，获得结果: {type(search_results)}")
                         break
                     except Exception as search_error:
@@ -743,8 +804,6 @@ Please communicate with users in a friendly and professional tone, providing acc
                     print(f"📊 搜索结果统计: {result_count} 条")
                 else:
                     yield {"type": "search_empty", "message": "📭 未找到相关信息，将基于已有知识回答"}
-                
-                await asyncio.sleep(0.5)
             
             # 开始深度分析
             yield {"type": "analyzing", "message": "🧠 正在进行深度分析..."}
@@ -752,18 +811,52 @@ Please communicate with users in a friendly and professional tone, providing acc
             
             try:
                 # 使用 deepagent 处理消息
-                from langchain_core.messages import HumanMessage
+                from langchain_core.messages import HumanMessage, AIMessage
                 
-                # 创建初始状态
+                # 创建初始状态（会话线程中之前的消息、文件和待办事项由检查点恢复）
                 initial_state = {"messages": [HumanMessage(content=message)]}
                 
                 yield {"type": "agent_thinking", "message": "🤔 Deep Agent 正在思考..."}
                 
-                # 调用代理（在线程池中执行以避免阻塞）
-                loop = asyncio.get_event_loop()
-                
                 print(f"🔄 调用 Deep Agent...")
-                result = await loop.run_in_executor(None, agent.invoke, initial_state)
+                await self._prepare_thread(agent, session_id)
+                result = {}
+                streamed_length = 0  # 当前轮次已转发的 token 字符数
+                current_turn = None
+                live_sanitizer = StreamSanitizer()  # 实时移除 token 流中的代码块
+                # 同时订阅 token 流和状态流：token 实时转发，状态用于提取最终回答
+                with self._summary_guard(agent, session_id):
+                    async for mode, payload in agent.astream(
+                        initial_state, self._run_config(run_id, session_id), stream_mode=["messages", "values"], durability="exit"
+                    ):
+                        if mode == "values":
+                            result = payload
+                            continue
+                    
+                        chunk, metadata = payload
+                        # 只转发主代理 agent 节点的输出，跳过工具结果和子代理的内部 token
+                        if metadata.get("langgraph_node") != "agent" or "|" in metadata.get("langgraph_checkpoint_ns", ""):
+                            continue
+                        if not isinstance(chunk, AIMessage) or not isinstance(chunk.content, str) or not chunk.content:
+                            continue
+                    
+                        # 新的模型轮次开始：上一轮只是中间步骤（如工具调用），通知前端丢弃已显示内容
+                        if chunk.id != current_turn:
+                            if streamed_length:
+                                yield {"type": "content_reset", "message": ""}
+                            elif current_turn is None:
+                                yield {"type": "generating", "message": "✍️ 正在生成回答..."}
+                            current_turn = chunk.id
+                            streamed_length = 0
+                            live_sanitizer = StreamSanitizer()
+                    
+                        streamed_length += len(chunk.content)
+                        text = live_sanitizer.feed(chunk.content)
+                        if text:
+                            yield {"type": "content", "message": text, "sources": []}
+                text = live_sanitizer.flush()
+                if text:
+                    yield {"type": "content", "message": text, "sources": []}
                 print(f"✅ Deep Agent 处理完成")
                 
                 yield {"type": "processing_complete", "message": "✅ 分析完成，正在整理回答..."}
@@ -797,38 +890,21 @@ Please communicate with users in a friendly and professional tone, providing acc
                     print(f"⚠️ 未找到有效消息")
                 
                 # 清理响应内容
+                sanitize_started = time.perf_counter()
                 if assistant_message:
-                    import re
                     original_length = len(assistant_message)
-                    # 移除工具调用相关的内容
-                    assistant_message = re.sub(r'```python[^`]*```', '', assistant_message)
-                    assistant_message = re.sub(r'```[^`]*```', '', assistant_message)
-                    assistant_message = re.sub(r'`[^`\n]*`', '', assistant_message)
-                    # 清理多余的空行
-                    assistant_message = re.sub(r'\n\s*\n', '\n\n', assistant_message.strip())
+                    assistant_message = sanitize(assistant_message)
                     print(f"🧹 内容清理: {original_length} -> {len(assistant_message)} 字符")
+                SANITIZE_SECONDS.observe(time.perf_counter() - sanitize_started, mode="stream")
                 
                 if not assistant_message or len(assistant_message.strip()) < 10:
                     assistant_message = "抱歉，生成的回答内容不完整。请尝试重新提问或换个方式描述您的问题。"
                     print(f"⚠️ 回答内容过短，使用默认消息")
                 
-                # 分块发送响应，模拟打字效果
-                yield {"type": "generating", "message": "✍️ 正在生成回答..."}
-                
-                chunk_size = 100  # 增大块大小以提高效率
-                total_chunks = (len(assistant_message) + chunk_size - 1) // chunk_size
-                
-                for i in range(0, len(assistant_message), chunk_size):
-                    chunk = assistant_message[i:i + chunk_size]
-                    chunk_num = i // chunk_size + 1
-                    
-                    yield {
-                        "type": "content",
-                        "message": chunk,
-                        "progress": f"{chunk_num}/{total_chunks}",
-                        "sources": []
-                    }
-                    await asyncio.sleep(0.05)  # 减少延迟以提高响应速度
+                # 模型未以流式返回时（如上游不支持 stream），一次性发送完整回答
+                if current_turn is None:
+                    yield {"type": "generating", "message": "✍️ 正在生成回答..."}
+                    yield {"type": "content", "message": assistant_message, "sources": []}
                 
                 # 处理搜索来源
                 sources = []
@@ -854,21 +930,19 @@ Please communicate with users in a friendly and professional tone, providing acc
                     print(f"⚠️ 处理搜索结果时出错: {e}")
                     sources = []
                 
-                # 更新会话历史
-                self.sessions[session_id]["history"].extend([
+                # 更新会话历史（存储内部截断到 max_session_history）
+                await self.session_store.aappend_history(session_id, [
                     {"role": "user", "content": message},
                     {"role": "assistant", "content": assistant_message}
                 ])
                 
-                # 限制会话历史长度
-                if len(self.sessions[session_id]["history"]) > self.max_session_history:
-                    self.sessions[session_id]["history"] = self.sessions[session_id]["history"][-self.max_session_history:]
-                
                 # 发送完成信号
                 yield {
                     "type": "complete", 
                     "message": "🎉 回答完成！",
+                    "content": assistant_message,  # 清理后的完整回答，替换流式过程中的原始 token
                     "sources": sources,
+                    "run_id": str(run_id),
                     "stats": {
                         "response_length": len(assistant_message),
                         "search_results": len(sources),
@@ -879,6 +953,7 @@ Please communicate with users in a friendly and professional tone, providing acc
                 print(f"✅ 流式处理完成: {len(assistant_message)} 字符, {len(sources)} 个来源")
                 
             except Exception as agent_error:
+                ERRORS.inc(component="agent")
                 import traceback
                 error_details = traceback.format_exc()
                 print(f"❌ Deep Agent 处理失败: {agent_error}")
@@ -948,50 +1023,98 @@ Please communicate with users in a friendly and professional tone, providing acc
     async def get_status(self) -> Dict[str, Any]:
         """获取系统状态"""
         return {
-            "active_sessions": len(self.sessions),
+            "active_sessions": await self.session_store.acount(),
             "total_requests": self.stats["total_requests"],
+            "cancelled_runs": self.stats["cancelled_runs"],
+            "coalesced_requests": self.stats["coalesced_requests"],
             "api_status": {
                 "custom_api": bool(self.custom_api_base and self.custom_api_key),
                 "tavily_api": bool(self.tavily_api_key)
             },
+            "search_cache": search_cache.stats() if search_cache is not None else None,
+            "llm_cache": response_cache_stats(),
+            "cassette": cassette.stats() if cassette.enabled else None,
+            "scheduler": self.scheduler.stats(),
+            "agents": self.agents.stats(),
+            "checkpointer": {
+                "type": type(self.checkpointer).__name__,
+                "threads": len(await list_threads(self.checkpointer)),
+            } if self.checkpointer is not None else None,
+            "summarizer": self.summarizer.stats() if self.summarizer is not None else None,
             "last_activity": self.stats["last_activity"]
         }
     
-    def _cleanup_expired_sessions(self):
+    async def _cleanup_expired_sessions(self):
         """清理过期会话"""
         try:
-            current_time = datetime.now()
-            expired_sessions = []
-            
-            for session_id, session_data in self.sessions.items():
-                try:
-                    last_activity = datetime.fromisoformat(session_data.get("last_activity", session_data["created_at"]))
-                    if (current_time - last_activity).total_seconds() > self.session_timeout:
-                        expired_sessions.append(session_id)
-                except Exception:
-                    # 如果时间解析失败，也标记为过期
-                    expired_sessions.append(session_id)
-            
-            for session_id in expired_sessions:
-                del self.sessions[session_id]
-            
-            if expired_sessions:
-                print(f"🧹 清理了 {len(expired_sessions)} 个过期会话")
-                self.stats["active_sessions"] = len(self.sessions)
-                
+            expired_count = await self.session_store.acleanup_expired()
+            if expired_count:
+                print(f"🧹 清理了 {expired_count} 个过期会话")
+                self.stats["active_sessions"] = await self.session_store.acount()
         except Exception as e:
             print(f"清理过期会话时出错: {e}")
     
+    async def _session_cleanup_loop(self):
+        """后台定期清理过期会话，不占用请求路径"""
+        while True:
+            await asyncio.sleep(self.session_cleanup_interval)
+            await self._cleanup_expired_sessions()
+            try:
+                await self._prune_threads()
+            except Exception as e:
+                print(f"清理会话线程时出错: {e}")
+    
+    def start_session_cleanup(self):
+        """在当前事件循环中启动后台会话清理任务"""
+        if self._cleanup_task is None or self._cleanup_task.done():
+            self._cleanup_task = asyncio.create_task(self._session_cleanup_loop())
+    
+    async def stop_session_cleanup(self):
+        """停止后台会话清理任务"""
+        if self._cleanup_task is not None:
+            self._cleanup_task.cancel()
+            try:
+                await self._cleanup_task
+            except asyncio.CancelledError:
+                pass
+            self._cleanup_task = None
+    
+    def start_warmup(self):
+        """在后台预编译 AGENT_WARMUP 中的代理类型，不阻塞服务启动"""
+        if self.warmup_agent_types and (self._warmup_task is None or self._warmup_task.done()):
+            print(f"🔥 后台预热代理: {', '.join(self.warmup_agent_types)}")
+            self._warmup_task = asyncio.create_task(self.agents.warmup(self.warmup_agent_types))
+    
+    async def stop_warmup(self):
+        """停止尚未完成的预热任务"""
+        if self._warmup_task is not None:
+            self._warmup_task.cancel()
+            try:
+                await self._warmup_task
+            except asyncio.CancelledError:
+                pass
+            self._warmup_task = None
+    
     async def reset_session(self, session_id: str):
         """重置会话"""
-        if session_id in self.sessions:
-            del self.sessions[session_id]
-            self.stats["active_sessions"] = len(self.sessions)
+        await self._forget_thread(session_id)
+        if await self.session_store.adelete(session_id):
+            self.stats["active_sessions"] = await self.session_store.acount()
             print(f"🔄 重置会话: {session_id}")
     
     async def cleanup_all_sessions(self):
         """清理所有会话"""
-        session_count = len(self.sessions)
-        self.sessions.clear()
+        session_count = await self.session_store.aclear()
+        if self.checkpointer is not None:
+            for session_id in await list_threads(self.checkpointer):
+                await self._forget_thread(session_id)
         self.stats["active_sessions"] = 0
-        print(f"🧹 清理了所有 {session_count} 个会话")
\ No newline at end of file
+        print(f"🧹 清理了所有 {session_count} 个会话")
+    
+    async def close(self):
+        """停止摘要任务，关闭检查点存储和会话存储"""
+        if self.summarizer is not None:
+            await self.summarizer.stop()
+        if self.checkpointer is not None:
+            await close_checkpointer(self.checkpointer)
+        self.session_store.close()
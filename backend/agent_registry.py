@@ -0,0 +1,72 @@
+import time
+import asyncio
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+class AgentRegistry:
+    """
+    按代理类型延迟编译的代理图注册表
+
+    注册时只保存构造函数，第一次使用某个类型时才编译对应的图并缓存；
+    编译失败不缓存，下次使用时重试。可选地在后台预热指定类型。
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._agents: Dict[str, Any] = {}
+        self._compile_seconds: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _name(agent_type) -> str:
+        return getattr(agent_type, "value", agent_type)
+
+    def register(self, agent_type: str, factory: Callable[[], Any]):
+        self._factories[agent_type] = factory
+
+    def types(self) -> List[str]:
+        return list(self._factories)
+
+    def get(self, agent_type) -> Optional[Any]:
+        """获取代理图，必要时同步编译；类型未注册或编译失败时返回 None"""
+        name = self._name(agent_type)
+        agent = self._agents.get(name)
+        if agent is not None or name not in self._factories:
+            return agent
+        with self._lock:
+            agent = self._agents.get(name)
+            if agent is None:
+                started = time.perf_counter()
+                try:
+                    agent = self._factories[name]()
+                except Exception as e:
+                    import traceback
+                    print(f"❌ 代理 {name} 编译失败: {e}")
+                    print(f"错误详情: {traceback.format_exc()}")
+                    return None
+                self._compile_seconds[name] = time.perf_counter() - started
+                self._agents[name] = agent
+                print(f"✓ 代理 {name} 编译完成 ({self._compile_seconds[name]:.2f}s)")
+        return agent
+
+    async def aget(self, agent_type) -> Optional[Any]:
+        """异步获取代理图；首次编译放到线程中执行，不阻塞事件循环"""
+        agent = self._agents.get(self._name(agent_type))
+        if agent is not None:
+            return agent
+        return await asyncio.to_thread(self.get, agent_type)
+
+    async def warmup(self, agent_types: Iterable[str]):
+        """在后台依次编译指定类型"""
+        for agent_type in agent_types:
+            if agent_type not in self._factories:
+                print(f"⚠️ 预热跳过未知代理类型: {agent_type}")
+                continue
+            await self.aget(agent_type)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "registered": self.types(),
+            "compiled": {name: round(seconds, 3) for name, seconds in self._compile_seconds.items()},
+        }
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class PersistentLRUCache:
+    """带 TTL 的内存 LRU 缓存，可选用本地 SQLite 文件持久化，进程重启后仍可命中
+
+    内存层有条目数上限（以及可选的总字节数上限），按最近使用顺序淘汰；磁盘层保存未过期条目，
+    内存未命中时回源到磁盘并重新放入内存。磁盘层每写入 maintain_every 次清理一次过期条目，
+    并在超出 max_disk_entries 时删除最早过期的条目。值需可 JSON 序列化。
+    事件循环中应使用 aget/aset：内存命中直接返回，磁盘读写和序列化放到线程中执行。
+    """
+
+    # 磁盘层每写入多少次清理一次（两次清理之间条目数可能暂时超出上限）
+    maintain_every = 100
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        db_path: Optional[str] = None,
+        table: str = "cache",
+        max_bytes: Optional[int] = None,
+        max_disk_entries: Optional[int] = None,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_disk_entries = max_disk_entries
+        self.db_path = db_path
+        self.table = table
+        # key -> (expires_at, value, size)，expires_at 为 time.time() 时间戳，size 为序列化后的字节数
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()  # 只保护内存层，持有期间不做磁盘 I/O
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._writes = 0  # 距上次清理磁盘层以来的写入次数
+        self._stats = {"hits": 0, "misses": 0, "disk_hits": 0, "evictions": 0, "disk_evictions": 0}
+
+        if db_path:
+            try:
+                directory = os.path.dirname(db_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} "
+                    "(key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value TEXT NOT NULL)"
+                )
+                self._db.execute(f"CREATE INDEX IF NOT EXISTS {table}_expires_at ON {table} (expires_at)")
+                self._maintain()
+            except Exception as e:
+                print(f"⚠️ 缓存持久化不可用，仅使用内存缓存: {e}")
+                self._db = None
+
+    def _get_memory(self, key: str, now: float) -> tuple:
+        """查内存层，返回 (是否命中, 值)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return True, entry[1]
+                self._remove(key)
+            if self._db is None:
+                self._stats["misses"] += 1
+            return False, None
+
+    def _get_disk(self, key: str, now: float) -> Optional[Any]:
+        """回源到磁盘层，命中时重新放入内存"""
+        try:
+            with self._db_lock:
+                row = self._db.execute(
+                    f"SELECT expires_at, value FROM {self.table} WHERE key = ?", (key,)
+                ).fetchone()
+        except Exception as e:
+            print(f"⚠️ 读取缓存文件失败: {e}")
+            row = None
+        value = json.loads(row[1]) if row is not None and row[0] > now else None
+        with self._lock:
+            if value is None:
+                self._stats["misses"] += 1
+                return None
+            self._put(key, row[0], value, len(row[1].encode("utf-8")))
+            self._stats["hits"] += 1
+            self._stats["disk_hits"] += 1
+        return value
+
+    def get(self, key: str) -> Optional[Any]:
+        """读取缓存，未命中或已过期时返回 None"""
+        now = time.time()
+        found, value = self._get_memory(key, now)
+        if found or self._db is None:
+            return value
+        return self._get_disk(key, now)
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """异步读取缓存：内存命中直接返回，磁盘回源在线程中执行"""
+        now = time.time()
+        found, value = self._get_memory(key, now)
+        if found or self._db is None:
+            return value
+        return await asyncio.to_thread(self._get_disk, key, now)
+
+    def set(self, key: str, value: Any, ttl: float):
+        """写入缓存，ttl 为有效期（秒）"""
+        expires_at = time.time() + ttl
+        serialized = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._put(key, expires_at, value, len(serialized.encode("utf-8")))
+        if self._db is not None:
+            try:
+                with self._db_lock:
+                    self._db.execute(
+                        f"INSERT OR REPLACE INTO {self.table} (key, expires_at, value) VALUES (?, ?, ?)",
+                        (key, expires_at, serialized),
+                    )
+                    self._writes += 1
+                    if self._writes >= self.maintain_every:
+                        self._maintain()
+            except Exception as e:
+                print(f"⚠️ 写入缓存文件失败: {e}")
+
+    async def aset(self, key: str, value: Any, ttl: float):
+        """异步写入缓存：序列化（值可能有数百 KB）和磁盘写入在线程中执行"""
+        await asyncio.to_thread(self.set, key, value, ttl)
+
+    def _maintain(self):
+        """清理磁盘层：删除过期条目，超出 max_disk_entries 时删除最早过期的条目（调用时已持有 _db_lock 或在初始化中）"""
+        self._writes = 0
+        self._db.execute(f"DELETE FROM {self.table} WHERE expires_at <= ?", (time.time(),))
+        if self.max_disk_entries is None:
+            return
+        excess = self._db.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0] - self.max_disk_entries
+        if excess > 0:
+            self._db.execute(
+                f"DELETE FROM {self.table} WHERE key IN "
+                f"(SELECT key FROM {self.table} ORDER BY expires_at LIMIT ?)",
+                (excess,),
+            )
+            with self._lock:
+                self._stats["disk_evictions"] += excess
+
+    def _put(self, key: str, expires_at: float, value: Any, size: int):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (expires_at, value, size)
+        self._bytes += size
+        while self._entries and (
+            len(self._entries) > self.max_entries
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self._stats["evictions"] += 1
+
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        """清空内存和磁盘中的全部条目"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute(f"DELETE FROM {self.table}")
+
+    def stats(self) -> Dict[str, Any]:
+        """命中/未命中统计"""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                "persistent": self._db is not None,
+            }
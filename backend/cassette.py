@@ -0,0 +1,208 @@
+import os
+import json
+import gzip
+import time
+import asyncio
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional
+
+
+class CassetteMissError(Exception):
+    """回放模式下找不到与请求匹配的录制"""
+
+    def __init__(self, kind: str, key: str):
+        self.kind = kind
+        self.key = key
+        super().__init__(f"磁带中没有匹配的 {kind} 请求: {key[:12]}")
+
+
+class Cassette:
+    """
+    LLM 和搜索流量的录制/回放磁带
+
+    录制模式把每一对请求/响应（连同耗时）追加写入 JSONL 文件（路径以 .gz 结尾时使用 gzip 压缩）；
+    回放模式按请求内容的哈希返回录制的响应，并按原始耗时乘以 latency_scale 延迟，
+    使同一个问题在代码改动前后的步数、token 量和耗时可以直接对比。
+    同一请求出现多次时按录制顺序依次返回，用完后重复最后一次。
+    匹配时忽略系统消息（静态提示词和每天变化的日期）和工具描述，提示词改动或隔天回放仍能命中。
+    文件读写不在事件循环中进行：录制交给单个写入线程按顺序追加，回放时首次查找在线程中加载磁带。
+    """
+
+    def __init__(self, path: str, mode: str = "off", latency_scale: float = 1.0):
+        if mode not in ("off", "record", "replay"):
+            raise ValueError(f"未知的磁带模式: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._entries: Optional[Dict[str, Deque[Dict[str, Any]]]] = None
+        self._stats = {"recorded": 0, "replayed": 0, "misses": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    @staticmethod
+    def _normalize(request: Dict[str, Any]) -> Dict[str, Any]:
+        """去掉不影响对话内容的部分：stream 标志、系统消息，工具只保留名称"""
+        normalized = {k: v for k, v in request.items() if k != "stream"}
+        messages = normalized.get("messages")
+        if isinstance(messages, list):
+            normalized["messages"] = [
+                m for m in messages if not (isinstance(m, dict) and m.get("role") == "system")
+            ]
+        tools = normalized.get("tools")
+        if isinstance(tools, list):
+            normalized["tools"] = sorted(
+                (t.get("function") or {}).get("name", "") if isinstance(t, dict) else str(t) for t in tools
+            )
+        return normalized
+
+    @classmethod
+    def key(cls, kind: str, request: Dict[str, Any]) -> str:
+        """请求指纹；流式和非流式调用可以互相回放，系统提示词和工具描述的改动不影响匹配"""
+        raw = json.dumps([kind, cls._normalize(request)], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _open(self, mode: str):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def record(
+        self,
+        kind: str,
+        request: Dict[str, Any],
+        response: Dict[str, Any],
+        latency: float,
+        ttft: Optional[float] = None,
+        chunks: Optional[List[str]] = None,
+    ):
+        """追加一条录制（非录制模式下为空操作）；计算指纹、序列化和写文件都在写入线程中执行"""
+        if not self.recording:
+            return
+        with self._lock:
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cassette")
+            self._writer.submit(self._append, kind, request, response, latency, ttft, chunks)
+
+    def _append(
+        self,
+        kind: str,
+        request: Dict[str, Any],
+        response: Dict[str, Any],
+        latency: float,
+        ttft: Optional[float],
+        chunks: Optional[List[str]],
+    ):
+        entry = {"kind": kind, "key": self.key(kind, request), "latency": round(latency, 4), "response": response}
+        if ttft is not None:
+            entry["ttft"] = round(ttft, 4)
+        if chunks is not None:
+            entry["chunks"] = chunks
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # gzip 支持多成员追加，每条录制立即落盘，进程中途退出也不会丢失已录制的部分
+            with self._open("a") as f:
+                f.write(line)
+        except Exception as e:
+            print(f"⚠️ 写入磁带失败: {e}")
+            return
+        with self._lock:
+            self._stats["recorded"] += 1
+
+    def close(self):
+        """等待尚未写完的录制落盘并停止写入线程（之后再有录制时会重新启动）"""
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.shutdown(wait=True)
+
+    def _load(self) -> Dict[str, Deque[Dict[str, Any]]]:
+        with self._lock:
+            if self._entries is None:
+                entries: Dict[str, Deque[Dict[str, Any]]] = {}
+                if os.path.exists(self.path):
+                    with self._open("r") as f:
+                        for line in f:
+                            if line.strip():
+                                entry = json.loads(line)
+                                entries.setdefault(entry["key"], deque()).append(entry)
+                print(f"📼 已加载磁带 {self.path}: {sum(len(v) for v in entries.values())} 条录制")
+                self._entries = entries
+            return self._entries
+
+    def lookup(self, kind: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        """取出与请求匹配的下一条录制，找不到时抛出 CassetteMissError"""
+        key = self.key(kind, request)
+        entries = self._load().get(key)
+        with self._lock:
+            if not entries:
+                self._stats["misses"] += 1
+                raise CassetteMissError(kind, key)
+            entry = entries.popleft() if len(entries) > 1 else entries[0]
+            self._stats["replayed"] += 1
+        return entry
+
+    async def alookup(self, kind: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        """异步查找：首次查找时在线程中读取整个磁带文件"""
+        if self._entries is None:
+            await asyncio.to_thread(self._load)
+        return self.lookup(kind, request)
+
+    def _delay(self, seconds: float) -> float:
+        return max(0.0, seconds * self.latency_scale)
+
+    def replay(self, kind: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        """同步回放：按（缩放后的）原始耗时阻塞后返回响应"""
+        entry = self.lookup(kind, request)
+        time.sleep(self._delay(entry["latency"]))
+        return entry["response"]
+
+    async def areplay(self, kind: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        """异步回放：按（缩放后的）原始耗时等待后返回响应"""
+        entry = await self.alookup(kind, request)
+        await asyncio.sleep(self._delay(entry["latency"]))
+        return entry["response"]
+
+    async def astream_entry(self, entry: Dict[str, Any]) -> AsyncIterator[str]:
+        """
+        按录制的节奏输出文本分片：先等待首 token 时间，其余分片均匀分布在剩余耗时内
+
+        非流式录制会作为单个分片返回。
+        """
+        chunks = entry.get("chunks")
+        if chunks is None:
+            chunks = [entry["response"]["choices"][0]["message"].get("content") or ""]
+        ttft = entry.get("ttft", entry["latency"])
+        await asyncio.sleep(self._delay(ttft))
+        interval = self._delay(entry["latency"] - ttft) / max(1, len(chunks))
+        for index, chunk in enumerate(chunks):
+            if index and interval:
+                await asyncio.sleep(interval)
+            yield chunk
+
+    def stats(self) -> Dict[str, Any]:
+        return {"mode": self.mode, "path": self.path, "latency_scale": self.latency_scale, **self._stats}
+
+
+cassette = Cassette(
+    path=os.getenv("CASSETTE_PATH", "data/cassette.jsonl.gz"),
+    mode=os.getenv("CASSETTE_MODE", "off").lower(),
+    latency_scale=float(os.getenv("CASSETTE_LATENCY_SCALE", "1.0")),
+)
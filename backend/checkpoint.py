@@ -0,0 +1,111 @@
+import os
+from typing import Any, List, Optional
+
+from langchain_core.messages import AIMessage, ToolMessage
+
+
+def create_checkpointer() -> Optional[Any]:
+    """
+    根据 CHECKPOINTER 环境变量创建 LangGraph 检查点存储（memory、sqlite 或 off），未知的取值视为 memory
+
+    每个会话对应一个线程（thread_id=session_id），后续提问会恢复线程中的消息、文件和待办事项。
+    sqlite 需要安装 langgraph-checkpoint-sqlite 和 aiosqlite。
+    """
+    backend = os.getenv("CHECKPOINTER", "memory").lower()
+    if backend == "off":
+        return None
+    if backend == "sqlite":
+        try:
+            import aiosqlite
+            from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+        except ImportError as e:
+            # 回退到内存存储会让多个 worker 各自持有一份线程，会话在 worker 之间丢失或分裂
+            raise RuntimeError(
+                "CHECKPOINTER=sqlite 需要安装 langgraph-checkpoint-sqlite 和 aiosqlite："
+                "pip install langgraph-checkpoint-sqlite aiosqlite"
+            ) from e
+        path = os.getenv("CHECKPOINT_DB_PATH", "data/checkpoints.sqlite3")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 连接在第一次使用时才在事件循环中打开
+        return AsyncSqliteSaver(aiosqlite.connect(path))
+    from langgraph.checkpoint.memory import InMemorySaver
+    return InMemorySaver()
+
+
+def thread_config(session_id: str) -> dict:
+    return {"configurable": {"thread_id": session_id, "checkpoint_ns": ""}}
+
+
+async def _ready(checkpointer):
+    """sqlite 存储在第一次使用时才连接并建表；直接访问连接或不会自行初始化的操作之前先调用"""
+    setup = getattr(checkpointer, "setup", None)
+    if setup is not None:
+        await setup()
+
+
+async def list_threads(checkpointer) -> List[str]:
+    """检查点中全部线程的 ID，包括其他 worker 或之前的进程写入的线程"""
+    storage = getattr(checkpointer, "storage", None)
+    if storage is not None:
+        # 内存存储：按线程 ID 保存，读取不存在的线程也会留下空条目
+        return [thread_id for thread_id, namespaces in storage.items() if any(namespaces.values())]
+    await _ready(checkpointer)
+    async with checkpointer.lock, checkpointer.conn.execute("SELECT DISTINCT thread_id FROM checkpoints") as cursor:
+        return [row[0] async for row in cursor]
+
+
+async def delete_thread(checkpointer, session_id: str):
+    await _ready(checkpointer)
+    await checkpointer.adelete_thread(session_id)
+
+
+async def copy_thread(checkpointer, source: str, target: str) -> bool:
+    """把 source 线程的最新检查点复制为 target 线程的最新检查点，返回是否复制"""
+    saved = await checkpointer.aget_tuple(thread_config(source))
+    if saved is None:
+        return False
+    checkpoint = saved.checkpoint
+    await checkpointer.aput(
+        thread_config(target), checkpoint, saved.metadata, dict(checkpoint["channel_versions"])
+    )
+    return True
+
+
+async def close_dangling_tool_calls(graph, session_id: str) -> int:
+    """
+    补全线程中没有结果的工具调用，返回补全的数量
+
+    运行在工具执行期间被取消或出错时，检查点中最后一条 AI 消息的部分 tool_calls 没有对应的
+    ToolMessage，下一次运行会在调用模型前的消息校验中失败。这里以 tools 节点的名义写入
+    “已取消”的工具结果，使线程恢复为可以继续对话的状态。
+    """
+    config = thread_config(session_id)
+    messages = (await graph.aget_state(config)).values.get("messages") or []
+    answered = {m.tool_call_id for m in messages if isinstance(m, ToolMessage)}
+    missing = [
+        tool_call
+        for m in messages if isinstance(m, AIMessage)
+        for tool_call in m.tool_calls
+        if tool_call["id"] not in answered
+    ]
+    if not missing:
+        return 0
+    await graph.aupdate_state(config, {"messages": [
+        ToolMessage(
+            f"Tool call `{tool_call['name']}` was cancelled before it returned a result.",
+            name=tool_call["name"],
+            tool_call_id=tool_call["id"],
+            status="error",
+        )
+        for tool_call in missing
+    ]}, as_node="tools")
+    return len(missing)
+
+
+async def close_checkpointer(checkpointer):
+    """关闭检查点存储持有的数据库连接（内存存储无需关闭）"""
+    conn = getattr(checkpointer, "conn", None)
+    if conn is not None:
+        await conn.close()
@@ -0,0 +1,145 @@
+import os
+import re
+from typing import Dict, Any, List
+
+import numpy as np
+
+from .tokens import estimate_tokens, CJK_RANGES
+
+# 单个段落的目标长度（字符）及每次搜索返回给模型的 token 预算
+PASSAGE_CHARS = int(os.getenv("SEARCH_PASSAGE_CHARS", "800"))
+SEARCH_TOKEN_BUDGET = int(os.getenv("SEARCH_TOKEN_BUDGET", "3000"))
+
+# BM25 参数
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_WORD_RE = re.compile(f"[a-z0-9]+|[{CJK_RANGES}]+")
+_CJK_RE = re.compile(f"[{CJK_RANGES}]")
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?。！？；;])\s*")
+
+
+def _terms(text: str) -> List[str]:
+    """分词：英文按单词，中日韩文本按字符二元组（单字时保留单字）"""
+    terms = []
+    for word in _WORD_RE.findall(text.lower()):
+        if _CJK_RE.match(word):
+            if len(word) == 1:
+                terms.append(word)
+            else:
+                terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            terms.append(word)
+    return terms
+
+
+def split_passages(text: str, max_chars: int = PASSAGE_CHARS) -> List[str]:
+    """按段落切分原文，过长的段落按句子再切，过短的相邻段落合并"""
+    passages = []
+    current = ""
+    for paragraph in _PARAGRAPH_RE.split(text or ""):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        pieces = [paragraph]
+        if len(paragraph) > max_chars:
+            pieces = []
+            piece = ""
+            for sentence in _SENTENCE_RE.split(paragraph):
+                if piece and len(piece) + len(sentence) > max_chars:
+                    pieces.append(piece)
+                    piece = ""
+                # 没有句子边界的超长文本按字符硬切
+                while len(sentence) > max_chars:
+                    pieces.append(sentence[:max_chars])
+                    sentence = sentence[max_chars:]
+                piece += sentence
+            if piece:
+                pieces.append(piece)
+        for piece in pieces:
+            if current and len(current) + len(piece) > max_chars:
+                passages.append(current)
+                current = ""
+            current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        passages.append(current)
+    return passages
+
+
+def bm25_scores(query: str, passages: List[str]) -> np.ndarray:
+    """对所有段落一次性计算 BM25 分数（只统计查询词，矩阵运算）"""
+    query_terms = list(dict.fromkeys(_terms(query)))
+    if not passages or not query_terms:
+        return np.zeros(len(passages))
+
+    column = {term: j for j, term in enumerate(query_terms)}
+    tf = np.zeros((len(passages), len(query_terms)), dtype=np.float32)
+    lengths = np.empty(len(passages), dtype=np.float32)
+    for i, passage in enumerate(passages):
+        terms = _terms(passage)
+        lengths[i] = len(terms)
+        for term in terms:
+            j = column.get(term)
+            if j is not None:
+                tf[i, j] += 1
+
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log1p((len(passages) - df + 0.5) / (df + 0.5))
+    avgdl = max(float(lengths.mean()), 1.0)
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / avgdl)
+    return ((tf * (BM25_K1 + 1)) / (tf + norm[:, None]) * idf).sum(axis=1)
+
+
+def compress_search_results(
+    search_docs: Dict[str, Any],
+    query: str,
+    token_budget: int = SEARCH_TOKEN_BUDGET,
+) -> Dict[str, Any]:
+    """只保留与查询最相关的原文段落，并控制在 token 预算内
+
+    每条结果保留标题、URL 和摘要以便引用；raw_content 被替换为入选段落（按原文顺序拼接）。
+    """
+    results = search_docs.get("results") if isinstance(search_docs, dict) else None
+    if not results:
+        return search_docs
+
+    # 标题、URL 和摘要总是保留，剩余预算分配给原文段落
+    budget = token_budget
+    for result in results:
+        budget -= estimate_tokens(result.get("title") or "") + estimate_tokens(result.get("content") or "")
+
+    owners = []
+    passages = []
+    for index, result in enumerate(results):
+        for position, passage in enumerate(split_passages(result.get("raw_content") or "")):
+            owners.append((index, position))
+            passages.append(passage)
+
+    selected: Dict[int, List[tuple]] = {}
+    if passages and budget > 0:
+        scores = bm25_scores(query, passages)
+        for k in np.argsort(-scores, kind="stable"):
+            if scores[k] <= 0:
+                break
+            cost = estimate_tokens(passages[k])
+            if cost > budget:
+                continue
+            budget -= cost
+            index, position = owners[k]
+            selected.setdefault(index, []).append((position, passages[k]))
+
+    compressed = []
+    for index, result in enumerate(results):
+        item = {
+            "title": result.get("title", ""),
+            "url": result.get("url", ""),
+            "content": result.get("content", ""),
+        }
+        if "score" in result:
+            item["score"] = result["score"]
+        if index in selected:
+            item["raw_content"] = "\n\n".join(passage for _, passage in sorted(selected[index]))
+        compressed.append(item)
+
+    return {**search_docs, "results": compressed}
@@ -0,0 +1,94 @@
+import os
+import json
+from typing import List, Sequence
+
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+
+from .tokens import count_tokens
+from .metrics import CONTEXT_TOKENS_SAVED
+
+# 每次模型调用的提示 token 预算（0 表示不限制）；最近的若干条消息始终原样保留
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "24000"))
+CONTEXT_KEEP_RECENT = int(os.getenv("CONTEXT_KEEP_RECENT", "6"))
+# 超出预算时最后才替换的工具输出（子代理的研究结果是写最终回答的依据）
+CONTEXT_PRESERVE_TOOLS = {
+    name.strip() for name in os.getenv("CONTEXT_PRESERVE_TOOLS", "task").split(",") if name.strip()
+}
+
+# 每条消息的格式开销（role、分隔符等）
+MESSAGE_OVERHEAD = 4
+# 短于此值的内容不值得替换
+_MIN_STUB_TOKENS = 64
+
+
+def _content(message: BaseMessage) -> str:
+    return message.content if isinstance(message.content, str) else json.dumps(message.content, ensure_ascii=False)
+
+
+def message_tokens(message: BaseMessage) -> int:
+    """单条消息的 token 数（内容加上工具调用参数）"""
+    tokens = count_tokens(_content(message)) + MESSAGE_OVERHEAD
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        tokens += count_tokens(tool_call["name"]) + count_tokens(json.dumps(tool_call["args"], ensure_ascii=False))
+    return tokens
+
+
+def _stub(message: BaseMessage) -> BaseMessage:
+    tokens = count_tokens(_content(message))
+    if isinstance(message, ToolMessage):
+        content = (
+            f"[Earlier output of `{message.name or 'tool'}` omitted to save context (~{tokens} tokens). "
+            f"Call the tool again if you still need it.]"
+        )
+    else:
+        content = f"[Earlier assistant text omitted to save context (~{tokens} tokens).]"
+    return message.model_copy(update={"content": content})
+
+
+def fit_to_budget(
+    messages: Sequence[BaseMessage],
+    budget: int = CONTEXT_TOKEN_BUDGET,
+    keep_recent: int = CONTEXT_KEEP_RECENT,
+) -> List[BaseMessage]:
+    """
+    把消息列表压到 token 预算以内
+
+    系统消息、用户消息、最近 keep_recent 条消息以及最后一条 AI 消息之后的内容原样保留；
+    其余消息从旧到新依次替换为简短的占位说明：先是普通工具输出，再是 CONTEXT_PRESERVE_TOOLS
+    中的工具输出，最后是 AI 消息的文本（工具调用本身保留，保证 tool_call_id 配对完整）。
+    """
+    messages = list(messages)
+    if budget <= 0 or not messages:
+        return messages
+    counts = [message_tokens(message) for message in messages]
+    before = total = sum(counts)
+    if total <= budget:
+        return messages
+
+    last_ai = max((i for i, message in enumerate(messages) if isinstance(message, AIMessage)), default=len(messages))
+    protected_from = min(len(messages) - keep_recent, last_ai)
+    stages = [
+        lambda m: isinstance(m, ToolMessage) and m.name not in CONTEXT_PRESERVE_TOOLS,
+        lambda m: isinstance(m, ToolMessage),
+        lambda m: isinstance(m, AIMessage),
+    ]
+    for stage in stages:
+        for i in range(protected_from):
+            if total <= budget:
+                break
+            message = messages[i]
+            if counts[i] - MESSAGE_OVERHEAD < _MIN_STUB_TOKENS or not stage(message):
+                continue
+            stub = _stub(message)
+            stub_tokens = message_tokens(stub)
+            if stub_tokens >= counts[i]:
+                continue
+            messages[i] = stub
+            total -= counts[i] - stub_tokens
+            counts[i] = stub_tokens
+
+    saved = before - total
+    if saved:
+        CONTEXT_TOKENS_SAVED.inc(saved)
+        print(f"✂️ 上下文预算 {budget}: {before} -> {total} tokens（节省 {saved}）")
+    return messages
@@ -0,0 +1,526 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from typing import Optional, List, Any, Dict, AsyncIterator, Sequence, Union
+
+import httpx
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, AIMessageChunk, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatResult, ChatGeneration, ChatGenerationChunk
+from langchain_core.callbacks import CallbackManagerForLLMRun, AsyncCallbackManagerForLLMRun
+from langchain_core.output_parsers.openai_tools import make_invalid_tool_call, parse_tool_call
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from .cache import PersistentLRUCache
+from .cassette import cassette, CassetteMissError
+from .http_clients import LoopLocalClient
+from .tokens import estimate_tokens
+from .context_budget import fit_to_budget
+from .metrics import LLM_CALL_SECONDS, LLM_TOKENS, ERRORS, CACHE_LOOKUPS
+
+# LLM 响应精确匹配缓存（默认关闭）：相同的模型、消息和采样参数直接复用上次的回答
+response_cache = (
+    PersistentLRUCache(
+        max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "500")),
+        max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", str(50 * 1024 * 1024))),
+        max_disk_entries=int(os.getenv("LLM_CACHE_MAX_DISK_ENTRIES", "5000")),
+        db_path=os.getenv("LLM_CACHE_PATH") or None,
+        table="llm_response_cache",
+    )
+    if os.getenv("LLM_CACHE_ENABLED", "False").lower() == "true"
+    else None
+)
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+
+# 缓存命中节省的上游开销
+response_cache_savings = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+
+def response_cache_stats() -> Optional[Dict[str, Any]]:
+    """LLM 响应缓存统计，未启用时返回 None"""
+    if response_cache is None:
+        return None
+    return {**response_cache.stats(), "saved": dict(response_cache_savings)}
+
+
+def _to_ai_message(message: Dict[str, Any]) -> AIMessage:
+    """OpenAI 格式的 assistant 消息 -> AIMessage（解析 tool_calls，参数不是合法 JSON 的记为 invalid_tool_calls）"""
+    tool_calls, invalid_tool_calls = [], []
+    for raw_tool_call in message.get("tool_calls") or []:
+        try:
+            tool_calls.append(parse_tool_call(raw_tool_call, return_id=True))
+        except Exception as e:
+            invalid_tool_calls.append(make_invalid_tool_call(raw_tool_call, str(e)))
+    return AIMessage(
+        content=message.get("content") or "",
+        tool_calls=tool_calls,
+        invalid_tool_calls=invalid_tool_calls,
+    )
+
+
+def _tool_call_chunks(message: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """完整消息中的 tool_calls -> 流式的 tool_call_chunks（用于缓存和磁带回放）"""
+    return [
+        {
+            "name": raw_tool_call["function"]["name"],
+            "args": raw_tool_call["function"].get("arguments") or "",
+            "id": raw_tool_call.get("id"),
+            "index": index,
+            "type": "tool_call_chunk",
+        }
+        for index, raw_tool_call in enumerate(message.get("tool_calls") or [])
+    ]
+
+
+def _completion_text(message: Dict[str, Any]) -> str:
+    """回答文本加上工具调用参数，用于估算输出 token 数"""
+    return (message.get("content") or "") + "".join(
+        raw_tool_call["function"]["name"] + (raw_tool_call["function"].get("arguments") or "")
+        for raw_tool_call in message.get("tool_calls") or []
+    )
+
+
+class CustomChatModel(BaseChatModel):
+    """自定义 LangChain 兼容的聊天模型（OpenAI 兼容 /chat/completions 接口）"""
+
+    # 是否使用全局 LLM 响应缓存（可按代理类型关闭）
+    use_response_cache: bool = True
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # 使用类变量而不是实例变量来避免 Pydantic 验证问题
+        self._base_url = os.getenv("CUSTOM_API_BASE_URL").rstrip('/')
+        self._api_key = os.getenv("CUSTOM_API_KEY")
+        self._model_name = os.getenv("MODEL_NAME", "Qwen3-235B")
+        # 增加超时时间并设置重试
+        self._timeout = httpx.Timeout(120.0, connect=30.0, read=120.0)
+        self._limits = httpx.Limits(
+            max_connections=int(os.getenv("CUSTOM_API_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=20
+        )
+        # httpx.AsyncClient 绑定创建它的事件循环，每个循环按需创建一个
+        self._clients = LoopLocalClient(lambda: httpx.AsyncClient(timeout=self._timeout, limits=self._limits))
+        self._sync_client = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """获取绑定到当前事件循环的异步客户端"""
+        return self._clients.get()
+
+    def _get_sync_client(self) -> httpx.Client:
+        """获取同步客户端（仅用于同步调用路径）"""
+        if self._sync_client is None:
+            self._sync_client = httpx.Client(timeout=self._timeout, limits=self._limits)
+        return self._sync_client
+
+    @property
+    def _llm_type(self) -> str:
+        return "custom_chat_model"
+
+    def bind_tools(
+        self,
+        tools: Sequence[Union[Dict[str, Any], type, Any]],
+        *,
+        tool_choice: Optional[Union[str, bool, Dict[str, Any]]] = None,
+        **kwargs: Any,
+    ):
+        """绑定工具：按 OpenAI function calling 格式随每次请求发送 tools / tool_choice"""
+        formatted_tools = [convert_to_openai_tool(tool) for tool in tools]
+        if tool_choice is not None:
+            if tool_choice is True or tool_choice == "any":
+                tool_choice = "required"
+            elif tool_choice is False:
+                tool_choice = "none"
+            elif isinstance(tool_choice, str) and tool_choice not in ("auto", "none", "required"):
+                # 指定工具名：强制调用该工具
+                tool_choice = {"type": "function", "function": {"name": tool_choice}}
+            kwargs["tool_choice"] = tool_choice
+        return super().bind(tools=formatted_tools, **kwargs)
+
+    def _format_messages(self, messages: List[BaseMessage]) -> List[Dict[str, Any]]:
+        """转换 LangChain 消息格式为 API 格式"""
+        formatted_messages = []
+        for msg in messages:
+            if isinstance(msg, HumanMessage):
+                formatted_messages.append({"role": "user", "content": msg.content})
+            elif isinstance(msg, AIMessage):
+                formatted = {"role": "assistant", "content": msg.content}
+                if msg.tool_calls:
+                    formatted["tool_calls"] = [
+                        {
+                            "id": tool_call["id"],
+                            "type": "function",
+                            "function": {
+                                "name": tool_call["name"],
+                                "arguments": json.dumps(tool_call["args"], ensure_ascii=False),
+                            },
+                        }
+                        for tool_call in msg.tool_calls
+                    ]
+                formatted_messages.append(formatted)
+            elif isinstance(msg, ToolMessage):
+                content = msg.content if isinstance(msg.content, str) else json.dumps(msg.content, ensure_ascii=False)
+                formatted_messages.append({"role": "tool", "tool_call_id": msg.tool_call_id, "content": content})
+            elif isinstance(msg, SystemMessage):
+                formatted_messages.append({"role": "system", "content": msg.content})
+            else:
+                formatted_messages.append({"role": "user", "content": str(msg.content)})
+        return formatted_messages
+
+    def _build_payload(
+        self,
+        messages: List[BaseMessage],
+        stream: bool,
+        stop: Optional[List[str]] = None,
+        tools: Optional[List[Dict[str, Any]]] = None,
+        tool_choice: Optional[Union[str, Dict[str, Any]]] = None,
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        """构造 /chat/completions 请求体；bind_tools 绑定的 tools / tool_choice 通过 kwargs 传入"""
+        payload = {
+            # 超出上下文预算时，较早的工具输出会被替换为占位说明
+            "messages": self._format_messages(fit_to_budget(messages)),
+            "model": self._model_name,
+            "temperature": 0.7,
+            "max_tokens": 2000,
+            "stream": stream
+        }
+        if stop:
+            payload["stop"] = stop
+        if tools:
+            payload["tools"] = tools
+            if tool_choice is not None:
+                payload["tool_choice"] = tool_choice
+        return payload
+
+    @property
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {self._api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def _cache_key(self, payload: Dict[str, Any]) -> Optional[str]:
+        """按模型名、消息和采样参数（即除 stream 外的完整请求体）计算缓存键"""
+        # 录制/回放磁带时绕过缓存，保证每次调用都被录制或从磁带回放
+        if response_cache is None or not self.use_response_cache or cassette.enabled:
+            return None
+        raw = json.dumps({k: v for k, v in payload.items() if k != "stream"}, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _cache_lookup(self, cache_key: Optional[str], payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if cache_key is None:
+            return None
+        return self._count_cache_lookup(response_cache.get(cache_key), payload)
+
+    async def _acache_lookup(self, cache_key: Optional[str], payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """异步查缓存：磁盘回源不阻塞事件循环"""
+        if cache_key is None:
+            return None
+        return self._count_cache_lookup(await response_cache.aget(cache_key), payload)
+
+    def _count_cache_lookup(self, result: Optional[Dict[str, Any]], payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        CACHE_LOOKUPS.inc(cache="llm", result="hit" if result is not None else "miss")
+        if result is not None:
+            response_cache_savings["requests"] += 1
+            response_cache_savings["prompt_tokens"] += sum(
+                estimate_tokens(str(m.get("content") or "")) for m in payload["messages"]
+            )
+            response_cache_savings["completion_tokens"] += estimate_tokens(
+                _completion_text(result["choices"][0]["message"])
+            )
+        return result
+
+    def _cache_store(self, cache_key: Optional[str], result: Dict[str, Any]):
+        if cache_key is None:
+            return
+        message = result["choices"][0]["message"]
+        response_cache.set(cache_key, {"choices": [{"message": message}]}, LLM_CACHE_TTL)
+
+    async def _acache_store(self, cache_key: Optional[str], result: Dict[str, Any]):
+        if cache_key is None:
+            return
+        message = result["choices"][0]["message"]
+        await response_cache.aset(cache_key, {"choices": [{"message": message}]}, LLM_CACHE_TTL)
+
+    def _observe_call(
+        self,
+        method: str,
+        status: str,
+        started: float,
+        payload: Optional[Dict[str, Any]] = None,
+        result: Optional[Dict[str, Any]] = None,
+    ):
+        """记录一次模型调用的耗时和 token 数（上游未返回 usage 时按文本估算）"""
+        LLM_CALL_SECONDS.observe(time.perf_counter() - started, method=method, status=status)
+        if status == "error":
+            ERRORS.inc(component="llm")
+        if status != "ok" or result is None:
+            return
+        usage = result.get("usage") or {}
+        prompt_tokens = usage.get("prompt_tokens")
+        if prompt_tokens is None and payload is not None:
+            prompt_tokens = sum(estimate_tokens(str(m.get("content") or "")) for m in payload["messages"])
+        completion_tokens = usage.get("completion_tokens")
+        if completion_tokens is None:
+            completion_tokens = estimate_tokens(_completion_text(result["choices"][0]["message"]))
+        LLM_TOKENS.inc(prompt_tokens or 0, type="prompt")
+        LLM_TOKENS.inc(completion_tokens, type="completion")
+
+    def _to_chat_result(self, result: Dict[str, Any]) -> ChatResult:
+        """将 API 响应转换为 LangChain 格式的结果"""
+        message = _to_ai_message(result["choices"][0]["message"])
+        generation = ChatGeneration(message=message)
+        return ChatResult(generations=[generation])
+
+    def _error_result(self, e: Exception) -> ChatResult:
+        """调用失败时返回错误消息而不是抛出异常"""
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"自定义模型调用失败: {e}")
+        print(f"错误详情: {error_details}")
+        error_message = AIMessage(content=f"抱歉，生成回答时出现错误：{str(e)}")
+        generation = ChatGeneration(message=error_message)
+        return ChatResult(generations=[generation])
+
+    def _request(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """同步调用自定义 API，超时时指数退避重试"""
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                response = self._get_sync_client().post(
+                    f"{self._base_url}/chat/completions",
+                    json=payload,
+                    headers=self._headers
+                )
+                response.raise_for_status()
+                return response.json()
+            except (httpx.ReadTimeout, httpx.ConnectTimeout) as timeout_error:
+                if attempt < max_retries - 1:
+                    print(f"API 调用超时，重试 {attempt + 1}/{max_retries}: {timeout_error}")
+                    time.sleep(2 ** attempt)  # 指数退避
+                    continue
+                raise timeout_error
+            except Exception as api_error:
+                print(f"API 调用错误: {api_error}")
+                raise api_error
+
+    async def _arequest(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """异步调用自定义 API，超时时指数退避重试"""
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                response = await self._get_client().post(
+                    f"{self._base_url}/chat/completions",
+                    json=payload,
+                    headers=self._headers
+                )
+                response.raise_for_status()
+                return response.json()
+            except (httpx.ReadTimeout, httpx.ConnectTimeout) as timeout_error:
+                if attempt < max_retries - 1:
+                    print(f"API 调用超时，重试 {attempt + 1}/{max_retries}: {timeout_error}")
+                    await asyncio.sleep(2 ** attempt)  # 指数退避
+                    continue
+                raise timeout_error
+            except Exception as api_error:
+                print(f"API 调用错误: {api_error}")
+                raise api_error
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        """同步生成方法 - 使用同步客户端，不创建或嵌套事件循环"""
+        started = time.perf_counter()
+        try:
+            payload = self._build_payload(messages, stream=False, stop=stop, **kwargs)
+            cache_key = self._cache_key(payload)
+            cached = self._cache_lookup(cache_key, payload)
+            if cached is not None:
+                self._observe_call("generate", "cache_hit", started)
+                return self._to_chat_result(cached)
+
+            if cassette.replaying:
+                result = cassette.replay("llm", payload)
+            else:
+                result = self._request(payload)
+                cassette.record("llm", payload, result, time.perf_counter() - started)
+
+            self._cache_store(cache_key, result)
+            self._observe_call("generate", "ok", started, payload, result)
+            return self._to_chat_result(result)
+
+        except Exception as e:
+            self._observe_call("generate", "error", started)
+            return self._error_result(e)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        """异步生成方法"""
+        started = time.perf_counter()
+        try:
+            payload = self._build_payload(messages, stream=False, stop=stop, **kwargs)
+            cache_key = self._cache_key(payload)
+            cached = await self._acache_lookup(cache_key, payload)
+            if cached is not None:
+                self._observe_call("agenerate", "cache_hit", started)
+                return self._to_chat_result(cached)
+
+            if cassette.replaying:
+                result = await cassette.areplay("llm", payload)
+            else:
+                result = await self._arequest(payload)
+                cassette.record("llm", payload, result, time.perf_counter() - started)
+
+            await self._acache_store(cache_key, result)
+            self._observe_call("agenerate", "ok", started, payload, result)
+            return self._to_chat_result(result)
+
+        except Exception as e:
+            self._observe_call("agenerate", "error", started)
+            return self._error_result(e)
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        """异步流式生成方法 - 逐个转发上游 SSE 中的 token"""
+        started = time.perf_counter()
+        payload = self._build_payload(messages, stream=True, stop=stop, **kwargs)
+        cache_key = self._cache_key(payload)
+        cached = await self._acache_lookup(cache_key, payload)
+        if cached is not None:
+            message = cached["choices"][0]["message"]
+            content = message.get("content") or ""
+            chunk = ChatGenerationChunk(
+                message=AIMessageChunk(content=content, tool_call_chunks=_tool_call_chunks(message))
+            )
+            if run_manager:
+                await run_manager.on_llm_new_token(content, chunk=chunk)
+            yield chunk
+            self._observe_call("astream", "cache_hit", started)
+            return
+
+        if cassette.replaying:
+            try:
+                entry = await cassette.alookup("llm", payload)
+                async for token in cassette.astream_entry(entry):
+                    if not token:
+                        continue
+                    chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+                    if run_manager:
+                        await run_manager.on_llm_new_token(token, chunk=chunk)
+                    yield chunk
+            except CassetteMissError as e:
+                print(f"自定义模型流式回放失败: {e}")
+                self._observe_call("astream", "error", started)
+                yield ChatGenerationChunk(message=AIMessageChunk(content=f"抱歉，生成回答时出现错误：{str(e)}"))
+                return
+            tool_call_chunks = _tool_call_chunks(entry["response"]["choices"][0]["message"])
+            if tool_call_chunks:
+                yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=tool_call_chunks))
+            self._observe_call("astream", "ok", started, payload, entry["response"])
+            return
+
+        # 只在尚未输出任何 token 时重试，避免向下游重复发送内容
+        max_retries = 3
+        emitted = False
+        tokens = []
+        tool_calls: Dict[int, Dict[str, Any]] = {}  # 按 index 拼接流式工具调用
+        first_token_at = None
+        for attempt in range(max_retries):
+            try:
+                async with self._get_client().stream(
+                    "POST",
+                    f"{self._base_url}/chat/completions",
+                    json=payload,
+                    headers=self._headers
+                ) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        try:
+                            event = json.loads(data)
+                        except json.JSONDecodeError:
+                            continue
+                        choices = event.get("choices") or []
+                        if not choices:
+                            continue
+                        delta = choices[0].get("delta") or {}
+                        token = delta.get("content") or ""
+                        # 一轮中可以有多个并行工具调用，按 index 区分，名称和参数分片到达
+                        tool_call_chunks = []
+                        for raw_chunk in delta.get("tool_calls") or []:
+                            index = raw_chunk.get("index", 0)
+                            function = raw_chunk.get("function") or {}
+                            accumulated = tool_calls.setdefault(
+                                index, {"id": None, "type": "function", "function": {"name": "", "arguments": ""}}
+                            )
+                            accumulated["id"] = accumulated["id"] or raw_chunk.get("id")
+                            accumulated["function"]["name"] += function.get("name") or ""
+                            accumulated["function"]["arguments"] += function.get("arguments") or ""
+                            tool_call_chunks.append({
+                                "name": function.get("name"),
+                                "args": function.get("arguments"),
+                                "id": raw_chunk.get("id"),
+                                "index": index,
+                                "type": "tool_call_chunk",
+                            })
+                        if not token and not tool_call_chunks:
+                            continue
+                        chunk = ChatGenerationChunk(
+                            message=AIMessageChunk(content=token, tool_call_chunks=tool_call_chunks)
+                        )
+                        if run_manager:
+                            await run_manager.on_llm_new_token(token, chunk=chunk)
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                        emitted = True
+                        if token:
+                            tokens.append(token)
+                        yield chunk
+                message = {"role": "assistant", "content": "".join(tokens)}
+                if tool_calls:
+                    message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+                result = {"choices": [{"message": message}]}
+                finished = time.perf_counter()
+                cassette.record(
+                    "llm", payload, result, finished - started,
+                    ttft=(first_token_at or finished) - started, chunks=tokens,
+                )
+                await self._acache_store(cache_key, result)
+                self._observe_call("astream", "ok", started, payload, result)
+                return
+            except (httpx.ReadTimeout, httpx.ConnectTimeout) as timeout_error:
+                if not emitted and attempt < max_retries - 1:
+                    print(f"API 流式调用超时，重试 {attempt + 1}/{max_retries}: {timeout_error}")
+                    await asyncio.sleep(2 ** attempt)  # 指数退避
+                    continue
+                error = timeout_error
+            except Exception as api_error:
+                error = api_error
+
+            print(f"自定义模型流式调用失败: {error}")
+            self._observe_call("astream", "error", started)
+            # 与非流式路径保持一致：以错误消息结束，而不是抛出异常
+            yield ChatGenerationChunk(
+                message=AIMessageChunk(content=f"抱歉，生成回答时出现错误：{str(error)}")
+            )
+            return
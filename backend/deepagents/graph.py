@@ -1,4 +1,4 @@
-from deepagents.sub_agent import _create_task_tool, SubAgent
+from deepagents.sub_agent import _build_prompt, _create_task_tool, SubAgent
 from deepagents.model import get_default_model
 from deepagents.tools import write_todos, write_file, read_file, ls, edit_file
 from deepagents.state import DeepAgentState
@@ -30,6 +30,11 @@ def create_deep_agent(
     model: Optional[Union[str, LanguageModelLike]] = None,
     subagents: list[SubAgent] = None,
     state_schema: Optional[StateSchemaType] = None,
+    max_concurrency: Optional[int] = None,
+    callbacks: Optional[list] = None,
+    subagent_graphs: Optional[dict] = None,
+    context: Optional[Callable[[], str]] = None,
+    checkpointer: Optional[Any] = None,
 ):
     """Create a deep agent.
 
@@ -48,6 +53,22 @@ def create_deep_agent(
                 - `prompt` (used as the system prompt in the subagent)
                 - (optional) `tools`
         state_schema: The schema of the deep agent. Should subclass from DeepAgentState
+        max_concurrency: The maximum number of sub agents that sibling `task` calls
+            from a single model turn may run at once. `None` means no limit.
+        callbacks: LangChain callback handlers attached to the agent and to every
+            sub agent, e.g. for metrics or tracing.
+        subagent_graphs: A dict shared between agents to cache compiled sub agent
+            graphs. Sub agents are compiled on first use; agents passing the same
+            dict reuse the graph of an identical sub agent (same name, prompt,
+            tools, model and state schema) instead of compiling their own.
+        context: A callable returning short, per-run context such as the current
+            date. It is evaluated on every model call of the agent and its sub
+            agents and sent as a separate system message after the static
+            instructions, which therefore stay a stable, cacheable prompt prefix.
+        checkpointer: A LangGraph checkpointer. Runs that pass a `thread_id` in
+            their config continue that thread: its messages, files and todos
+            are restored before the new input is added. Sub agents never
+            checkpoint.
     """
     prompt = instructions + base_prompt
     built_in_tools = [write_todos, write_file, read_file, ls, edit_file]
@@ -59,12 +80,20 @@ def create_deep_agent(
         instructions,
         subagents or [],
         model,
-        state_schema
+        state_schema,
+        max_concurrency=max_concurrency,
+        callbacks=callbacks,
+        graph_cache=subagent_graphs,
+        context=context,
     )
     all_tools = built_in_tools + list(tools) + [task_tool]
-    return create_react_agent(
+    agent = create_react_agent(
         model,
-        prompt=prompt,
+        prompt=_build_prompt(prompt, context),
         tools=all_tools,
         state_schema=state_schema,
+        checkpointer=checkpointer,
     )
+    if callbacks:
+        agent = agent.with_config({"callbacks": callbacks})
+    return agent
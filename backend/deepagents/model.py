@@ -1,5 +1,6 @@
-from langchain_anthropic import ChatAnthropic
-
-
 def get_default_model():
+    # Imported lazily: the Anthropic client is heavy to import and only needed
+    # when no model is passed to `create_deep_agent`.
+    from langchain_anthropic import ChatAnthropic
+
     return ChatAnthropic(model_name="claude-sonnet-4-20250514", max_tokens=64000)
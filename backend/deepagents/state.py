@@ -1,5 +1,8 @@
 from langgraph.prebuilt.chat_agent_executor import AgentState
+from collections import OrderedDict
 from typing import Annotated
+import hashlib
+import threading
 try:
     from typing import NotRequired
 except ImportError:
@@ -15,15 +18,62 @@ class Todo(TypedDict):
     status: Literal["pending", "in_progress", "completed"]
 
 
+class Summary(TypedDict):
+    """Rolling summary of the earlier turns of a conversation."""
+
+    text: str
+    # id of the first message the summary does not cover (a human message)
+    until: str
+    version: int
+
+
+# File contents at least this large are interned by content hash, so the same
+# report written by several runs, sessions or sub agents is held only once.
+BLOB_MIN_SIZE = 4096
+_BLOB_CACHE_SIZE = 256
+_blobs: "OrderedDict[str, str]" = OrderedDict()
+_blobs_lock = threading.Lock()
+
+
+def intern_content(content: str) -> str:
+    """Return the shared copy of `content` if an identical large blob is known."""
+    if not isinstance(content, str) or len(content) < BLOB_MIN_SIZE:
+        return content
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    with _blobs_lock:
+        shared = _blobs.get(digest)
+        if shared is None:
+            _blobs[digest] = shared = content
+            if len(_blobs) > _BLOB_CACHE_SIZE:
+                _blobs.popitem(last=False)
+        else:
+            _blobs.move_to_end(digest)
+    return shared
+
+
 def file_reducer(l, r):
+    """Merge a `files` update into the current files.
+
+    Updates carry only the paths they change, and no version of the dict is
+    ever mutated. A new dict is built only when some content actually changes;
+    it shares every unchanged content string with the previous version, and an
+    update that changes nothing returns the previous dict itself.
+    """
     if l is None:
         return r
     elif r is None:
         return l
-    else:
-        return {**l, **r}
+    changed = {
+        path: content
+        for path, content in r.items()
+        if l.get(path) is not content and l.get(path) != content
+    }
+    if not changed:
+        return l
+    return {**l, **changed}
 
 
 class DeepAgentState(AgentState):
     todos: NotRequired[list[Todo]]
     files: Annotated[NotRequired[dict[str, str]], file_reducer]
+    summary: NotRequired[Summary]
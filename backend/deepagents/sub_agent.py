@@ -1,11 +1,16 @@
 from deepagents.prompts import TASK_DESCRIPTION_PREFIX, TASK_DESCRIPTION_SUFFIX
 from deepagents.state import DeepAgentState
 from langgraph.prebuilt import create_react_agent
-from langchain_core.tools import BaseTool
+from langchain_core.tools import BaseTool, StructuredTool
 from typing import TypedDict
 from langchain_core.tools import tool, InjectedToolCallId
-from langchain_core.messages import ToolMessage
-from typing import Annotated
+from langchain_core.messages import SystemMessage, ToolMessage
+from langchain_core.callbacks import BaseCallbackManager
+from langchain_core.runnables import ensure_config
+from typing import Annotated, Callable, Optional
+from contextlib import asynccontextmanager
+import asyncio
+import threading
 try:
     from typing import NotRequired
 except ImportError:
@@ -22,10 +27,65 @@ class SubAgent(TypedDict):
     tools: NotRequired[list[str]]
 
 
-def _create_task_tool(tools, instructions, subagents: list[SubAgent], model, state_schema):
-    agents = {
-        "general-purpose": create_react_agent(model, prompt=instructions, tools=tools)
-    }
+# Guards compilation into the shared graph caches; compiles run in worker threads.
+_compile_lock = threading.Lock()
+
+
+def _apply_summary(state, messages):
+    """Replace the messages covered by `state["summary"]` with the summary.
+
+    The summary is kept only while the message it stops at is still in the
+    list, so a sub agent (whose messages are its own) ignores the parent's.
+    """
+    summary = state.get("summary")
+    if not summary:
+        return [], messages
+    for index, message in enumerate(messages):
+        if message.id == summary["until"]:
+            text = f"Summary of the earlier conversation:\n{summary['text']}"
+            return [SystemMessage(content=text)], messages[index:]
+    return [], messages
+
+
+def _build_prompt(prompt: str, context: Optional[Callable[[], str]] = None):
+    """Build the `prompt` for `create_react_agent`.
+
+    The output of `context()` (e.g. the current date), if given, goes into a
+    separate system message right after the static prompt on every model call.
+    The static text stays a byte-identical prefix across runs and days, and the
+    conversation that follows stays identical across the model calls of a run,
+    so an inference server with prefix caching can reuse both. Turns covered
+    by the thread's rolling summary are replaced by it.
+    """
+    system_message = SystemMessage(content=prompt)
+
+    def _prompt(state):
+        extra = context() if context is not None else None
+        summary, messages = _apply_summary(state, list(state["messages"]))
+        if extra:
+            return [system_message, SystemMessage(content=extra)] + summary + messages
+        return [system_message] + summary + messages
+
+    return _prompt
+
+
+def _create_task_tool(
+    tools,
+    instructions,
+    subagents: list[SubAgent],
+    model,
+    state_schema,
+    max_concurrency: Optional[int] = None,
+    callbacks: Optional[list] = None,
+    graph_cache: Optional[dict] = None,
+    context: Optional[Callable[[], str]] = None,
+):
+    # Sub agent graphs are compiled on first use, off the event loop for async
+    # callers. Compiled graphs are stored in `graph_cache` keyed by everything
+    # that goes into them, so parents sharing a cache reuse the same graph for
+    # identical sub agents.
+    graph_cache = {} if graph_cache is None else graph_cache
+    specs = {"general-purpose": (instructions, list(tools), None)}
     tools_by_name = {}
     for tool_ in tools:
         if not isinstance(tool_, BaseTool):
@@ -35,33 +95,65 @@ def _create_task_tool(tools, instructions, subagents: list[SubAgent], model, sta
         if "tools" in _agent:
             _tools = [tools_by_name[t] for t in _agent["tools"]]
         else:
-            _tools = tools
-        agents[_agent["name"]] = create_react_agent(
-            model, prompt=_agent["prompt"], tools=_tools, state_schema=state_schema
-        )
+            _tools = list(tools)
+        specs[_agent["name"]] = (_agent["prompt"], _tools, state_schema)
+
+    def _key(name: str):
+        prompt, _tools, schema = specs[name]
+        return (name, prompt, id(model), tuple(id(t) for t in _tools), schema, context)
+
+    def _compiled(name: str):
+        key = _key(name)
+        agent = graph_cache.get(key)
+        if agent is None:
+            with _compile_lock:
+                agent = graph_cache.get(key)
+                if agent is None:
+                    prompt, _tools, schema = specs[name]
+                    kwargs = {"state_schema": schema} if schema is not None else {}
+                    # Every `task` call is a one-off run, so sub agents never checkpoint,
+                    # even when the parent graph has a checkpointer.
+                    agent = graph_cache[key] = create_react_agent(
+                        model, prompt=_build_prompt(prompt, context), tools=_tools, checkpointer=False, **kwargs
+                    )
+        return agent
 
     other_agents_string = [
         f"- {_agent['name']}: {_agent['description']}" for _agent in subagents
     ]
 
-    @tool(
-        description=TASK_DESCRIPTION_PREFIX.format(other_agents=other_agents_string)
-        + TASK_DESCRIPTION_SUFFIX
-    )
-    def task(
-        description: str,
-        subagent_type: str,
-        state: Annotated[DeepAgentState, InjectedState],
-        tool_call_id: Annotated[str, InjectedToolCallId],
-    ):
-        if subagent_type not in agents:
-            return f"Error: invoked agent of type {subagent_type}, the only allowed types are {[f'`{k}`' for k in agents]}"
-        sub_agent = agents[subagent_type]
-        state["messages"] = [{"role": "user", "content": description}]
-        result = sub_agent.invoke(state)
+    def _select_agent(subagent_type: str):
+        if subagent_type not in specs:
+            return None, f"Error: invoked agent of type {subagent_type}, the only allowed types are {[f'`{k}`' for k in specs]}"
+        return _compiled(subagent_type), None
+
+    async def _aselect_agent(subagent_type: str):
+        if subagent_type in specs and graph_cache.get(_key(subagent_type)) is None:
+            # First use: compile in a worker thread so other runs keep going.
+            await asyncio.to_thread(_compiled, subagent_type)
+        return _select_agent(subagent_type)
+
+    def _sub_state(state, description: str):
+        # Each call gets its own messages. Files are shared with the parent
+        # as is: tools never mutate a files dict, and `file_reducer` builds a
+        # new one whenever a sub agent changes something.
+        return {
+            **state,
+            "messages": [{"role": "user", "content": description}],
+            "files": state.get("files") or {},
+        }
+
+    def _to_command(parent_files, result, tool_call_id: str) -> Command:
+        # Only report files the sub agent created or changed, so sibling updates
+        # merge through file_reducer in tool-call order without clobbering each other.
+        changed_files = {
+            path: content
+            for path, content in (result.get("files") or {}).items()
+            if parent_files.get(path) != content
+        }
         return Command(
             update={
-                "files": result.get("files", {}),
+                "files": changed_files,
                 "messages": [
                     ToolMessage(
                         result["messages"][-1].content, tool_call_id=tool_call_id
@@ -70,4 +162,78 @@ def _create_task_tool(tools, instructions, subagents: list[SubAgent], model, sta
             }
         )
 
-    return task
+    def _sub_config():
+        # Attach `callbacks` to the sub agent run without losing the parent's
+        # callback manager (and with it the parent run id that nests the sub
+        # agent's runs under this `task` call). Handlers the parent already
+        # passes down are not added twice.
+        if not callbacks:
+            return None
+        manager = ensure_config().get("callbacks")
+        if isinstance(manager, BaseCallbackManager):
+            manager = manager.copy()
+            for handler in callbacks:
+                manager.add_handler(handler, inherit=True)
+        else:
+            manager = list(manager or [])
+            manager += [handler for handler in callbacks if handler not in manager]
+        return {"callbacks": manager}
+
+    # Sibling `task` calls emitted in the same model turn run concurrently; they
+    # share a semaphore keyed by the id of the AI message that requested them.
+    fanout: dict[str, list] = {}
+
+    @asynccontextmanager
+    async def _fanout_slot(state, tool_call_id: str):
+        if not max_concurrency:
+            yield
+            return
+        messages = state.get("messages") or []
+        key = getattr(messages[-1], "id", None) if messages else None
+        key = key or tool_call_id
+        entry = fanout.get(key)
+        if entry is None:
+            entry = fanout[key] = [asyncio.Semaphore(max_concurrency), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                fanout.pop(key, None)
+
+    async def atask(
+        description: str,
+        subagent_type: str,
+        state: Annotated[DeepAgentState, InjectedState],
+        tool_call_id: Annotated[str, InjectedToolCallId],
+    ):
+        sub_agent, error = await _aselect_agent(subagent_type)
+        if error:
+            return error
+        async with _fanout_slot(state, tool_call_id):
+            result = await sub_agent.ainvoke(_sub_state(state, description), _sub_config())
+        return _to_command(state.get("files") or {}, result, tool_call_id)
+
+    # Sync fallback for callers that drive the graph with `invoke`; it never
+    # creates or nests an event loop.
+    def task(
+        description: str,
+        subagent_type: str,
+        state: Annotated[DeepAgentState, InjectedState],
+        tool_call_id: Annotated[str, InjectedToolCallId],
+    ):
+        sub_agent, error = _select_agent(subagent_type)
+        if error:
+            return error
+        result = sub_agent.invoke(_sub_state(state, description), _sub_config())
+        return _to_command(state.get("files") or {}, result, tool_call_id)
+
+    return StructuredTool.from_function(
+        func=task,
+        coroutine=atask,
+        name="task",
+        description=TASK_DESCRIPTION_PREFIX.format(other_agents=other_agents_string)
+        + TASK_DESCRIPTION_SUFFIX,
+    )
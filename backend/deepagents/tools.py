@@ -9,7 +9,7 @@ from deepagents.prompts import (
     EDIT_DESCRIPTION,
     TOOL_DESCRIPTION,
 )
-from deepagents.state import Todo, DeepAgentState
+from deepagents.state import Todo, DeepAgentState, intern_content
 
 
 @tool(description=WRITE_TODOS_DESCRIPTION)
@@ -84,11 +84,10 @@ def write_file(
     tool_call_id: Annotated[str, InjectedToolCallId],
 ) -> Command:
     """Write to a file."""
-    files = state.get("files", {})
-    files[file_path] = content
+    # Only the changed path is sent; `file_reducer` merges it copy-on-write.
     return Command(
         update={
-            "files": files,
+            "files": {file_path: intern_content(content)},
             "messages": [
                 ToolMessage(f"Updated file {file_path}", tool_call_id=tool_call_id)
             ],
@@ -137,11 +136,10 @@ def edit_file(
         )  # Replace only first occurrence
         result_msg = f"Successfully replaced string in '{file_path}'"
 
-    # Update the mock filesystem
-    mock_filesystem[file_path] = new_content
+    # Update the mock filesystem (the state's dict itself is never mutated)
     return Command(
         update={
-            "files": mock_filesystem,
+            "files": {file_path: intern_content(new_content)},
             "messages": [
                 ToolMessage(f"Updated file {file_path}", tool_call_id=tool_call_id)
             ],
@@ -0,0 +1,43 @@
+import asyncio
+import weakref
+from typing import Callable
+
+import httpx
+
+# 所有按事件循环创建的客户端，服务关闭时统一关闭
+_registry: "weakref.WeakSet[LoopLocalClient]" = weakref.WeakSet()
+
+
+class LoopLocalClient:
+    """
+    每个事件循环一个 httpx.AsyncClient
+
+    httpx.AsyncClient 的连接池绑定创建它的事件循环。客户端按循环保存在 WeakKeyDictionary 中，
+    切换循环时不会替换（并泄漏）其他循环的客户端；循环被回收时对应的客户端随之释放。
+    """
+
+    def __init__(self, factory: Callable[[], httpx.AsyncClient]):
+        self._factory = factory
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+            weakref.WeakKeyDictionary()
+        )
+        _registry.add(self)
+
+    def get(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = self._factory()
+        return client
+
+    async def aclose(self):
+        """关闭当前事件循环的客户端及其连接池"""
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+async def aclose_clients():
+    """关闭当前事件循环中所有已创建的客户端（在 lifespan 关闭阶段调用）"""
+    for clients in list(_registry):
+        await clients.aclose()
@@ -1,33 +1,58 @@
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import os
 import json
 import asyncio
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
+# 加载环境变量：必须在导入下面这些模块之前，它们在导入时读取配置
+load_dotenv()
+
 from .agent_core import DeepAgentManager
+from .scheduler import QueueFullError, QueueTimeoutError
+from .metrics import registry
+from .tracing import tracer
+from .cassette import cassette
+from .http_clients import aclose_clients
 from .models import ChatRequest, ChatResponse, AgentStatus
 
-# 加载环境变量
-load_dotenv()
+# Agent 管理器在 lifespan 中创建，导入本模块不做任何初始化
+agent_manager: Optional[DeepAgentManager] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """启动时初始化 Agent 管理器和后台任务（会话清理、代理预热），关闭时停止"""
+    global agent_manager
+    agent_manager = DeepAgentManager()
+    agent_manager.start_session_cleanup()
+    agent_manager.start_warmup()
+    try:
+        yield
+    finally:
+        await agent_manager.stop_warmup()
+        await agent_manager.stop_session_cleanup()
+        await agent_manager.close()
+        await aclose_clients()
+        if tracer is not None:
+            tracer.close()
+        cassette.close()
 
 app = FastAPI(
     title="Deep Agent System",
     description="基于 deepagents 的智能代理系统",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # 静态文件和模板
 app.mount("/static", StaticFiles(directory="frontend/static"), name="static")
 templates = Jinja2Templates(directory="frontend/templates")
 
-# 初始化 Agent 管理器
-agent_manager = DeepAgentManager()
-
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
     """主页面"""
@@ -46,24 +71,33 @@ async def chat(request: ChatRequest):
             message=response["message"],
             agent_type=response["agent_type"],
             sources=response.get("sources", []),
-            session_id=request.session_id
+            session_id=request.session_id,
+            run_id=response.get("run_id")
         )
+    except QueueFullError as e:
+        return JSONResponse(status_code=429, content={"detail": str(e)}, headers={"Retry-After": str(e.retry_after)})
+    except QueueTimeoutError as e:
+        return JSONResponse(status_code=503, content={"detail": str(e)}, headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/chat/stream/{session_id}")
-async def chat_stream(session_id: str, message: str, agent_type: str = "research"):
-    """流式聊天响应"""
+async def chat_stream(request: Request, session_id: str, message: str, agent_type: str = "research"):
+    """流式聊天响应；客户端断开时取消进行中的代理运行"""
     async def generate():
+        stream = agent_manager.stream_message(
+            message=message,
+            session_id=session_id,
+            agent_type=agent_type,
+            is_disconnected=request.is_disconnected
+        )
         try:
-            async for chunk in agent_manager.stream_message(
-                message=message,
-                session_id=session_id,
-                agent_type=agent_type
-            ):
+            async for chunk in stream:
                 yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
         except Exception as e:
             yield f"data: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+        finally:
+            await stream.aclose()
     
     return StreamingResponse(generate(), media_type="text/plain")
 
@@ -72,6 +106,20 @@ async def get_agent_status():
     """获取代理状态"""
     return await agent_manager.get_status()
 
+@app.get("/api/runs/{run_id}/trace")
+async def get_run_trace(run_id: str):
+    """获取一次运行的追踪树（span 嵌套结构，start_ms 为相对运行开始的偏移）"""
+    # 较早的追踪需要扫描追踪文件，放到线程中执行
+    trace = await asyncio.to_thread(tracer.get_trace, run_id) if tracer is not None else None
+    if trace is None:
+        raise HTTPException(status_code=404, detail="未找到该运行的追踪")
+    return trace
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus 文本格式的指标"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.post("/api/agents/reset/{session_id}")
 async def reset_session(session_id: str):
     """重置会话"""
@@ -0,0 +1,217 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# 默认直方图分桶（秒）：覆盖毫秒级的清理步骤到数分钟的深度研究运行
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Histogram(_Metric):
+    """累积分桶直方图，可在 Prometheus 中用 histogram_quantile 计算 p95/p99"""
+
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [各分桶计数..., 总数, 总和]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """记录代码块的耗时"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, state in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {int(state[-2])}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_count{labels} {int(state[-2])}")
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-1])}")
+        return lines
+
+
+class MetricsRegistry:
+    """进程内指标注册表，按 Prometheus 文本格式导出，无需外部采集组件"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets=buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+RUN_SECONDS = registry.histogram(
+    "agent_run_seconds", "端到端代理运行耗时（获得执行名额后）", ["agent_type", "mode"]
+)
+QUEUE_WAIT_SECONDS = registry.histogram(
+    "agent_queue_wait_seconds", "等待执行名额的时间", ["agent_type"]
+)
+TIME_TO_FIRST_EVENT_SECONDS = registry.histogram(
+    "agent_time_to_first_event_seconds", "从收到流式请求到发出第一个内容事件的时间", ["agent_type"]
+)
+LLM_CALL_SECONDS = registry.histogram(
+    "llm_call_seconds", "CustomChatModel 单次调用耗时（含重试）", ["method", "status"]
+)
+SEARCH_CALL_SECONDS = registry.histogram(
+    "search_call_seconds", "internet_search 单次调用耗时", ["topic", "cache"]
+)
+TOOL_CALL_SECONDS = registry.histogram(
+    "agent_tool_call_seconds", "代理工具调用耗时（task 即子代理调用）", ["tool", "status"]
+)
+SANITIZE_SECONDS = registry.histogram(
+    "response_sanitize_seconds", "回答内容清理耗时", ["mode"],
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+)
+
+LLM_TOKENS = registry.counter("llm_tokens_total", "LLM token 数（上游未返回 usage 时为估算值）", ["type"])
+CONTEXT_TOKENS_SAVED = registry.counter("llm_context_tokens_saved_total", "上下文预算替换旧消息节省的提示 token 数")
+ERRORS = registry.counter("errors_total", "错误次数", ["component"])
+CACHE_LOOKUPS = registry.counter("cache_lookups_total", "缓存查询次数", ["cache", "result"])
+RUNS_CANCELLED = registry.counter("agent_runs_cancelled_total", "客户端断开后被取消的运行", ["agent_type"])
+REQUESTS_COALESCED = registry.counter("agent_requests_coalesced_total", "合并到进行中运行的请求", ["agent_type"])
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """LangChain 回调：记录每次工具调用（包括子代理 task 调用）的耗时
+
+    作为可继承回调挂在代理上，子代理内部的工具调用也会被记录。
+    """
+
+    # 回调只做计时，直接在事件循环中执行，无需放入线程池
+    run_inline = True
+
+    def __init__(self):
+        self._started: Dict[UUID, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any):
+        name = (serialized or {}).get("name") or kwargs.get("name") or "unknown"
+        with self._lock:
+            self._started[run_id] = (name, time.perf_counter())
+
+    def _finish(self, run_id: UUID, status: str):
+        with self._lock:
+            started = self._started.pop(run_id, None)
+        if started is not None:
+            name, started_at = started
+            TOOL_CALL_SECONDS.observe(time.perf_counter() - started_at, tool=name, status=status)
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id, "ok")
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._finish(run_id, "error")
+        ERRORS.inc(component="tool")
+
+
+metrics_callback = MetricsCallbackHandler()
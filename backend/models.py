@@ -19,12 +19,22 @@ class ChatResponse(BaseModel):
     agent_type: str
     sources: List[Dict[str, Any]] = []
     session_id: str
+    run_id: Optional[str] = None
     timestamp: Optional[str] = None
 
 class AgentStatus(BaseModel):
     active_sessions: int
     total_requests: int
+    cancelled_runs: int = 0
+    coalesced_requests: int = 0
     api_status: Dict[str, bool]
+    search_cache: Optional[Dict[str, Any]] = None
+    llm_cache: Optional[Dict[str, Any]] = None
+    cassette: Optional[Dict[str, Any]] = None
+    scheduler: Optional[Dict[str, Any]] = None
+    agents: Optional[Dict[str, Any]] = None
+    checkpointer: Optional[Dict[str, Any]] = None
+    summarizer: Optional[Dict[str, Any]] = None
     last_activity: Optional[str] = None
 
 class SearchResult(BaseModel):
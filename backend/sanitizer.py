@@ -0,0 +1,137 @@
+"""
+回答清理：移除代码块、行内代码和泄露的内部指令
+
+非流式和流式两条路径共用同一套规则。代码的移除是一次线性扫描，可以增量地作用于 token 流，
+只有未闭合的行内代码（最多一行）和结尾可能构成围栏的反引号会被暂缓输出，围栏内的内容直接丢弃；
+内部指令短语合并为一个预编译的正则，按行过滤需要完整的行，只在最终回答上执行。
+"""
+
+import re
+
+FENCE = "```"
+
+# 泄露的内部指令短语（均不跨行）。按首字合并成一个正则，开头的前瞻字符集让引擎快速跳过无关位置
+_INTERNAL_PHRASES = re.compile(
+    r'(?=[写将保创使调qfrcQFRC])(?:'
+    r'写入(?:.*?\.txt.*?文件.*?中|.*?文件)'
+    r'|将.*?写入.*?文件'
+    r'|(?:保存到|创建).*?文件'
+    r'|question\.txt|final_report\.md'
+    r'|(?:使用|调用).*?代理'
+    r'|(?:research|critique)-agent'
+    r')',
+    re.IGNORECASE,
+)
+
+# 以这些词开头的行通常是内部指令
+_SKIP_PREFIXES = ('将原始用户问题', '写入', '保存', '创建', '调用', '使用')
+
+# 行内代码的结束位置：闭合的反引号，或者换行（未闭合，按原文保留）
+_INLINE_END = re.compile(r'[`\n]')
+
+
+class StreamSanitizer:
+    """增量移除代码块和行内代码，feed() 返回可以立即输出的文本，结束时调用 flush()"""
+
+    def __init__(self):
+        self._pending = ""     # 暂缓输出的尾部：未闭合的行内代码或结尾的反引号
+        self._resume = 0       # _pending 中已确认不含行内代码结束位置的长度
+        self._in_fence = False
+
+    def feed(self, text: str) -> str:
+        return self._scan(text, final=False)
+
+    def flush(self) -> str:
+        return self._scan("", final=True)
+
+    def _scan(self, text: str, final: bool) -> str:
+        buf = self._pending + text if self._pending else text
+        resume = self._resume
+        self._pending = ""
+        self._resume = 0
+        out = []
+        i, n = 0, len(buf)
+        while i < n:
+            if self._in_fence:
+                k = buf.find(FENCE, i)
+                if k < 0:
+                    # 围栏内容直接丢弃，只保留可能与下一段拼成闭合标记的最后两个字符
+                    if not final:
+                        self._pending = buf[max(i, n - 2):]
+                    break
+                self._in_fence = False
+                i = k + 3
+                continue
+
+            j = buf.find("`", i)
+            if j < 0:
+                out.append(buf[i:])
+                break
+            out.append(buf[i:j])
+            run = 1
+            while j + run < n and buf[j + run] == "`":
+                run += 1
+            if j + run == n and not final:
+                # 结尾的反引号可能是围栏的前半部分，等待下一段
+                self._pending = buf[j:]
+                break
+            if run >= 3:
+                self._in_fence = True
+                i = j + 3
+                continue
+            if run == 2:
+                i = j + 2
+                continue
+
+            match = _INLINE_END.search(buf, max(j + 1, resume) if j == 0 else j + 1)
+            if match is None:
+                if final:
+                    out.append(buf[j:])
+                else:
+                    self._pending = buf[j:]
+                    self._resume = len(self._pending)
+                break
+            if match.group() == "`":
+                end = match.end()
+                if not final and n - end < 2 and buf[end:] == "`" * (n - end):
+                    # 闭合的反引号可能是围栏的开头，等待下一段再判断
+                    self._pending = buf[j:]
+                    self._resume = match.start() - j
+                    break
+                if buf.startswith("``", end):
+                    # 遇到围栏：行内代码未闭合，按原文保留
+                    out.append(buf[j:match.start()])
+                    i = match.start()
+                else:
+                    i = end
+            else:
+                out.append(buf[j:match.start()])
+                i = match.start()
+        return "".join(out)
+
+
+def strip_code(text: str) -> str:
+    """移除代码块和行内代码（未闭合的代码块一直移除到结尾）"""
+    return StreamSanitizer()._scan(text, final=True)
+
+
+def sanitize(text: str) -> str:
+    """清理完整回答：移除代码、内部指令短语和指令行，连续空行合并为一个"""
+    if not text:
+        return text
+    text = _INTERNAL_PHRASES.sub("", strip_code(text))
+    lines = []
+    blank = False
+    for line in text.split("\n"):
+        line = line.rstrip()
+        content = line.lstrip()
+        if not content:
+            blank = bool(lines)
+            continue
+        if content.startswith(_SKIP_PREFIXES):
+            continue
+        if blank:
+            lines.append("")
+            blank = False
+        lines.append(line)
+    return "\n".join(lines)
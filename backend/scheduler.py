@@ -0,0 +1,174 @@
+import os
+import math
+import time
+import asyncio
+from collections import deque
+from typing import AsyncIterator, Dict, Optional
+
+
+class QueueFullError(Exception):
+    """等待队列已满，调用方应在 retry_after 秒后重试"""
+
+    def __init__(self, agent_type: str, retry_after: int):
+        super().__init__(f"{agent_type} 代理当前繁忙，请 {retry_after} 秒后重试")
+        self.agent_type = agent_type
+        self.retry_after = retry_after
+
+
+class QueueTimeoutError(Exception):
+    """在等待队列中超过 queue_timeout 仍未获得执行名额"""
+
+    def __init__(self, agent_type: str, retry_after: int):
+        super().__init__(f"{agent_type} 代理排队超时，请 {retry_after} 秒后重试")
+        self.agent_type = agent_type
+        self.retry_after = retry_after
+
+
+class _Lane:
+    """单个代理类型的执行名额和 FIFO 等待队列"""
+
+    def __init__(self, agent_type: str, max_concurrent: int, max_queue: int):
+        self.agent_type = agent_type
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.running = 0
+        self.waiters: "deque[RunSlot]" = deque()
+        # 最近运行耗时的指数移动平均，用于估算 Retry-After
+        self.avg_run_seconds = 30.0
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "timeouts": 0}
+
+    def retry_after(self) -> int:
+        rounds = (len(self.waiters) + 1) / max(self.max_concurrent, 1)
+        return max(1, math.ceil(self.avg_run_seconds * rounds))
+
+    def position(self, slot: "RunSlot") -> int:
+        return self.waiters.index(slot) + 1
+
+    def grant_next(self):
+        while self.waiters and self.running < self.max_concurrent:
+            slot = self.waiters.popleft()
+            slot._grant()
+        # 队列前移，通知剩余等待者更新位置
+        for slot in self.waiters:
+            slot._moved.set()
+
+
+class RunSlot:
+    """一次代理运行的执行名额；先 reserve 进入队列，再等待获得名额，结束后 release"""
+
+    def __init__(self, lane: _Lane, timeout: float):
+        self._lane = lane
+        self._timeout = timeout
+        self._moved = asyncio.Event()
+        self.granted = False
+        self.released = False
+        self.started_at: Optional[float] = None
+
+    def _grant(self):
+        self.granted = True
+        self.started_at = time.monotonic()
+        self._lane.running += 1
+        self._lane.stats["admitted"] += 1
+        self._moved.set()
+
+    @property
+    def position(self) -> int:
+        """当前排队位置（从 1 开始），已获得名额时为 0"""
+        return 0 if self.granted else self._lane.position(self)
+
+    async def wait_positions(self) -> AsyncIterator[int]:
+        """排队期间每当位置变化时产出当前位置；获得名额后结束，超时抛出 QueueTimeoutError"""
+        deadline = time.monotonic() + self._timeout
+        while not self.granted:
+            yield self.position
+            self._moved.clear()
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                # 不用 wait_for：名额与取消在同一轮到达时它会吞掉取消，已断开的请求仍会开始运行
+                moved = asyncio.ensure_future(self._moved.wait())
+                try:
+                    await asyncio.wait((moved,), timeout=remaining)
+                finally:
+                    moved.cancel()
+            if not self.granted and time.monotonic() >= deadline:
+                self._lane.stats["timeouts"] += 1
+                retry_after = self._lane.retry_after()
+                self.release()
+                raise QueueTimeoutError(self._lane.agent_type, retry_after)
+
+    async def acquire(self):
+        """等待获得执行名额（不关心排队位置）"""
+        async for _ in self.wait_positions():
+            pass
+
+    def release(self):
+        """归还名额或退出队列，可重复调用"""
+        if self.released:
+            return
+        self.released = True
+        lane = self._lane
+        if self.granted:
+            lane.running -= 1
+            elapsed = time.monotonic() - self.started_at
+            lane.avg_run_seconds = 0.8 * lane.avg_run_seconds + 0.2 * elapsed
+        else:
+            try:
+                lane.waiters.remove(self)
+            except ValueError:
+                pass
+        lane.grant_next()
+
+
+class RunScheduler:
+    """按代理类型限制并发运行数，超出的请求进入有界 FIFO 队列等待
+
+    队列已满时 reserve 立即抛出 QueueFullError（HTTP 层转换为 429 + Retry-After），
+    排队超过 queue_timeout 的请求抛出 QueueTimeoutError，避免突发流量下所有请求一起超时。
+    """
+
+    def __init__(
+        self,
+        max_concurrent: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        queue_timeout: Optional[float] = None,
+    ):
+        self.max_concurrent = max_concurrent or int(os.getenv("RUN_MAX_CONCURRENT", "4"))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("RUN_MAX_QUEUE", "16"))
+        self.queue_timeout = queue_timeout or float(os.getenv("RUN_QUEUE_TIMEOUT", "60"))
+        self._lanes: Dict[str, _Lane] = {}
+
+    def _lane(self, agent_type: str) -> _Lane:
+        lane = self._lanes.get(agent_type)
+        if lane is None:
+            # 可按代理类型覆盖并发上限，例如 RUN_MAX_CONCURRENT_RESEARCH=2
+            limit = int(os.getenv(f"RUN_MAX_CONCURRENT_{agent_type.upper()}", self.max_concurrent))
+            lane = self._lanes[agent_type] = _Lane(agent_type, limit, self.max_queue)
+        return lane
+
+    def reserve(self, agent_type: str) -> RunSlot:
+        """申请执行名额：有空闲名额时立即获得，否则进入队列；队列已满时抛出 QueueFullError"""
+        lane = self._lane(getattr(agent_type, "value", agent_type))
+        slot = RunSlot(lane, self.queue_timeout)
+        if lane.running < lane.max_concurrent and not lane.waiters:
+            slot._grant()
+        elif len(lane.waiters) < lane.max_queue:
+            lane.waiters.append(slot)
+            lane.stats["queued"] += 1
+        else:
+            lane.stats["rejected"] += 1
+            raise QueueFullError(lane.agent_type, lane.retry_after())
+        return slot
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """各代理类型的运行/排队情况"""
+        return {
+            agent_type: {
+                **lane.stats,
+                "running": lane.running,
+                "waiting": len(lane.waiters),
+                "max_concurrent": lane.max_concurrent,
+                "max_queue": lane.max_queue,
+                "avg_run_seconds": round(lane.avg_run_seconds, 2),
+            }
+            for agent_type, lane in self._lanes.items()
+        }
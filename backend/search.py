@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from typing import Dict, Any, Literal, Optional
+
+import httpx
+from langchain_core.tools import StructuredTool
+
+from .cache import PersistentLRUCache
+from .cassette import cassette
+from .http_clients import LoopLocalClient
+from .compression import compress_search_results, SEARCH_TOKEN_BUDGET
+from .metrics import SEARCH_CALL_SECONDS, ERRORS, CACHE_LOOKUPS
+
+
+class TavilySearchClient:
+    """Tavily 搜索客户端 - 复用 keep-alive 连接池，支持单次调用超时"""
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        timeout: Optional[float] = None,
+        max_connections: Optional[int] = None,
+    ):
+        self._api_key = api_key or os.getenv("TAVILY_API_KEY")
+        self._base_url = (base_url or os.getenv("TAVILY_API_BASE_URL", "https://api.tavily.com")).rstrip('/')
+        self._timeout = timeout or float(os.getenv("TAVILY_TIMEOUT", "30"))
+        self._limits = httpx.Limits(
+            max_connections=max_connections or int(os.getenv("TAVILY_MAX_CONNECTIONS", "20")),
+            max_keepalive_connections=10
+        )
+        # httpx.AsyncClient 绑定创建它的事件循环，每个循环按需创建一个
+        self._clients = LoopLocalClient(lambda: httpx.AsyncClient(
+            base_url=self._base_url, headers=self._headers, limits=self._limits
+        ))
+        self._sync_client = None
+
+    @property
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {self._api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """获取绑定到当前事件循环的异步客户端"""
+        return self._clients.get()
+
+    def _get_sync_client(self) -> httpx.Client:
+        """获取同步客户端（仅用于同步调用路径）"""
+        if self._sync_client is None:
+            self._sync_client = httpx.Client(
+                base_url=self._base_url, headers=self._headers, limits=self._limits
+            )
+        return self._sync_client
+
+    def _build_payload(self, query: str, max_results: int, topic: str, include_raw_content: bool) -> Dict[str, Any]:
+        return {
+            "query": query,
+            "max_results": max_results,
+            "topic": topic,
+            "include_raw_content": include_raw_content,
+        }
+
+    async def asearch(
+        self,
+        query: str,
+        max_results: int = 10,
+        topic: str = "general",
+        include_raw_content: bool = True,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """异步搜索；调用方取消时，进行中的 HTTP 请求会随之取消"""
+        payload = self._build_payload(query, max_results, topic, include_raw_content)
+        if cassette.replaying:
+            return await cassette.areplay("search", payload)
+        started = time.perf_counter()
+        response = await self._get_client().post("/search", json=payload, timeout=timeout or self._timeout)
+        response.raise_for_status()
+        result = response.json()
+        cassette.record("search", payload, result, time.perf_counter() - started)
+        return result
+
+    def search(
+        self,
+        query: str,
+        max_results: int = 10,
+        topic: str = "general",
+        include_raw_content: bool = True,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """同步搜索"""
+        payload = self._build_payload(query, max_results, topic, include_raw_content)
+        if cassette.replaying:
+            return cassette.replay("search", payload)
+        started = time.perf_counter()
+        response = self._get_sync_client().post("/search", json=payload, timeout=timeout or self._timeout)
+        response.raise_for_status()
+        result = response.json()
+        cassette.record("search", payload, result, time.perf_counter() - started)
+        return result
+
+
+# 全局共享客户端，连接池在所有请求和子代理之间复用
+search_client = TavilySearchClient()
+
+# 各主题的缓存有效期（秒）：新闻时效性强，通用内容可以缓存更久
+SEARCH_CACHE_TTLS = {
+    "news": float(os.getenv("SEARCH_CACHE_TTL_NEWS", "600")),
+    "finance": float(os.getenv("SEARCH_CACHE_TTL_FINANCE", "1800")),
+    "general": float(os.getenv("SEARCH_CACHE_TTL_GENERAL", "86400")),
+}
+
+# 搜索结果缓存：内存 LRU + 本地 SQLite 文件，跨请求、跨用户、跨重启复用（缓存压缩后的结果）
+search_cache = (
+    PersistentLRUCache(
+        max_entries=int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "1000")),
+        max_disk_entries=int(os.getenv("SEARCH_CACHE_MAX_DISK_ENTRIES", "20000")),
+        db_path=os.getenv("SEARCH_CACHE_PATH", "data/search_cache.sqlite3") or None,
+        table="search_cache",
+    )
+    if os.getenv("SEARCH_CACHE_ENABLED", "True").lower() == "true"
+    else None
+)
+
+
+def _cache_key(query: str, max_results: int, topic: str, include_raw_content: bool) -> str:
+    """按规范化后的查询、搜索参数和压缩预算生成缓存键（缓存的是压缩后的结果，预算变化后不能复用）"""
+    normalized_query = " ".join(query.lower().split())
+    budget = SEARCH_TOKEN_BUDGET if include_raw_content else 0
+    raw = json.dumps([normalized_query, topic, max_results, include_raw_content, budget], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _cache_enabled() -> bool:
+    # 录制/回放磁带时绕过缓存，保证每次搜索都被录制或从磁带回放
+    return search_cache is not None and not cassette.enabled
+
+
+def _count_lookup(cached: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    CACHE_LOOKUPS.inc(cache="search", result="hit" if cached is not None else "miss")
+    return cached
+
+
+def _cache_ttl(topic: str) -> float:
+    return SEARCH_CACHE_TTLS.get(topic, SEARCH_CACHE_TTLS["general"])
+
+
+def _cache_get(key: str) -> Optional[Dict[str, Any]]:
+    return _count_lookup(search_cache.get(key)) if _cache_enabled() else None
+
+
+async def _acache_get(key: str) -> Optional[Dict[str, Any]]:
+    return _count_lookup(await search_cache.aget(key)) if _cache_enabled() else None
+
+
+def _cache_set(key: str, topic: str, result: Dict[str, Any]):
+    if _cache_enabled():
+        search_cache.set(key, result, _cache_ttl(topic))
+
+
+async def _acache_set(key: str, topic: str, result: Dict[str, Any]):
+    if _cache_enabled():
+        await search_cache.aset(key, result, _cache_ttl(topic))
+
+
+async def _ainternet_search(
+    query: str,
+    max_results: int = 10,  # 增加到10条结果
+    topic: Literal["general", "news", "finance"] = "general",
+    include_raw_content: bool = True,  # 获取完整内容
+):
+    """Run a web search - 增强版本，获取更多更详细的信息"""
+    started = time.perf_counter()
+    key = _cache_key(query, max_results, topic, include_raw_content)
+    cached = await _acache_get(key)
+    if cached is not None:
+        SEARCH_CALL_SECONDS.observe(time.perf_counter() - started, topic=topic, cache="hit")
+        return cached
+    try:
+        result = await search_client.asearch(
+            query,
+            max_results=max_results,
+            topic=topic,
+            include_raw_content=include_raw_content,
+        )
+        if include_raw_content and SEARCH_TOKEN_BUDGET > 0:
+            # 原文可能有数百 KB，压缩放到线程中执行，避免阻塞事件循环
+            result = await asyncio.to_thread(compress_search_results, result, query)
+    except Exception as e:
+        print(f"Tavily搜索失败: {e}")
+        ERRORS.inc(component="search")
+        SEARCH_CALL_SECONDS.observe(time.perf_counter() - started, topic=topic, cache="error")
+        # 返回空结果而不是抛出异常（失败结果不缓存）
+        return {"results": []}
+    await _acache_set(key, topic, result)
+    SEARCH_CALL_SECONDS.observe(time.perf_counter() - started, topic=topic, cache="miss")
+    return result
+
+
+def _internet_search(
+    query: str,
+    max_results: int = 10,  # 增加到10条结果
+    topic: Literal["general", "news", "finance"] = "general",
+    include_raw_content: bool = True,  # 获取完整内容
+):
+    """Run a web search - 增强版本，获取更多更详细的信息"""
+    started = time.perf_counter()
+    key = _cache_key(query, max_results, topic, include_raw_content)
+    cached = _cache_get(key)
+    if cached is not None:
+        SEARCH_CALL_SECONDS.observe(time.perf_counter() - started, topic=topic, cache="hit")
+        return cached
+    try:
+        result = search_client.search(
+            query,
+            max_results=max_results,
+            topic=topic,
+            include_raw_content=include_raw_content,
+        )
+        if include_raw_content and SEARCH_TOKEN_BUDGET > 0:
+            result = compress_search_results(result, query)
+    except Exception as e:
+        print(f"Tavily搜索失败: {e}")
+        ERRORS.inc(component="search")
+        SEARCH_CALL_SECONDS.observe(time.perf_counter() - started, topic=topic, cache="error")
+        # 返回空结果而不是抛出异常（失败结果不缓存）
+        return {"results": []}
+    _cache_set(key, topic, result)
+    SEARCH_CALL_SECONDS.observe(time.perf_counter() - started, topic=topic, cache="miss")
+    return result
+
+
+# 异步 LangChain 工具，LangGraph 的工具节点可以直接 await；同步实现仅作为 invoke 的回退
+internet_search = StructuredTool.from_function(
+    func=_internet_search,
+    coroutine=_ainternet_search,
+    name="internet_search",
+)
@@ -0,0 +1,306 @@
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+
+class SessionStore(ABC):
+    """会话存储接口
+
+    会话包含对话历史、创建时间和最后活动时间。历史追加、截断（max_history）、
+    容量淘汰（max_sessions）和过期清理（session_timeout）都在存储内部完成。
+    每个同步方法都有对应的 a 前缀异步版本，事件循环中的调用方应使用异步版本：
+    需要访问磁盘的存储在后台线程中执行，不阻塞事件循环。
+    """
+
+    def __init__(self, max_sessions: int = 100, session_timeout: float = 3600, max_history: int = 20):
+        self.max_sessions = max_sessions
+        self.session_timeout = session_timeout
+        self.max_history = max_history
+
+    @abstractmethod
+    def ensure(self, session_id: str) -> bool:
+        """确保会话存在并刷新活动时间，返回是否新建了会话"""
+
+    @abstractmethod
+    def exists(self, session_id: str) -> bool:
+        """会话是否存在"""
+
+    @abstractmethod
+    def get_history(self, session_id: str) -> List[Dict[str, str]]:
+        """获取会话历史（按时间顺序）"""
+
+    @abstractmethod
+    def append_history(self, session_id: str, entries: List[Dict[str, str]]):
+        """追加历史并截断到 max_history 条"""
+
+    @abstractmethod
+    def delete(self, session_id: str) -> bool:
+        """删除会话，返回会话是否存在"""
+
+    @abstractmethod
+    def clear(self) -> int:
+        """删除所有会话，返回删除数量"""
+
+    @abstractmethod
+    def count(self) -> int:
+        """当前会话数量"""
+
+    @abstractmethod
+    def cleanup_expired(self) -> int:
+        """删除超过 session_timeout 未活动的会话，返回删除数量"""
+
+    async def _call(self, func: Callable, *args):
+        """执行一次存储操作；内存存储直接执行"""
+        return func(*args)
+
+    def close(self):
+        """释放存储持有的资源"""
+
+    async def aensure(self, session_id: str) -> bool:
+        return await self._call(self.ensure, session_id)
+
+    async def aexists(self, session_id: str) -> bool:
+        return await self._call(self.exists, session_id)
+
+    async def aget_history(self, session_id: str) -> List[Dict[str, str]]:
+        return await self._call(self.get_history, session_id)
+
+    async def aappend_history(self, session_id: str, entries: List[Dict[str, str]]):
+        return await self._call(self.append_history, session_id, entries)
+
+    async def adelete(self, session_id: str) -> bool:
+        return await self._call(self.delete, session_id)
+
+    async def aclear(self) -> int:
+        return await self._call(self.clear)
+
+    async def acount(self) -> int:
+        return await self._call(self.count)
+
+    async def acleanup_expired(self) -> int:
+        return await self._call(self.cleanup_expired)
+
+
+class MemorySessionStore(SessionStore):
+    """进程内会话存储（仅适用于单个 worker）
+
+    会话按最后活动时间排列在 OrderedDict 中（每次活动 move_to_end），时间戳取自
+    time.monotonic()。由于所有会话的超时时长相同，队首始终是最早过期的会话，
+    因此容量淘汰是 O(1)，过期清理只需从队首弹出已过期的条目，成本与过期数量成正比。
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # session_id -> {"history": [...], "created_at": float, "last_activity": float}
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def ensure(self, session_id: str) -> bool:
+        now = time.monotonic()
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session["last_activity"] = now
+            self._sessions.move_to_end(session_id)
+            return False
+        # 如果会话数量过多，淘汰最久未活动的会话
+        while len(self._sessions) >= self.max_sessions:
+            self._sessions.popitem(last=False)
+        self._sessions[session_id] = {"history": [], "created_at": now, "last_activity": now}
+        return True
+
+    def exists(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def get_history(self, session_id: str) -> List[Dict[str, str]]:
+        session = self._sessions.get(session_id)
+        return list(session["history"]) if session else []
+
+    def append_history(self, session_id: str, entries: List[Dict[str, str]]):
+        session = self._sessions.get(session_id)
+        if session is None:
+            return
+        history = session["history"]
+        history.extend(entries)
+        if len(history) > self.max_history:
+            del history[:len(history) - self.max_history]
+
+    def delete(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id, None) is not None
+
+    def clear(self) -> int:
+        count = len(self._sessions)
+        self._sessions.clear()
+        return count
+
+    def count(self) -> int:
+        return len(self._sessions)
+
+    def cleanup_expired(self) -> int:
+        deadline = time.monotonic() - self.session_timeout
+        expired = 0
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session["last_activity"] >= deadline:
+                break
+            del self._sessions[session_id]
+            expired += 1
+        return expired
+
+
+class SQLiteSessionStore(SessionStore):
+    """基于本地 SQLite（WAL 模式）的会话存储，可由同一主机上的多个 worker 进程共享
+
+    异步方法在专用的单线程执行器中访问数据库，等待其他进程的写锁（最长 30 秒）不会阻塞事件循环。
+    会话数量由触发器维护在 session_count 表中，插入会话时不需要 COUNT(*)。
+    """
+
+    def __init__(self, db_path: str = "data/sessions.sqlite3", **kwargs):
+        super().__init__(**kwargs)
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-db")
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                last_activity REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_last_activity ON sessions(last_activity);
+            CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_history_session ON history(session_id, id);
+            CREATE TABLE IF NOT EXISTS session_count (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                n INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO session_count (id, n) SELECT 0, COUNT(*) FROM sessions;
+            CREATE TRIGGER IF NOT EXISTS sessions_count_insert AFTER INSERT ON sessions
+            BEGIN UPDATE session_count SET n = n + 1 WHERE id = 0; END;
+            CREATE TRIGGER IF NOT EXISTS sessions_count_delete AFTER DELETE ON sessions
+            BEGIN UPDATE session_count SET n = n - 1 WHERE id = 0; END;
+            """
+        )
+
+    async def _call(self, func: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._db.close()
+
+    def _transaction(self):
+        return _Transaction(self._db, self._lock)
+
+    def ensure(self, session_id: str) -> bool:
+        now = time.time()
+        with self._transaction() as db:
+            updated = db.execute(
+                "UPDATE sessions SET last_activity = ? WHERE session_id = ?", (now, session_id)
+            ).rowcount
+            if updated:
+                return False
+            # 如果会话数量过多，淘汰最久未活动的会话（走 last_activity 索引）
+            overflow = db.execute("SELECT n FROM session_count WHERE id = 0").fetchone()[0] - self.max_sessions + 1
+            if overflow > 0:
+                db.execute(
+                    "DELETE FROM sessions WHERE session_id IN "
+                    "(SELECT session_id FROM sessions ORDER BY last_activity LIMIT ?)",
+                    (overflow,),
+                )
+            db.execute(
+                "INSERT OR IGNORE INTO sessions (session_id, created_at, last_activity) VALUES (?, ?, ?)",
+                (session_id, now, now),
+            )
+            return True
+
+    def exists(self, session_id: str) -> bool:
+        with self._lock:
+            row = self._db.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row is not None
+
+    def get_history(self, session_id: str) -> List[Dict[str, str]]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT role, content FROM history WHERE session_id = ? ORDER BY id", (session_id,)
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    def append_history(self, session_id: str, entries: List[Dict[str, str]]):
+        with self._transaction() as db:
+            if db.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone() is None:
+                return
+            db.executemany(
+                "INSERT INTO history (session_id, role, content) VALUES (?, ?, ?)",
+                [(session_id, entry["role"], entry["content"]) for entry in entries],
+            )
+            db.execute(
+                "DELETE FROM history WHERE session_id = ? AND id <= "
+                "(SELECT id FROM history WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (session_id, session_id, self.max_history),
+            )
+
+    def delete(self, session_id: str) -> bool:
+        with self._transaction() as db:
+            return db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount > 0
+
+    def clear(self) -> int:
+        with self._transaction() as db:
+            return db.execute("DELETE FROM sessions").rowcount
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT n FROM session_count WHERE id = 0").fetchone()[0]
+
+    def cleanup_expired(self) -> int:
+        deadline = time.time() - self.session_timeout
+        with self._transaction() as db:
+            return db.execute("DELETE FROM sessions WHERE last_activity < ?", (deadline,)).rowcount
+
+
+class _Transaction:
+    """串行化本进程内的访问，并用 BEGIN IMMEDIATE 与其他进程互斥写入"""
+
+    def __init__(self, db: sqlite3.Connection, lock: threading.Lock):
+        self._db = db
+        self._lock = lock
+
+    def __enter__(self) -> sqlite3.Connection:
+        self._lock.acquire()
+        try:
+            self._db.execute("BEGIN IMMEDIATE")
+        except Exception:
+            self._lock.release()
+            raise
+        return self._db
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self._db.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self._lock.release()
+        return False
+
+
+def create_session_store(**kwargs) -> SessionStore:
+    """根据 SESSION_STORE 环境变量创建会话存储（memory 或 sqlite）"""
+    backend = os.getenv("SESSION_STORE", "memory").lower()
+    if backend == "sqlite":
+        return SQLiteSessionStore(db_path=os.getenv("SESSION_DB_PATH", "data/sessions.sqlite3"), **kwargs)
+    return MemorySessionStore(**kwargs)
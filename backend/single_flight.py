@@ -0,0 +1,47 @@
+import asyncio
+from typing import Any, Dict, List, Optional
+
+
+def flight_key(agent_type: str, message: str) -> str:
+    """相同代理类型 + 规范化后的消息视为同一个请求"""
+    normalized_message = " ".join(message.lower().split())
+    return f"{getattr(agent_type, 'value', agent_type)}\x00{normalized_message}"
+
+
+class StreamFlight:
+    """一次共享运行的事件广播
+
+    保存已发布的全部事件，新订阅者先回放已有事件再接收后续事件，
+    因此中途加入的请求也能收到完整的事件序列和最终回答。运行结束时向所有订阅者发送 None。
+    """
+
+    def __init__(self, key: Optional[str] = None, session_id: Optional[str] = None):
+        self.key = key
+        self.session_id = session_id  # 发起者的会话，跟随者结束时从中复制线程
+        self.task: Optional[asyncio.Task] = None
+        self.events: List[Dict[str, Any]] = []
+        self.subscribers: List[asyncio.Queue] = []
+        self.finished = False
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        for event in self.events:
+            queue.put_nowait(event)
+        if self.finished:
+            queue.put_nowait(None)
+        self.subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        if queue in self.subscribers:
+            self.subscribers.remove(queue)
+
+    def publish(self, event: Dict[str, Any]):
+        self.events.append(event)
+        for queue in self.subscribers:
+            queue.put_nowait(event)
+
+    def finish(self):
+        self.finished = True
+        for queue in self.subscribers:
+            queue.put_nowait(None)
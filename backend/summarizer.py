@@ -0,0 +1,198 @@
+import os
+import time
+import asyncio
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, ToolMessage
+
+from .context_budget import message_tokens
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and a research assistant.
+Update the existing summary with the new turns below. Keep the user's questions and stated preferences, the key findings, figures and sources found so far, the files that were written, and any open follow-ups. Drop small talk and tool mechanics. Write in the same language as the user, as a concise bulleted list of at most 400 words. Output only the updated summary."""
+
+# 摘要输入中每条工具输出保留的最大字符数
+_TOOL_OUTPUT_CHARS = 2000
+
+
+def _render(messages: Sequence[BaseMessage]) -> str:
+    lines = []
+    for message in messages:
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        if isinstance(message, HumanMessage):
+            lines.append(f"User: {content}")
+        elif isinstance(message, ToolMessage):
+            if len(content) > _TOOL_OUTPUT_CHARS:
+                content = content[:_TOOL_OUTPUT_CHARS] + " ..."
+            lines.append(f"Tool result ({message.name or 'tool'}): {content}")
+        else:
+            calls = ", ".join(call["name"] for call in getattr(message, "tool_calls", None) or [])
+            if content:
+                lines.append(f"Assistant: {content}")
+            if calls:
+                lines.append(f"Assistant called: {calls}")
+    return "\n".join(lines)
+
+
+class HistorySummarizer:
+    """
+    会话线程的后台滚动摘要
+
+    每次运行结束后检查线程：较早的轮次（最近 keep_turns 轮之前、尚未被摘要覆盖的部分）
+    超过 trigger_tokens 时，在后台把它们与上一版摘要合并成新摘要，写回线程状态的 summary 键。
+    摘要只在轮次边界处截断，记录下第一条未覆盖消息的 ID 和版本号；提示构造时用摘要替换被覆盖的消息。
+    同一会话同时只有一个摘要任务，结果保存在检查点中，每段历史只摘要一次。
+
+    运行以 durability="exit" 在结束时按启动时的状态写入检查点，会覆盖运行期间写入的摘要。
+    因此代理运行包裹在 run() 中：运行期间生成的摘要先留在内存里，运行结束后重新检查线程，
+    摘要被覆盖或尚未写入时直接写回，不再调用模型。
+    """
+
+    def __init__(self, model, trigger_tokens: int = 4000, keep_turns: int = 2):
+        self.model = model
+        self.trigger_tokens = trigger_tokens
+        self.keep_turns = keep_turns
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # 每个会话最近一次生成的摘要，写入被运行覆盖时据此恢复
+        self._latest: Dict[str, Dict[str, Any]] = {}
+        # 每个会话进行中的代理运行数
+        self._running: Dict[str, int] = {}
+        # 摘要任务进行中时又请求的检查，任务结束后再执行一次
+        self._again: Dict[str, Tuple[Any, Dict[str, Any]]] = {}
+        self._stats = {"summaries": 0, "restored": 0, "failures": 0, "summarized_tokens": 0, "seconds": 0.0}
+
+    def pending(self, values: Dict[str, Any]) -> Optional[Tuple[List[BaseMessage], str]]:
+        """返回需要并入摘要的消息和新的截断点（第一条未覆盖消息的 ID），不需要时返回 None"""
+        messages = values.get("messages") or []
+        summary = values.get("summary")
+        start = 0
+        if summary:
+            start = next((i for i, m in enumerate(messages) if m.id == summary["until"]), 0)
+        # 最近 keep_turns 轮（从用户消息开始）始终原样保留
+        turns = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage) and i > start]
+        if self.keep_turns < 1 or len(turns) < self.keep_turns:
+            return None
+        end = turns[-self.keep_turns]
+        covered = messages[start:end]
+        if sum(message_tokens(m) for m in covered) < self.trigger_tokens:
+            return None
+        return covered, messages[end].id
+
+    async def summarize(self, previous: Optional[str], messages: Sequence[BaseMessage]) -> str:
+        prompt = f"Existing summary:\n{previous or '(none)'}\n\nNew turns:\n{_render(messages)}"
+        response = await self.model.ainvoke([SystemMessage(content=SUMMARY_PROMPT), HumanMessage(content=prompt)])
+        return response.content.strip()
+
+    @contextmanager
+    def run(self, graph, config: Dict[str, Any], session_id: str):
+        """包裹会话线程上的一次代理运行：运行期间不写入摘要，结束（含失败和取消）后在后台检查摘要"""
+        self._running[session_id] = self._running.get(session_id, 0) + 1
+        try:
+            yield
+        finally:
+            count = self._running.pop(session_id) - 1
+            if count:
+                self._running[session_id] = count
+            else:
+                self.schedule(graph, config, session_id)
+
+    def schedule(self, graph, config: Dict[str, Any], session_id: str):
+        """在后台检查并更新该会话的摘要，不阻塞请求"""
+        task = self._tasks.get(session_id)
+        if task is not None and not task.done():
+            # 进行中的任务读到的可能是旧状态，结束后再检查一次
+            self._again[session_id] = (graph, config)
+            return
+        task = asyncio.create_task(self._update(graph, config, session_id))
+        self._tasks[session_id] = task
+        task.add_done_callback(lambda t: self._finished(session_id, t))
+
+    def _finished(self, session_id: str, task: asyncio.Task):
+        if self._tasks.get(session_id) is not task:
+            return
+        del self._tasks[session_id]
+        again = self._again.pop(session_id, None)
+        if again is not None and not task.cancelled():
+            self.schedule(*again, session_id)
+
+    async def _restore(self, graph, config: Dict[str, Any], session_id: str, values: Dict[str, Any]) -> Dict[str, Any]:
+        """线程中的摘要比最近一次生成的旧（被运行的检查点覆盖或被推迟写入）时写回，返回更新后的状态"""
+        latest = self._latest.get(session_id)
+        current = values.get("summary")
+        if latest is None or (current and current["version"] >= latest["version"]):
+            return values
+        if not any(m.id == latest["until"] for m in values.get("messages") or []):
+            # 线程已被重置，旧摘要不再适用
+            del self._latest[session_id]
+            return values
+        if not self._running.get(session_id):
+            await graph.aupdate_state(config, {"summary": latest}, as_node="agent")
+            self._stats["restored"] += 1
+        return {**values, "summary": latest}
+
+    async def _update(self, graph, config: Dict[str, Any], session_id: str):
+        try:
+            values = (await graph.aget_state(config)).values
+            values = await self._restore(graph, config, session_id, values)
+            work = self.pending(values)
+            if work is None:
+                return
+            covered, until = work
+            previous = values.get("summary")
+            started = time.perf_counter()
+            text = await self.summarize(previous["text"] if previous else None, covered)
+            if not text:
+                return
+            version = (previous["version"] if previous else 0) + 1
+            summary = {"text": text, "until": until, "version": version}
+            self._latest[session_id] = summary
+            # 有运行进行中时不写入：它结束时会覆盖这次写入，由运行结束后的检查写回
+            if not self._running.get(session_id):
+                await graph.aupdate_state(config, {"summary": summary}, as_node="agent")
+            elapsed = time.perf_counter() - started
+            tokens = sum(message_tokens(m) for m in covered)
+            self._stats["summaries"] += 1
+            self._stats["summarized_tokens"] += tokens
+            self._stats["seconds"] += elapsed
+            print(f"📝 会话 {session_id} 摘要 v{version}: 合并 {len(covered)} 条消息（{tokens} tokens，{elapsed:.1f}s）")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._stats["failures"] += 1
+            print(f"⚠️ 会话 {session_id} 摘要失败: {e}")
+
+    def cancel(self, session_id: str):
+        self._latest.pop(session_id, None)
+        self._again.pop(session_id, None)
+        task = self._tasks.pop(session_id, None)
+        if task is not None:
+            task.cancel()
+
+    async def stop(self):
+        """取消所有进行中的摘要任务"""
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+        self._again.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "seconds": round(self._stats["seconds"], 3),
+            "running": len(self._tasks),
+            "trigger_tokens": self.trigger_tokens,
+            "keep_turns": self.keep_turns,
+        }
+
+
+def create_summarizer(model) -> Optional[HistorySummarizer]:
+    """根据环境变量创建摘要器（SUMMARY_ENABLED=False 时返回 None）"""
+    if os.getenv("SUMMARY_ENABLED", "True").lower() != "true":
+        return None
+    return HistorySummarizer(
+        model,
+        trigger_tokens=int(os.getenv("SUMMARY_TRIGGER_TOKENS", "4000")),
+        keep_turns=int(os.getenv("SUMMARY_KEEP_TURNS", "2")),
+    )
@@ -0,0 +1,51 @@
+import os
+import re
+from typing import Callable, Optional
+
+# 中日韩字符范围（正则字符类片段）
+CJK_RANGES = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+
+# 中日韩字符大致一个字符对应一个 token，其余文本约 4 个字符对应一个 token
+_CJK_RE = re.compile(f"[{CJK_RANGES}]")
+
+
+def estimate_tokens(text: str) -> int:
+    """快速估算文本的 token 数量（不依赖分词器）"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+# 可选的真实分词器：TOKENIZER=tiktoken:<编码名> 或 hf:<tokenizer.json 路径>，未配置或加载失败时使用估算
+_tokenizer = None
+_tokenizer_loaded = False
+
+
+def _load_tokenizer(spec: str) -> Optional[Callable[[str], int]]:
+    kind, _, name = spec.partition(":")
+    try:
+        if kind == "tiktoken":
+            import tiktoken
+            encoding = tiktoken.get_encoding(name or "cl100k_base")
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        if kind == "hf":
+            from tokenizers import Tokenizer
+            tokenizer = Tokenizer.from_file(name)
+            return lambda text: len(tokenizer.encode(text).ids)
+        print(f"⚠️ 未知的分词器类型: {spec}，使用估算")
+    except Exception as e:
+        print(f"⚠️ 分词器 {spec} 不可用，使用估算: {e}")
+    return None
+
+
+def count_tokens(text: str) -> int:
+    """计算 token 数：配置了分词器时精确计算，否则估算"""
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        spec = os.getenv("TOKENIZER", "")
+        _tokenizer = _load_tokenizer(spec) if spec else None
+        _tokenizer_loaded = True
+    if not text:
+        return 0
+    return _tokenizer(text) if _tokenizer is not None else estimate_tokens(text)
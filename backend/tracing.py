@@ -0,0 +1,330 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Dict, List, Optional, Sequence
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .tokens import estimate_tokens
+
+# LangGraph 给内部的写入/分支等运行打上这个标签，追踪时跳过，子运行挂到最近的可见祖先上
+HIDDEN_TAG = "langsmith:hidden"
+
+
+def _size(value: Any) -> int:
+    """载荷大小（UTF-8 字节数）"""
+    if value is None:
+        return 0
+    if not isinstance(value, str):
+        value = json.dumps(value, ensure_ascii=False, default=str)
+    return len(value.encode("utf-8"))
+
+
+def _message_text(messages: Sequence[Any]) -> str:
+    return "".join(str(getattr(m, "content", "") or "") for m in messages)
+
+
+class _RecordQueueHandler(QueueHandler):
+    """原样入队日志记录，追踪的 JSON 序列化留给写文件的线程"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.msg, ensure_ascii=False, default=str)
+
+
+class RunTracer(BaseCallbackHandler):
+    """基于 LangChain 回调的运行追踪器
+
+    记录每次运行中链（图节点）、模型调用和工具调用（含子代理 task）的嵌套 span，包括耗时、
+    token 数和输入/输出载荷大小。根运行结束时整条追踪交给后台线程序列化并写入按大小轮转的
+    JSONL 文件，最近的追踪同时保存在内存中，供 /api/runs/{run_id}/trace 查询。
+    """
+
+    # 回调只做记录，直接在事件循环中执行，无需放入线程池
+    run_inline = True
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_bytes: int = 10 * 1024 * 1024,
+        backup_count: int = 5,
+        max_runs: int = 100,
+    ):
+        self.path = path
+        self.max_runs = max_runs
+        self._lock = threading.Lock()
+        # span_id -> span；进行中和已结束但所属追踪尚未写出的 span
+        self._spans: Dict[UUID, Dict[str, Any]] = {}
+        # 运行 id -> 所属根运行 id
+        self._root_of: Dict[UUID, UUID] = {}
+        # 被跳过的内部运行 id -> 最近的可见祖先 span id
+        self._alias: Dict[UUID, Optional[UUID]] = {}
+        # 根运行 id -> 该追踪的全部运行 id（含被跳过的内部运行）
+        self._traces: Dict[UUID, List[UUID]] = {}
+        # 最近完成的追踪：根运行 id（字符串）-> 记录
+        self._recent: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+        self._logger = None
+        self._listener: Optional[QueueListener] = None
+        self._writing = False
+        if path:
+            try:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+                handler.setFormatter(_JsonFormatter())
+                # 回调在事件循环中执行：只把记录放入队列，序列化、写文件和轮转都在监听线程中完成
+                records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+                self._listener = QueueListener(records, handler)
+                self._logger = logging.getLogger(f"{__name__}.{id(self)}")
+                self._logger.setLevel(logging.INFO)
+                self._logger.propagate = False
+                self._logger.addHandler(_RecordQueueHandler(records))
+            except Exception as e:
+                print(f"⚠️ 追踪文件不可用，仅在内存中保存追踪: {e}")
+
+    # ---- span 生命周期 ----
+
+    def _start(
+        self,
+        run_id: UUID,
+        parent_run_id: Optional[UUID],
+        kind: str,
+        name: str,
+        tags: Optional[List[str]],
+        **fields: Any,
+    ):
+        with self._lock:
+            parent = self._alias.get(parent_run_id, parent_run_id) if parent_run_id else None
+            root = self._root_of.get(parent, run_id) if parent else run_id
+            self._root_of[run_id] = root
+            self._traces.setdefault(root, []).append(run_id)
+            if tags and HIDDEN_TAG in tags:
+                self._alias[run_id] = parent
+                return
+            self._spans[run_id] = {
+                "id": str(run_id),
+                "parent_id": str(parent) if parent else None,
+                "kind": kind,
+                "name": name,
+                "start": time.time(),
+                "end": None,
+                "duration_ms": None,
+                "status": "running",
+                **fields,
+            }
+
+    def _end(self, run_id: UUID, status: str = "ok", **fields: Any):
+        record = None
+        with self._lock:
+            root = self._root_of.pop(run_id, None)
+            if run_id in self._alias:
+                del self._alias[run_id]
+            elif run_id in self._spans:
+                span = self._spans[run_id]
+                span["end"] = time.time()
+                span["duration_ms"] = round((span["end"] - span["start"]) * 1000, 2)
+                span["status"] = status
+                span.update(fields)
+            if root is not None and run_id == root:
+                record = self._collect(root)
+        if record is not None:
+            self._write(record)
+
+    def _collect(self, root: UUID) -> Optional[Dict[str, Any]]:
+        """根运行结束：取出整条追踪（调用时已持有锁）"""
+        run_ids = self._traces.pop(root, [])
+        spans = [self._spans.pop(run_id) for run_id in run_ids if run_id in self._spans]
+        # 运行被取消时，子运行可能收不到结束回调：随追踪一起丢弃它们的记录，标记为已取消
+        for run_id in run_ids:
+            self._root_of.pop(run_id, None)
+            self._alias.pop(run_id, None)
+        for span in spans:
+            if span["end"] is None:
+                span["status"] = "cancelled"
+        if not spans:
+            return None
+        record = {
+            "run_id": str(root),
+            "start": spans[0]["start"],
+            "duration_ms": spans[0]["duration_ms"],
+            "spans": spans,
+        }
+        self._recent[record["run_id"]] = record
+        while len(self._recent) > self.max_runs:
+            self._recent.popitem(last=False)
+        return record
+
+    def _write(self, record: Dict[str, Any]):
+        if self._logger is None:
+            return
+        with self._lock:
+            if not self._writing:
+                self._listener.start()
+                self._writing = True
+        self._logger.info(record)
+
+    def close(self):
+        """写完队列中剩余的追踪并停止写文件的线程（之后再有追踪时会重新启动）"""
+        with self._lock:
+            if not self._writing:
+                return
+            self._writing = False
+            self._listener.stop()
+            for handler in self._listener.handlers:
+                handler.close()
+
+    # ---- LangChain 回调 ----
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name") or "chain"
+        self._start(run_id, parent_run_id, "chain", name, tags)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, "error", error=str(error)[:500])
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name") or "chat_model"
+        batch = messages[0] if messages else []
+        text = _message_text(batch)
+        self._start(
+            run_id, parent_run_id, "llm", name, tags,
+            input_bytes=len(text.encode("utf-8")),
+            prompt_tokens=estimate_tokens(text),
+            messages=len(batch),
+        )
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name") or "llm"
+        text = "".join(prompts)
+        self._start(
+            run_id, parent_run_id, "llm", name, tags,
+            input_bytes=len(text.encode("utf-8")),
+            prompt_tokens=estimate_tokens(text),
+        )
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        text = ""
+        tool_calls = 0
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        for generations in response.generations:
+            for generation in generations:
+                text += generation.text or ""
+                message = getattr(generation, "message", None)
+                tool_calls += len(getattr(message, "tool_calls", None) or [])
+                usage = usage or (getattr(message, "usage_metadata", None) or {})
+        fields = {
+            "output_bytes": len(text.encode("utf-8")),
+            "completion_tokens": usage.get("completion_tokens") or usage.get("output_tokens") or estimate_tokens(text),
+            "tool_calls": tool_calls,
+        }
+        prompt_tokens = usage.get("prompt_tokens") or usage.get("input_tokens")
+        if prompt_tokens:
+            fields["prompt_tokens"] = prompt_tokens
+        self._end(run_id, **fields)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, "error", error=str(error)[:500])
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        name = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+        self._start(run_id, parent_run_id, "tool", name, tags, input_bytes=_size(input_str))
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id, output_bytes=_size(getattr(output, "content", output)))
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, "error", error=str(error)[:500])
+
+    # ---- 查询 ----
+
+    def get_trace(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """
+        返回可直接绘制瀑布图的嵌套追踪树；运行仍在进行时返回当前已有的 span
+
+        内存中找不到时会扫描轮转的追踪文件，事件循环中应放到线程里调用。
+        """
+        with self._lock:
+            record = self._recent.get(run_id)
+            if record is None:
+                try:
+                    root = UUID(run_id)
+                except ValueError:
+                    return None
+                if root in self._traces:
+                    spans = [dict(self._spans[s]) for s in self._traces[root] if s in self._spans]
+                    record = {"run_id": run_id, "start": spans[0]["start"], "duration_ms": None, "spans": spans}
+        if record is None:
+            record = self._read(run_id)
+        if record is None:
+            return None
+        return {
+            "run_id": record["run_id"],
+            "duration_ms": record["duration_ms"],
+            "in_progress": record["duration_ms"] is None,
+            "root": _build_tree(record["spans"]),
+        }
+
+    def _read(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """在轮转的 JSONL 文件中查找较早的追踪"""
+        if not self.path:
+            return None
+        marker = f'"run_id": "{run_id}"'
+        candidates = [self.path] + [f"{self.path}.{i}" for i in range(1, 100)]
+        for candidate in candidates:
+            if not os.path.exists(candidate):
+                if candidate != self.path:
+                    break
+                continue
+            try:
+                with open(candidate, encoding="utf-8") as f:
+                    for line in f:
+                        if line.startswith("{" + marker):
+                            return json.loads(line)
+            except Exception as e:
+                print(f"⚠️ 读取追踪文件失败: {e}")
+        return None
+
+
+def _build_tree(spans: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """把扁平的 span 列表组装成树；start_ms 为相对根 span 开始时间的偏移"""
+    if not spans:
+        return None
+    origin = spans[0]["start"]
+    nodes = {}
+    for span in spans:
+        node = {k: v for k, v in span.items() if k not in ("start", "end", "parent_id")}
+        node["start_ms"] = round((span["start"] - origin) * 1000, 2)
+        node["children"] = []
+        nodes[span["id"]] = node
+    root = nodes[spans[0]["id"]]
+    for span in spans[1:]:
+        parent = nodes.get(span["parent_id"], root)
+        parent["children"].append(nodes[span["id"]])
+    return root
+
+
+tracer = (
+    RunTracer(
+        path=os.getenv("TRACE_PATH", "data/traces.jsonl") or None,
+        max_bytes=int(os.getenv("TRACE_MAX_BYTES", str(10 * 1024 * 1024))),
+        backup_count=int(os.getenv("TRACE_BACKUP_COUNT", "5")),
+        max_runs=int(os.getenv("TRACE_MAX_RUNS", "100")),
+    )
+    if os.getenv("TRACE_ENABLED", "True").lower() == "true"
+    else None
+)
@@ -0,0 +1,3 @@
+"""
+离线性能基准测试：模型/搜索桩服务和负载生成器
+"""
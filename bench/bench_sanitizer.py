@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+回答清理微基准：对比旧的多次 re.sub 实现和 backend.sanitizer 的单遍实现
+
+示例：
+    python -m bench.bench_sanitizer --sizes 10000 50000 200000 --repeat 20
+"""
+
+import re
+import json
+import time
+import random
+import argparse
+from typing import Callable, Dict, List
+
+from backend.sanitizer import StreamSanitizer, sanitize
+
+_LEGACY_INTERNAL_PATTERNS = [
+    r'写入.*?\.txt.*?文件.*?中',
+    r'将.*?写入.*?文件',
+    r'写入.*?文件',
+    r'保存到.*?文件',
+    r'创建.*?文件',
+    r'question\.txt',
+    r'final_report\.md',
+    r'使用.*?代理',
+    r'调用.*?代理',
+    r'research-agent',
+    r'critique-agent',
+]
+
+
+def legacy_process_sanitize(text: str) -> str:
+    """旧的非流式清理（未预编译的 11 个短语、3 个代码正则、行过滤和空行合并）"""
+    for pattern in _LEGACY_INTERNAL_PATTERNS:
+        text = re.sub(pattern, '', text, flags=re.IGNORECASE)
+    text = re.sub(r'```python.*?```', '', text, flags=re.DOTALL)
+    text = re.sub(r'```.*?```', '', text, flags=re.DOTALL)
+    text = re.sub(r'`[^`]*`', '', text)
+    lines = []
+    for line in text.split('\n'):
+        line = line.strip()
+        if line and not any(line.startswith(prefix) for prefix in ['将原始用户问题', '写入', '保存', '创建', '调用', '使用']):
+            lines.append(line)
+    return re.sub(r'\n\s*\n', '\n\n', '\n'.join(lines).strip())
+
+
+def make_report(size: int, seed: int = 0) -> str:
+    """生成带标题、列表、行内代码、代码块和内部指令的 Markdown 报告"""
+    rng = random.Random(seed)
+    blocks = [
+        "## 发展历程\n",
+        "人工智能在过去几十年经历了多次起伏，`深度学习` 的兴起带来了新的突破。\n",
+        "- 早期的符号主义方法\n- 统计学习方法\n  - 支持向量机\n  - 决策树\n",
+        "```python\nimport numpy as np\nprint(np.arange(10))\n```\n",
+        "使用 research-agent 代理进行深入研究，并将结果写入 final_report.md 文件。\n",
+        "The transformer architecture (Vaswani et al., 2017) replaced recurrence with attention.\n",
+        "\n\n",
+    ]
+    parts: List[str] = []
+    total = 0
+    while total < size:
+        block = rng.choice(blocks)
+        parts.append(block)
+        total += len(block)
+    return "".join(parts)[:size]
+
+
+def stream_sanitize(text: str, token_chars: int = 4) -> str:
+    """按 token 大小切片增量清理"""
+    sanitizer = StreamSanitizer()
+    out = [sanitizer.feed(text[i:i + token_chars]) for i in range(0, len(text), token_chars)]
+    out.append(sanitizer.flush())
+    return "".join(out)
+
+
+def _time(func: Callable[[str], str], text: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回答清理微基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000, 200000], help="报告字符数")
+    parser.add_argument("--repeat", type=int, default=20, help="每项重复次数（取最好成绩）")
+    args = parser.parse_args()
+
+    results: List[Dict[str, float]] = []
+    for size in args.sizes:
+        text = make_report(size)
+        legacy = _time(legacy_process_sanitize, text, args.repeat)
+        current = _time(sanitize, text, args.repeat)
+        streamed = _time(stream_sanitize, text, args.repeat)
+        results.append({
+            "chars": size,
+            "legacy_ms": round(legacy * 1000, 3),
+            "sanitize_ms": round(current * 1000, 3),
+            "stream_ms": round(streamed * 1000, 3),
+            "speedup": round(legacy / current, 2) if current else None,
+        })
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
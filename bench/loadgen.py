@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+负载生成器：以固定并发驱动 /api/chat 和 /api/chat/stream，输出 JSON 报告
+
+报告包含吞吐量、p50/p95/p99 延迟、首个事件时间（流式）和错误率。
+"""
+
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """毫秒级统计（p50/p95/p99/mean/max），无数据时为 None"""
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+        return round(ordered[index] * 1000, 2)
+
+    return {
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 2),
+        "max": round(ordered[-1] * 1000, 2),
+    }
+
+
+class LoadGenerator:
+    def __init__(
+        self,
+        base_url: str,
+        concurrency: int = 4,
+        requests: int = 20,
+        agent_type: str = "general",
+        message: str = "请简单介绍一下人工智能的发展历史",
+        unique: bool = True,
+        timeout: float = 600.0,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self.requests = requests
+        self.agent_type = agent_type
+        self.message = message
+        self.unique = unique
+        self.timeout = timeout
+
+    def _message(self, index: int) -> str:
+        # 默认每个请求的问题不同，避免被单飞合并或缓存命中掩盖真实开销
+        return f"{self.message} #{index}" if self.unique else self.message
+
+    async def _chat(self, client: httpx.AsyncClient, index: int) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            response = await client.post(
+                "/api/chat",
+                json={"message": self._message(index), "session_id": f"bench-{uuid.uuid4().hex}", "agent_type": self.agent_type},
+            )
+            ok = response.status_code == 200
+            return {"ok": ok, "status": response.status_code, "latency": time.perf_counter() - started}
+        except Exception as e:
+            return {"ok": False, "status": type(e).__name__, "latency": time.perf_counter() - started}
+
+    async def _stream(self, client: httpx.AsyncClient, index: int) -> Dict[str, Any]:
+        started = time.perf_counter()
+        first_event = first_content = None
+        status: Any = None
+        ok = False
+        try:
+            async with client.stream(
+                "GET",
+                f"/api/chat/stream/bench-{uuid.uuid4().hex}",
+                params={"message": self._message(index), "agent_type": self.agent_type},
+            ) as response:
+                status = response.status_code
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    now = time.perf_counter()
+                    if first_event is None:
+                        first_event = now - started
+                    event = json.loads(line[6:])
+                    kind = event.get("type")
+                    if kind == "content" and first_content is None:
+                        first_content = now - started
+                    if kind == "complete":
+                        ok = True
+                    if kind in ("error", "agent_error") or "error" in event:
+                        ok = False
+                        status = "error_event"
+        except Exception as e:
+            status = type(e).__name__
+        return {
+            "ok": ok and status == 200,
+            "status": status,
+            "latency": time.perf_counter() - started,
+            "first_event": first_event,
+            "first_content": first_content,
+        }
+
+    async def run(self, endpoint: str) -> Dict[str, Any]:
+        """endpoint 为 chat 或 stream"""
+        call = self._chat if endpoint == "chat" else self._stream
+        queue: asyncio.Queue = asyncio.Queue()
+        for index in range(self.requests):
+            queue.put_nowait(index)
+        results: List[Dict[str, Any]] = []
+
+        async def worker(client: httpx.AsyncClient):
+            while not queue.empty():
+                results.append(await call(client, queue.get_nowait()))
+
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=limits) as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(worker(client) for _ in range(self.concurrency)))
+            elapsed = time.perf_counter() - started
+
+        statuses: Dict[str, int] = {}
+        for result in results:
+            statuses[str(result["status"])] = statuses.get(str(result["status"]), 0) + 1
+        errors = sum(1 for result in results if not result["ok"])
+        report = {
+            "endpoint": "/api/chat" if endpoint == "chat" else "/api/chat/stream",
+            "requests": len(results),
+            "concurrency": self.concurrency,
+            "duration_s": round(elapsed, 3),
+            "throughput_rps": round(len(results) / elapsed, 3) if elapsed else None,
+            "errors": errors,
+            "error_rate": round(errors / len(results), 4) if results else None,
+            "status_counts": statuses,
+            "latency_ms": percentiles([r["latency"] for r in results if r["ok"]]),
+        }
+        if endpoint == "stream":
+            report["time_to_first_event_ms"] = percentiles([r["first_event"] for r in results if r.get("first_event") is not None])
+            report["time_to_first_content_ms"] = percentiles([r["first_content"] for r in results if r.get("first_content") is not None])
+        return report
+
+
+async def run_load(args) -> Dict[str, Any]:
+    generator = LoadGenerator(
+        base_url=args.base_url,
+        concurrency=args.concurrency,
+        requests=args.requests,
+        agent_type=args.agent_type,
+        message=args.message,
+        unique=not args.same_message,
+    )
+    endpoints = ["chat", "stream"] if args.endpoint == "both" else [args.endpoint]
+    return {
+        "base_url": args.base_url,
+        "agent_type": args.agent_type,
+        "results": [await generator.run(endpoint) for endpoint in endpoints],
+    }
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--endpoint", choices=["chat", "stream", "both"], default="both")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发请求数")
+    parser.add_argument("--requests", type=int, default=20, help="每个接口的请求总数")
+    parser.add_argument("--agent-type", default="general", choices=["research", "critique", "general"])
+    parser.add_argument("--message", default="请简单介绍一下人工智能的发展历史")
+    parser.add_argument("--same-message", action="store_true", help="所有请求使用相同的问题（测试单飞合并）")
+    parser.add_argument("--output", help="报告输出路径（默认只打印）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deep Agent System 负载生成器")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    report = asyncio.run(run_load(args))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
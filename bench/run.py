@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+一键离线基准测试：启动模型桩、搜索桩和应用服务器，运行负载生成器并输出 JSON 报告
+
+示例：
+    python -m bench.run --concurrency 8 --requests 50 --output bench_report.json
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+import httpx
+
+from .loadgen import add_arguments, run_load
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _spawn(args, env=None) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, *args], cwd=ROOT, env=env)
+
+
+def _wait_ready(url: str, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"服务未在 {timeout} 秒内就绪: {url}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deep Agent System 离线基准测试")
+    parser.add_argument("--port", type=int, default=8100, help="应用服务器端口")
+    parser.add_argument("--llm-port", type=int, default=9101)
+    parser.add_argument("--search-port", type=int, default=9102)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="模型首 token 延迟（秒）")
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0, help="模型输出 token 速率")
+    parser.add_argument("--completion-tokens", type=int, default=200, help="每次回答的 token 数")
+    parser.add_argument("--search-latency", type=float, default=0.3, help="搜索延迟（秒）")
+    parser.add_argument("--workers", type=int, default=1, help="应用服务器 worker 数")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="deepagent-bench-")
+    env = {
+        **os.environ,
+        "CUSTOM_API_BASE_URL": f"http://127.0.0.1:{args.llm_port}",
+        "CUSTOM_API_KEY": "bench",
+        "TAVILY_API_BASE_URL": f"http://127.0.0.1:{args.search_port}",
+        "TAVILY_API_KEY": "bench",
+        # 关闭跨请求缓存，测量真实的每请求开销；状态文件写到临时目录
+        "SEARCH_CACHE_ENABLED": "False",
+        "LLM_CACHE_ENABLED": "False",
+        "TRACE_PATH": os.path.join(workdir, "traces.jsonl"),
+        "SESSION_DB_PATH": os.path.join(workdir, "sessions.sqlite3"),
+    }
+    if args.workers > 1:
+        env["SESSION_STORE"] = "sqlite"
+        env["CHECKPOINTER"] = "sqlite"
+        env["CHECKPOINT_DB_PATH"] = os.path.join(workdir, "checkpoints.sqlite3")
+
+    processes = [
+        _spawn(["-m", "bench.stub_llm", "--port", str(args.llm_port), "--latency", str(args.llm_latency),
+                "--tokens-per-sec", str(args.tokens_per_sec), "--completion-tokens", str(args.completion_tokens)]),
+        _spawn(["-m", "bench.stub_search", "--port", str(args.search_port), "--latency", str(args.search_latency)]),
+        _spawn(["-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1", "--port", str(args.port),
+                "--workers", str(args.workers), "--log-level", "warning"], env=env),
+    ]
+    try:
+        print("🚀 启动桩服务和应用服务器...")
+        _wait_ready(f"http://127.0.0.1:{args.llm_port}/stats")
+        _wait_ready(f"http://127.0.0.1:{args.search_port}/stats")
+        _wait_ready(f"http://127.0.0.1:{args.port}/api/health", timeout=120.0)
+
+        print(f"📈 开始压测: 并发 {args.concurrency}，每个接口 {args.requests} 个请求")
+        args.base_url = f"http://127.0.0.1:{args.port}"
+        report = asyncio.run(run_load(args))
+        report["config"] = {
+            "llm_latency": args.llm_latency,
+            "tokens_per_sec": args.tokens_per_sec,
+            "completion_tokens": args.completion_tokens,
+            "search_latency": args.search_latency,
+            "workers": args.workers,
+        }
+        report["upstream_requests"] = {
+            "llm": httpx.get(f"http://127.0.0.1:{args.llm_port}/stats").json()["requests"],
+            "search": httpx.get(f"http://127.0.0.1:{args.search_port}/stats").json()["requests"],
+        }
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        print(text)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(text)
+            print(f"📝 报告已写入 {args.output}")
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    main()
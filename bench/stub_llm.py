@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+OpenAI 兼容的 /chat/completions 桩服务（流式和非流式）
+
+首 token 延迟和 token 速率可配置，用于在离线环境下对系统做压测。
+请求中带有 internet_search 工具且对话中还没有工具结果时，先返回一次搜索工具调用，
+模拟"搜索 -> 回答"的典型代理轮次。
+"""
+
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+def create_app(latency: float = 0.2, tokens_per_sec: float = 50.0, completion_tokens: int = 200) -> FastAPI:
+    """latency 为首 token 延迟（秒），tokens_per_sec 为之后的输出速率"""
+    app = FastAPI(title="LLM Stub")
+    app.state.requests = 0
+
+    def _answer_tokens(messages: List[Dict[str, Any]]) -> List[str]:
+        question = next(
+            (str(m.get("content") or "") for m in reversed(messages) if m.get("role") == "user"), ""
+        )
+        words = [f"stub answer to {question[:40]!r}:"] + [f"token{i}" for i in range(completion_tokens - 1)]
+        return [w + " " for w in words]
+
+    def _tool_call(payload: Dict[str, Any]):
+        tools = {t.get("function", {}).get("name") for t in payload.get("tools") or []}
+        messages = payload.get("messages") or []
+        if "internet_search" not in tools or any(m.get("role") == "tool" for m in messages):
+            return None
+        question = next((str(m.get("content") or "") for m in reversed(messages) if m.get("role") == "user"), "")
+        return {
+            "id": f"call_{uuid.uuid4().hex[:12]}",
+            "type": "function",
+            "function": {"name": "internet_search", "arguments": json.dumps({"query": question[:200]})},
+        }
+
+    def _usage(payload: Dict[str, Any], completion: int) -> Dict[str, int]:
+        prompt = sum(len(str(m.get("content") or "")) // 4 for m in payload.get("messages") or [])
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+    @app.post("/chat/completions")
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        app.state.requests += 1
+        tool_call = _tool_call(payload)
+        tokens = [] if tool_call else _answer_tokens(payload.get("messages") or [])
+        interval = 1.0 / tokens_per_sec if tokens_per_sec > 0 else 0.0
+
+        if not payload.get("stream"):
+            await asyncio.sleep(latency + interval * len(tokens))
+            message = {"role": "assistant", "content": "".join(tokens)}
+            if tool_call:
+                message["tool_calls"] = [tool_call]
+            return JSONResponse({
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": payload.get("model", "stub"),
+                "choices": [{
+                    "index": 0,
+                    "message": message,
+                    "finish_reason": "tool_calls" if tool_call else "stop",
+                }],
+                "usage": _usage(payload, len(tokens)),
+            })
+
+        async def events():
+            await asyncio.sleep(latency)
+            if tool_call:
+                delta = {"role": "assistant", "tool_calls": [{"index": 0, **tool_call}]}
+                yield f"data: {json.dumps({'choices': [{'index': 0, 'delta': delta}]})}\n\n"
+            for token in tokens:
+                yield f"data: {json.dumps({'choices': [{'index': 0, 'delta': {'content': token}}]})}\n\n"
+                if interval:
+                    await asyncio.sleep(interval)
+            finish = {"index": 0, "delta": {}, "finish_reason": "tool_calls" if tool_call else "stop"}
+            yield f"data: {json.dumps({'choices': [finish], 'usage': _usage(payload, len(tokens))})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": app.state.requests}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的模型桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9101)
+    parser.add_argument("--latency", type=float, default=0.2, help="首 token 延迟（秒）")
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0, help="输出 token 速率")
+    parser.add_argument("--completion-tokens", type=int, default=200, help="每次回答的 token 数")
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(
+        create_app(args.latency, args.tokens_per_sec, args.completion_tokens),
+        host=args.host, port=args.port, log_level="warning",
+    )
+
+
+if __name__ == "__main__":
+    main()
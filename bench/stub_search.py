@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Tavily 兼容的 /search 桩服务
+
+通过 TAVILY_API_BASE_URL 指向本服务即可离线压测，延迟、结果数和原文长度可配置。
+"""
+
+import asyncio
+import argparse
+
+from fastapi import FastAPI, Request
+
+
+def create_app(latency: float = 0.3, raw_content_chars: int = 20000) -> FastAPI:
+    app = FastAPI(title="Search Stub")
+    app.state.requests = 0
+
+    @app.post("/search")
+    async def search(request: Request):
+        payload = await request.json()
+        app.state.requests += 1
+        await asyncio.sleep(latency)
+        query = payload.get("query", "")
+        paragraph = f"This paragraph discusses {query}. " * 8
+        raw_content = "\n\n".join([paragraph] * max(1, raw_content_chars // len(paragraph)))
+        return {
+            "query": query,
+            "results": [
+                {
+                    "title": f"Result {i} for {query}",
+                    "url": f"https://example.com/{i}",
+                    "content": f"Summary {i} about {query}.",
+                    "score": round(1.0 - i * 0.05, 2),
+                    "raw_content": raw_content if payload.get("include_raw_content") else None,
+                }
+                for i in range(int(payload.get("max_results", 5)))
+            ],
+        }
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": app.state.requests}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tavily 兼容的搜索桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9102)
+    parser.add_argument("--latency", type=float, default=0.3, help="每次搜索的延迟（秒）")
+    parser.add_argument("--raw-content-chars", type=int, default=20000, help="每条结果的原文长度")
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(create_app(args.latency, args.raw_content_chars), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
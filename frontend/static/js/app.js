@@ -130,6 +130,10 @@ class DeepAgentChat {
                                 this.updateMessageContent(assistantMessageElement, data.message, 'start');
                                 break;
                             
+                            case 'queued':
+                                this.updateMessageContent(assistantMessageElement, data.message, 'queued');
+                                break;
+                            
                             case 'agent_selected':
                                 this.updateMessageContent(assistantMessageElement, data.message, 'agent-selected');
                                 break;
@@ -179,6 +183,11 @@ class DeepAgentChat {
                                 this.updateMessageContent(assistantMessageElement, fullMessage, 'content', progressText);
                                 break;
                             
+                            case 'content_reset':
+                                // 上一轮模型输出只是中间步骤，丢弃已显示的内容
+                                fullMessage = '';
+                                break;
+                            
                             case 'agent_error':
                                 this.updateMessageContent(assistantMessageElement, data.message, 'agent-error');
                                 break;
@@ -188,6 +197,10 @@ class DeepAgentChat {
                                 break;
                             
                             case 'complete':
+                                // 使用服务端清理后的完整回答替换流式 token
+                                if (data.content) {
+                                    fullMessage = data.content;
+                                }
                                 this.updateMessageContent(assistantMessageElement, fullMessage, 'complete');
                                 if (sources.length > 0) {
                                     this.addSources(assistantMessageElement, sources);
@@ -265,6 +278,9 @@ class DeepAgentChat {
             case 'start':
                 messageText.innerHTML = `<div class="status-message"><i class="fas fa-robot fa-spin mr-2 text-indigo-600"></i>${content}</div>`;
                 break;
+            case 'queued':
+                messageText.innerHTML = `<div class="status-message"><i class="fas fa-hourglass-half mr-2 text-yellow-600"></i>${content}</div>`;
+                break;
             case 'agent-selected':
                 messageText.innerHTML = `<div class="status-message"><i class="fas fa-check text-green-500 mr-2"></i>${content}</div>`;
                 break;
@@ -4,25 +4,51 @@ Deep Agent System 启动脚本
 """
 
 import os
+import re
 import sys
 import subprocess
 import argparse
 from pathlib import Path
+from importlib import metadata
 
 def check_requirements():
-    """检查依赖是否安装"""
-    try:
-        import fastapi
-        import uvicorn
-        import tavily
-        import langchain
-        import langgraph
-        print("✓ 所有依赖已安装")
-        return True
-    except ImportError as e:
-        print(f"✗ 缺少依赖: {e}")
+    """检查依赖是否安装（只读取包元数据，不导入，避免在父进程中加载重量级模块）"""
+    missing = []
+    for line in Path("requirements.txt").read_text(encoding="utf-8").splitlines():
+        name = re.split(r"[<>=!~;\[\s]", line.strip(), maxsplit=1)[0]
+        if not name or name.startswith("#"):
+            continue
+        try:
+            metadata.version(name)
+        except metadata.PackageNotFoundError:
+            missing.append(name)
+    if missing:
+        print(f"✗ 缺少依赖: {', '.join(missing)}")
         print("请运行: pip install -r requirements.txt")
         return False
+    print("✓ 所有依赖已安装")
+    return True
+
+def profile_imports(top: int = 25):
+    """在子进程中用 -X importtime 导入 backend.main，按累计耗时列出最慢的模块"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import backend.main"],
+        capture_output=True, text=True, cwd=Path(__file__).resolve().parent,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)", line)
+        if match:
+            rows.append((int(match.group(2)), int(match.group(1)), len(match.group(3)) // 2, match.group(4)))
+    if result.returncode != 0 or not rows:
+        print(f"✗ 导入 backend.main 失败:\n{result.stderr[-2000:]}")
+        return False
+    total = next((row[0] for row in rows if row[3] == "backend.main"), max(row[0] for row in rows))
+    print(f"⏱️ 导入 backend.main 共 {total / 1000:.0f} ms，累计耗时最多的 {top} 个模块：")
+    print(f"{'累计(ms)':>10} {'自身(ms)':>10}  模块")
+    for cumulative, own, depth, name in sorted(rows, reverse=True)[:top]:
+        print(f"{cumulative / 1000:>10.1f} {own / 1000:>10.1f}  {'  ' * min(depth, 8)}{name}")
+    return True
 
 def check_deepagents_source():
     """检查本地 deepagents 源码"""
@@ -89,10 +115,15 @@ def main():
     parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"), help="服务器主机地址")
     parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 8000)), help="服务器端口")
     parser.add_argument("--reload", action="store_true", help="启用自动重载")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKERS", 1)), help="uvicorn worker 进程数")
     parser.add_argument("--check", action="store_true", help="仅检查环境")
+    parser.add_argument("--profile-imports", action="store_true", help="输出导入 backend.main 的耗时分析")
     
     args = parser.parse_args()
     
+    if args.profile_imports:
+        sys.exit(0 if profile_imports() else 1)
+    
     print("🤖 Deep Agent System 启动检查...")
     print("=" * 50)
     
@@ -115,6 +146,13 @@ def main():
         print("✓ 所有检查通过！")
         return
     
+    if args.workers > 1 and os.getenv("SESSION_STORE", "memory").lower() != "sqlite":
+        print("⚠️ 多个 worker 之间无法共享内存会话，请设置 SESSION_STORE=sqlite")
+    if args.workers > 1 and os.getenv("CHECKPOINTER", "memory").lower() not in ("sqlite", "off"):
+        # 每个 worker 各自保存一份线程，同一会话的历史会分散到不同 worker 上
+        print("✗ 多个 worker 之间无法共享内存检查点，请设置 CHECKPOINTER=sqlite（或 off 关闭多轮记忆）")
+        sys.exit(1)
+    
     print("=" * 50)
     print("🚀 启动 Deep Agent System...")
     print(f"📍 地址: http://{args.host}:{args.port}")
@@ -131,6 +169,7 @@ def main():
             host=args.host,
             port=args.port,
             reload=args.reload,
+            workers=None if args.reload else args.workers,
             log_level="info"
         )
     except KeyboardInterrupt:
@@ -0,0 +1,17 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# backend 以包的形式导入，本地 deepagents 以顶层模块导入
+for path in (ROOT, os.path.join(ROOT, "backend")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# 模块在导入时读取配置：测试不访问真实的模型、搜索服务，也不写追踪和缓存文件
+os.environ.setdefault("CUSTOM_API_BASE_URL", "http://model.invalid")
+os.environ.setdefault("CUSTOM_API_KEY", "test")
+os.environ["TRACE_PATH"] = ""
+os.environ["SEARCH_CACHE_ENABLED"] = "False"
+os.environ["LLM_CACHE_ENABLED"] = "False"
+os.environ["SUMMARY_ENABLED"] = "False"
+os.environ["CASSETTE_MODE"] = "off"
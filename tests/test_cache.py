@@ -0,0 +1,66 @@
+import asyncio
+import threading
+
+from backend.cache import PersistentLRUCache
+
+
+def test_async_round_trip_through_disk(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+
+    async def scenario():
+        cache = PersistentLRUCache(db_path=path)
+        await cache.aset("k", {"answer": "值"}, ttl=60)
+        assert await cache.aget("k") == {"answer": "值"}
+        # 新实例只有磁盘层，读取走磁盘回源
+        reopened = PersistentLRUCache(db_path=path)
+        return await reopened.aget("k"), await reopened.aget("missing"), reopened.stats()
+
+    value, missing, stats = asyncio.run(scenario())
+    assert value == {"answer": "值"}
+    assert missing is None
+    assert stats["disk_hits"] == 1 and stats["misses"] == 1
+
+
+def test_disk_io_runs_off_the_event_loop_thread(tmp_path, monkeypatch):
+    cache = PersistentLRUCache(db_path=str(tmp_path / "cache.sqlite3"))
+    cache.set("k", [1, 2, 3], ttl=60)
+    cache._entries.clear()
+    threads = []
+    get_disk = cache._get_disk
+
+    def recording_get_disk(key, now):
+        threads.append(threading.get_ident())
+        return get_disk(key, now)
+
+    monkeypatch.setattr(cache, "_get_disk", recording_get_disk)
+
+    async def scenario():
+        return threading.get_ident(), await cache.aget("k")
+
+    loop_thread, value = asyncio.run(scenario())
+    assert value == [1, 2, 3]
+    assert threads and threads[0] != loop_thread
+
+
+def _disk_keys(cache):
+    return [row[0] for row in cache._db.execute(f"SELECT key FROM {cache.table} ORDER BY key")]
+
+
+def test_disk_layer_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(PersistentLRUCache, "maintain_every", 5)
+    cache = PersistentLRUCache(db_path=str(tmp_path / "cache.sqlite3"), max_disk_entries=6)
+    for i in range(4):
+        cache.set(f"old{i}", i, ttl=-1)  # 已过期
+    for i in range(12):
+        cache.set(f"k{i:02d}", i, ttl=60 + i)
+
+    # 每 5 次写入清理一次：过期条目被删除，超出上限时先删除最早过期的条目；两次清理之间可暂时超出
+    assert _disk_keys(cache) == [f"k{i:02d}" for i in range(5, 12)]
+    for i in range(12, 16):
+        cache.set(f"k{i:02d}", i, ttl=60 + i)
+    assert _disk_keys(cache) == [f"k{i:02d}" for i in range(10, 16)]
+    assert cache.stats()["disk_evictions"] == 10
+
+    # 重新打开时也会清理
+    reopened = PersistentLRUCache(db_path=str(tmp_path / "cache.sqlite3"), max_disk_entries=3)
+    assert _disk_keys(reopened) == ["k13", "k14", "k15"]
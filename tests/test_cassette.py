@@ -0,0 +1,67 @@
+import asyncio
+import threading
+
+from backend.cassette import Cassette
+
+
+def _payload(system_prompt, date, question, stream=False):
+    return {
+        "model": "m",
+        "stream": stream,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": date},
+            {"role": "user", "content": question},
+        ],
+        "tools": [{"type": "function", "function": {"name": "task", "description": system_prompt}}],
+    }
+
+
+def test_key_ignores_system_messages_tool_descriptions_and_stream():
+    recorded = Cassette.key("llm", _payload("old prompt", "Current date: 2026-10-16", "q"))
+    replayed = Cassette.key("llm", _payload("edited prompt", "Current date: 2026-10-17", "q", stream=True))
+    assert recorded == replayed
+
+
+def test_key_still_distinguishes_conversation():
+    assert Cassette.key("llm", _payload("p", "d", "q1")) != Cassette.key("llm", _payload("p", "d", "q2"))
+    assert Cassette.key("llm", _payload("p", "d", "q")) != Cassette.key("search", _payload("p", "d", "q"))
+
+
+def test_replay_hits_recording_made_with_another_prompt(tmp_path):
+    path = str(tmp_path / "cassette.jsonl.gz")
+    response = {"choices": [{"message": {"role": "assistant", "content": "answer"}}]}
+    recorder = Cassette(path, mode="record")
+    recorder.record("llm", _payload("old", "day 1", "q"), response, latency=0.5)
+    recorder.close()
+
+    replay = Cassette(path, mode="replay", latency_scale=0)
+    assert replay.replay("llm", _payload("new", "day 2", "q")) == response
+    assert replay.stats()["replayed"] == 1
+
+
+def test_recording_and_loading_run_off_the_event_loop(tmp_path, monkeypatch):
+    path = str(tmp_path / "cassette.jsonl.gz")
+    response = {"choices": [{"message": {"role": "assistant", "content": "answer"}}]}
+    threads = []
+    open_file = Cassette._open
+
+    def recording_open(self, mode):
+        threads.append(threading.get_ident())
+        return open_file(self, mode)
+
+    monkeypatch.setattr(Cassette, "_open", recording_open)
+
+    async def scenario():
+        recorder = Cassette(path, mode="record")
+        for question in ("q1", "q2", "q1"):
+            recorder.record("llm", _payload("p", "d", question), response, latency=0.1)
+        recorder.close()
+        replay = Cassette(path, mode="replay", latency_scale=0)
+        result = await replay.areplay("llm", _payload("p", "d", "q2"))
+        return threading.get_ident(), result, recorder.stats(), replay.stats()
+
+    loop_thread, result, recorded, replayed = asyncio.run(scenario())
+    assert result == response
+    assert recorded["recorded"] == 3 and replayed["replayed"] == 1
+    assert len(threads) == 4 and loop_thread not in threads
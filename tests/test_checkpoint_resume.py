@@ -0,0 +1,131 @@
+import json
+import asyncio
+
+import pytest
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import ToolMessage
+
+from backend.agent_core import DeepAgentManager
+from backend.checkpoint import list_threads
+from backend.custom_model import CustomChatModel
+
+ANSWER = "这是一个足够长的回答内容，用于测试多轮对话。"
+
+
+def _tool_call(call_id, name, args):
+    return {"id": call_id, "type": "function", "function": {"name": name, "arguments": json.dumps(args)}}
+
+
+def _install_fake_model(monkeypatch, subagent_started: asyncio.Event):
+    """第一轮派发一个子代理 task 和一个 write_todos；子代理一直挂起，其余调用直接回答"""
+
+    async def fake_request(self, payload):
+        messages = payload["messages"]
+        if "dedicated researcher" in messages[0]["content"]:
+            subagent_started.set()
+            await asyncio.sleep(3600)
+        if messages[-1]["role"] == "user" and messages[-1]["content"] == "first question":
+            return {"choices": [{"message": {"role": "assistant", "content": "", "tool_calls": [
+                _tool_call("call_task", "task", {"description": "research it", "subagent_type": "research-agent"}),
+                _tool_call("call_todos", "write_todos", {"todos": []}),
+            ]}}]}
+        return {"choices": [{"message": {"role": "assistant", "content": ANSWER}}]}
+
+    monkeypatch.setattr(CustomChatModel, "_arequest", fake_request)
+    # 流式调用走同一个假请求（一次性返回）
+    monkeypatch.setattr(CustomChatModel, "_astream", BaseChatModel._astream)
+    monkeypatch.setattr(CustomChatModel, "_stream", BaseChatModel._stream)
+
+
+def test_follow_up_after_run_cancelled_during_task_fanout(monkeypatch):
+    async def scenario():
+        subagent_started = asyncio.Event()
+        _install_fake_model(monkeypatch, subagent_started)
+        manager = DeepAgentManager()
+
+        async def consume():
+            async for _ in manager.stream_message("first question", "s1", "research"):
+                pass
+
+        # 子代理运行期间客户端断开，运行被取消
+        stream = asyncio.create_task(consume())
+        await asyncio.wait_for(subagent_started.wait(), 10)
+        stream.cancel()
+        await asyncio.gather(stream, return_exceptions=True)
+        await asyncio.sleep(0)
+
+        result = await manager.process_message("follow up", "s1", "research")
+        agent = await manager.agents.aget("research")
+        state = await agent.aget_state({"configurable": {"thread_id": "s1"}})
+        await manager.close()
+        return result, state.values["messages"]
+
+    result, messages = asyncio.run(scenario())
+
+    assert result["message"] == ANSWER
+    tool_results = {m.tool_call_id: m for m in messages if isinstance(m, ToolMessage)}
+    assert set(tool_results) == {"call_task", "call_todos"}
+    assert tool_results["call_task"].status == "error"
+    # 第一轮的问题仍在线程中，后续提问接在其后
+    contents = [m.content for m in messages]
+    assert contents.index("first question") < contents.index("follow up")
+
+
+def _use_sqlite(monkeypatch, tmp_path):
+    pytest.importorskip("aiosqlite")
+    pytest.importorskip("langgraph.checkpoint.sqlite")
+    monkeypatch.setenv("CHECKPOINTER", "sqlite")
+    monkeypatch.setenv("CHECKPOINT_DB_PATH", str(tmp_path / "checkpoints.sqlite3"))
+    monkeypatch.setenv("SESSION_STORE", "sqlite")
+    monkeypatch.setenv("SESSION_DB_PATH", str(tmp_path / "sessions.sqlite3"))
+
+
+def test_follow_up_in_another_process_after_cancelled_run(monkeypatch, tmp_path):
+    _use_sqlite(monkeypatch, tmp_path)
+
+    async def scenario():
+        subagent_started = asyncio.Event()
+        _install_fake_model(monkeypatch, subagent_started)
+        first = DeepAgentManager()
+
+        async def consume():
+            async for _ in first.stream_message("first question", "s1", "research"):
+                pass
+
+        stream = asyncio.create_task(consume())
+        await asyncio.wait_for(subagent_started.wait(), 10)
+        stream.cancel()
+        await asyncio.gather(stream, return_exceptions=True)
+        await first.close()
+
+        # 后续提问到达另一个 worker（或重启后的进程）
+        second = DeepAgentManager()
+        result = await second.process_message("follow up", "s1", "research")
+        await second.close()
+        return result
+
+    assert asyncio.run(scenario())["message"] == ANSWER
+
+
+def test_prune_threads_of_sessions_from_other_processes(monkeypatch, tmp_path):
+    _use_sqlite(monkeypatch, tmp_path)
+    _install_fake_model(monkeypatch, asyncio.Event())
+
+    async def scenario():
+        first = DeepAgentManager()
+        for session_id in ("s1", "s2", "s3"):
+            await first.process_message("hello", session_id, "general")
+        await first.close()
+
+        second = DeepAgentManager()
+        await second.session_store.adelete("s1")
+        await second._prune_threads()
+        pruned = await list_threads(second.checkpointer)
+        await second.cleanup_all_sessions()
+        cleared = await list_threads(second.checkpointer)
+        await second.close()
+        return pruned, cleared
+
+    pruned, cleared = asyncio.run(scenario())
+    assert sorted(pruned) == ["s2", "s3"]
+    assert cleared == []
@@ -0,0 +1,72 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
+from backend.context_budget import fit_to_budget, message_tokens
+
+BIG = "研究结果 detail " * 300
+
+
+def _call(call_id, name):
+    return {"id": call_id, "name": name, "args": {"query": call_id}, "type": "tool_call"}
+
+
+def _conversation():
+    return [
+        SystemMessage(content="You are a researcher. " * 50, id="system"),
+        HumanMessage(content="问题 " * 200, id="question"),
+        AIMessage(content="", tool_calls=[_call("c1", "internet_search")], id="ai1"),
+        ToolMessage(content=BIG, name="internet_search", tool_call_id="c1", id="t1"),
+        AIMessage(content="", tool_calls=[_call("c2", "task")], id="ai2"),
+        ToolMessage(content=BIG, name="task", tool_call_id="c2", id="t2"),
+        AIMessage(content=BIG, tool_calls=[_call("c3", "internet_search")], id="ai3"),
+        ToolMessage(content=BIG, name="internet_search", tool_call_id="c3", id="t3"),
+        AIMessage(content="", tool_calls=[_call("c4", "internet_search")], id="ai4"),
+        ToolMessage(content=BIG, name="internet_search", tool_call_id="c4", id="t4"),
+    ]
+
+
+def _total(messages):
+    return sum(message_tokens(m) for m in messages)
+
+
+def _stubbed(original, fitted):
+    return [a.id for a, b in zip(original, fitted) if a is not b]
+
+
+def test_under_budget_is_unchanged():
+    messages = _conversation()
+    fitted = fit_to_budget(messages, budget=_total(messages), keep_recent=2)
+    assert all(a is b for a, b in zip(messages, fitted))
+
+
+def test_stubbing_order():
+    messages = _conversation()
+    total = _total(messages)
+    tool_tokens = message_tokens(messages[3])
+
+    # 普通工具输出从旧到新先被替换，子代理 task 的输出保留
+    fitted = fit_to_budget(messages, budget=total - tool_tokens // 2, keep_recent=2)
+    assert _stubbed(messages, fitted) == ["t1"]
+    fitted = fit_to_budget(messages, budget=total - tool_tokens * 3 // 2, keep_recent=2)
+    assert _stubbed(messages, fitted) == ["t1", "t3"]
+
+    # 然后是 task 输出，最后才是 AI 文本
+    fitted = fit_to_budget(messages, budget=total - tool_tokens * 5 // 2, keep_recent=2)
+    assert _stubbed(messages, fitted) == ["t1", "t2", "t3"]
+    fitted = fit_to_budget(messages, budget=1, keep_recent=2)
+    assert _stubbed(messages, fitted) == ["t1", "t2", "ai3", "t3"]
+    assert "omitted to save context" in fitted[6].content
+    # 系统消息、用户消息和最近的消息始终原样保留
+    assert fitted[0] is messages[0] and fitted[1] is messages[1]
+    assert fitted[8:] == messages[8:]
+
+
+def test_tool_call_pairs_survive_stubbing():
+    messages = _conversation()
+    fitted = fit_to_budget(messages, budget=1, keep_recent=2)
+
+    assert [m.id for m in fitted] == [m.id for m in messages]
+    assert [type(m) for m in fitted] == [type(m) for m in messages]
+    calls = [call for m in fitted if isinstance(m, AIMessage) for call in m.tool_calls]
+    assert calls == [call for m in messages if isinstance(m, AIMessage) for call in m.tool_calls]
+    results = [(m.tool_call_id, m.name) for m in fitted if isinstance(m, ToolMessage)]
+    assert results == [(call["id"], call["name"]) for call in calls]
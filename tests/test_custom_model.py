@@ -0,0 +1,129 @@
+import json
+import asyncio
+
+import httpx
+from langchain_core.messages import HumanMessage
+from langchain_core.tools import tool
+
+from backend.custom_model import CustomChatModel
+from backend.http_clients import LoopLocalClient
+
+
+@tool
+def web_search(query: str) -> str:
+    """搜索网页"""
+    return query
+
+
+@tool
+def read_file(path: str) -> str:
+    """读取文件"""
+    return path
+
+
+def _model(handler):
+    """请求经 MockTransport 交给 handler，不访问网络"""
+    model = CustomChatModel()
+    transport = httpx.MockTransport(handler)
+    model._clients = LoopLocalClient(lambda: httpx.AsyncClient(transport=transport))
+    return model
+
+
+def _sse(*deltas):
+    lines = [f"data: {json.dumps({'choices': [{'delta': delta}]})}" for delta in deltas]
+    return httpx.Response(200, text="\n\n".join(lines + ["data: [DONE]"]) + "\n\n")
+
+
+def _tool_delta(index, id=None, name=None, arguments=None):
+    function = {k: v for k, v in (("name", name), ("arguments", arguments)) if v is not None}
+    raw = {"index": index, "function": function}
+    if id is not None:
+        raw["id"] = id
+    return {"tool_calls": [raw]}
+
+
+def _astream(model, tools, **kwargs):
+    async def collect():
+        message = None
+        async for chunk in model.bind_tools(tools, **kwargs).astream([HumanMessage(content="q")]):
+            message = chunk if message is None else message + chunk
+        return message
+
+    return asyncio.run(collect())
+
+
+def test_streamed_tool_call_is_assembled_across_deltas():
+    model = _model(lambda request: _sse(
+        {"content": "先搜索。"},
+        _tool_delta(0, id="call_1", name="web_"),
+        _tool_delta(0, name="search", arguments='{"que'),
+        _tool_delta(0, arguments='ry": "lang'),
+        _tool_delta(0, arguments='graph"}'),
+    ))
+    message = _astream(model, [web_search])
+    assert message.content == "先搜索。"
+    assert message.tool_calls == [
+        {"name": "web_search", "args": {"query": "langgraph"}, "id": "call_1", "type": "tool_call"}
+    ]
+    assert message.invalid_tool_calls == []
+
+
+def test_parallel_streamed_tool_calls_are_kept_apart_by_index():
+    model = _model(lambda request: _sse(
+        _tool_delta(0, id="call_a", name="web_search", arguments='{"query":'),
+        _tool_delta(1, id="call_b", name="read_file", arguments='{"path": '),
+        _tool_delta(0, arguments=' "a"}'),
+        _tool_delta(1, arguments='"b.txt"}'),
+    ))
+    message = _astream(model, [web_search, read_file])
+    assert [(c["id"], c["name"], c["args"]) for c in message.tool_calls] == [
+        ("call_a", "web_search", {"query": "a"}),
+        ("call_b", "read_file", {"path": "b.txt"}),
+    ]
+
+
+def test_invalid_json_arguments_become_invalid_tool_calls():
+    model = _model(lambda request: _sse(
+        _tool_delta(0, id="call_1", name="web_search", arguments='{"query": '),
+        _tool_delta(0, arguments="oops}"),
+    ))
+    message = _astream(model, [web_search])
+    assert message.tool_calls == []
+    assert len(message.invalid_tool_calls) == 1
+    assert message.invalid_tool_calls[0]["name"] == "web_search"
+    assert message.invalid_tool_calls[0]["args"] == '{"query": oops}'
+
+    # 非流式路径：整条消息的参数不是合法 JSON 时同样记为 invalid_tool_calls
+    model = _model(lambda request: httpx.Response(200, json={"choices": [{"message": {
+        "role": "assistant",
+        "content": "",
+        "tool_calls": [
+            {"id": "call_1", "type": "function", "function": {"name": "web_search", "arguments": '{"query": "a"}'}},
+            {"id": "call_2", "type": "function", "function": {"name": "read_file", "arguments": "{path"}},
+        ],
+    }}]}))
+    message = asyncio.run(model.bind_tools([web_search, read_file]).ainvoke([HumanMessage(content="q")]))
+    assert [c["id"] for c in message.tool_calls] == ["call_1"]
+    assert [c["id"] for c in message.invalid_tool_calls] == ["call_2"]
+
+
+def test_tool_choice_is_mapped_to_openai_values():
+    payloads = []
+
+    def handler(request):
+        payloads.append(json.loads(request.content))
+        return httpx.Response(200, json={"choices": [{"message": {"role": "assistant", "content": "ok"}}]})
+
+    model = _model(handler)
+    for tool_choice in ("any", True, False, "auto", "web_search", None):
+        asyncio.run(model.bind_tools([web_search], tool_choice=tool_choice).ainvoke([HumanMessage(content="q")]))
+
+    assert [payload.get("tool_choice") for payload in payloads] == [
+        "required",
+        "required",
+        "none",
+        "auto",
+        {"type": "function", "function": {"name": "web_search"}},
+        None,
+    ]
+    assert all(payload["tools"][0]["function"]["name"] == "web_search" for payload in payloads)
@@ -0,0 +1,49 @@
+from deepagents.state import BLOB_MIN_SIZE, file_reducer, intern_content
+from deepagents.tools import edit_file, write_file
+
+
+def test_unchanged_update_returns_the_same_dict():
+    files = {"a.md": "alpha", "b.md": "beta"}
+    assert file_reducer(files, {}) is files
+    assert file_reducer(files, {"a.md": "alpha"}) is files
+    # 内容相等但不是同一个字符串对象，也视为未改变
+    assert file_reducer(files, {"a.md": "".join(["al", "pha"])}) is files
+    assert file_reducer(None, files) is files
+    assert file_reducer(files, None) is files
+
+
+def test_changed_update_is_copy_on_write():
+    report = "x" * BLOB_MIN_SIZE
+    files = {"a.md": "alpha", "report.md": report}
+    merged = file_reducer(files, {"a.md": "changed", "new.md": "new"})
+
+    assert merged is not files
+    assert files == {"a.md": "alpha", "report.md": report}
+    assert merged == {"a.md": "changed", "report.md": report, "new.md": "new"}
+    assert merged["report.md"] is files["report.md"]
+
+
+def test_intern_content_shares_large_blobs():
+    small = "".join(["short", " text"])
+    assert intern_content(small) is small
+
+    first = "".join(["report ", "y" * BLOB_MIN_SIZE])
+    second = "".join(["report ", "y" * BLOB_MIN_SIZE])
+    assert first is not second
+    assert intern_content(first) is first
+    assert intern_content(second) is first
+
+
+def test_file_tools_send_only_the_changed_path():
+    files = {"a.md": "hello world", "b.md": "untouched"}
+    state = {"files": files, "messages": []}
+
+    written = write_file("c.md", "new file", state, "call_1").update["files"]
+    edited = edit_file.func("a.md", "world", "there", state, "call_2").update["files"]
+
+    assert written == {"c.md": "new file"}
+    assert edited == {"a.md": "hello there"}
+    # 工具不修改状态中的字典
+    assert files == {"a.md": "hello world", "b.md": "untouched"}
+    merged = file_reducer(file_reducer(files, written), edited)
+    assert merged == {"a.md": "hello there", "b.md": "untouched", "c.md": "new file"}
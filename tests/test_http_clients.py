@@ -0,0 +1,27 @@
+import asyncio
+
+import httpx
+
+from backend.http_clients import LoopLocalClient, aclose_clients
+
+
+def test_one_client_per_loop_and_closed_on_shutdown():
+    created = []
+
+    def factory():
+        created.append(httpx.AsyncClient())
+        return created[-1]
+
+    clients = LoopLocalClient(factory)
+
+    async def use_and_close():
+        first = clients.get()
+        assert clients.get() is first
+        await aclose_clients()
+        return first
+
+    first = asyncio.run(use_and_close())
+    second = asyncio.run(use_and_close())
+    assert first is not second
+    assert first.is_closed and second.is_closed
+    assert len(created) == 2
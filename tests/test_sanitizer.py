@@ -0,0 +1,49 @@
+import random
+
+import pytest
+
+from backend.sanitizer import StreamSanitizer, sanitize, strip_code
+
+# 反引号、换行和内部指令相关的片段组合，覆盖围栏、行内代码和它们跨分块的各种位置
+_PIECES = ["`", "``", "```", "```python\n", "\n", "\n\n", "  ", "text", "代码", "x = 1",
+           "写入文件", "调用 research-agent", "final_report.md", "保存结果\n", "结论。"]
+
+
+def _stream(text, rng):
+    sanitizer = StreamSanitizer()
+    out, i = [], 0
+    while i < len(text):
+        size = rng.randint(1, 8)
+        out.append(sanitizer.feed(text[i:i + size]))
+        i += size
+    out.append(sanitizer.flush())
+    return "".join(out)
+
+
+def test_streamed_output_matches_one_shot():
+    # 流式路径实时输出的是移除代码后的文本，最终回答仍由 sanitize 作用于完整原文
+    for seed in range(500):
+        rng = random.Random(seed)
+        text = "".join(rng.choice(_PIECES) for _ in range(rng.randint(0, 40)))
+        assert _stream(text, rng) == strip_code(text), (seed, text)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("结果如下：\n```python\nprint(1)\n```\n完成", "结果如下：\n\n完成"),
+    ("运行 `pip install` 即可", "运行  即可"),
+    ("未闭合的 `反引号\n下一行", "未闭合的 `反引号\n下一行"),
+    ("开头\n```\n未闭合的代码块", "开头"),
+    ("第一段\n\n\n\n第二段\n写入完成后通知用户\n  缩进保留", "第一段\n\n第二段\n  缩进保留"),
+    ("请查看 final_report.md 获取详情", "请查看  获取详情"),
+])
+def test_sanitize(text, expected):
+    assert sanitize(text) == expected
+
+
+def test_feed_holds_back_only_what_may_still_change():
+    sanitizer = StreamSanitizer()
+    assert sanitizer.feed("前文 ``") == "前文 "
+    assert sanitizer.feed("`\n代码") == ""
+    assert sanitizer.feed("\n``") == ""
+    assert sanitizer.feed("`后文`") == "后文"
+    assert sanitizer.flush() == "`"
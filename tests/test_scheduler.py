@@ -0,0 +1,176 @@
+import asyncio
+import json
+
+import pytest
+from langchain_core.language_models import BaseChatModel
+
+import backend.main as main
+from backend.agent_core import DeepAgentManager
+from backend.custom_model import CustomChatModel
+from backend.models import ChatRequest
+from backend.scheduler import QueueFullError, QueueTimeoutError, RunScheduler
+
+
+async def _run(scheduler, name, order, release: asyncio.Event):
+    """与 _admitted_process 相同的用法：获得名额后运行，结束（或取消）时归还"""
+    slot = scheduler.reserve("research")
+    try:
+        await slot.acquire()
+        order.append(name)
+        await release.wait()
+    finally:
+        slot.release()
+
+
+def test_waiters_are_admitted_in_fifo_order():
+    async def scenario():
+        scheduler = RunScheduler(max_concurrent=1, max_queue=5, queue_timeout=5)
+        order, release = [], asyncio.Event()
+        holder = scheduler.reserve("research")
+        tasks = []
+        for name in "abcd":
+            tasks.append(asyncio.create_task(_run(scheduler, name, order, release)))
+            await asyncio.sleep(0)
+        positions = [slot.position for slot in scheduler._lanes["research"].waiters]
+        release.set()
+        holder.release()
+        await asyncio.gather(*tasks)
+        return order, positions, scheduler.stats()["research"]
+
+    order, positions, stats = asyncio.run(scenario())
+    assert order == list("abcd")
+    assert positions == [1, 2, 3, 4]
+    assert stats["running"] == 0 and stats["waiting"] == 0
+    assert stats["admitted"] == 5 and stats["queued"] == 4
+
+
+def test_full_queue_rejects_with_retry_after():
+    scheduler = RunScheduler(max_concurrent=1, max_queue=1, queue_timeout=5)
+    scheduler.reserve("research")
+    scheduler.reserve("research")
+    with pytest.raises(QueueFullError) as error:
+        scheduler.reserve("research")
+    assert error.value.retry_after >= 1
+    assert scheduler.stats()["research"]["rejected"] == 1
+    # 各代理类型的名额互不影响
+    assert scheduler.reserve("critique").granted
+
+
+def test_queue_timeout_leaves_the_queue():
+    async def scenario():
+        scheduler = RunScheduler(max_concurrent=1, max_queue=5, queue_timeout=0.05)
+        scheduler.reserve("research")
+        slot = scheduler.reserve("research")
+        with pytest.raises(QueueTimeoutError):
+            await slot.acquire()
+        return slot, scheduler.stats()["research"]
+
+    slot, stats = asyncio.run(scenario())
+    assert slot.released and not slot.granted
+    assert stats["timeouts"] == 1 and stats["waiting"] == 0 and stats["running"] == 1
+
+
+def test_cancelled_waiters_give_up_their_place():
+    async def scenario():
+        scheduler = RunScheduler(max_concurrent=1, max_queue=5, queue_timeout=5)
+        order, release = [], asyncio.Event()
+        holder = scheduler.reserve("research")
+        tasks = {}
+        for name in "abc":
+            tasks[name] = asyncio.create_task(_run(scheduler, name, order, release))
+            await asyncio.sleep(0)
+
+        # 排队中取消
+        tasks["a"].cancel()
+        await asyncio.gather(tasks["a"], return_exceptions=True)
+        waiting = scheduler.stats()["research"]["waiting"]
+
+        # 刚获得名额、尚未开始运行时取消：名额转给下一个等待者
+        holder.release()
+        tasks["b"].cancel()
+        await asyncio.gather(tasks["b"], return_exceptions=True)
+
+        release.set()
+        await tasks["c"]
+        return order, waiting, scheduler.stats()["research"]
+
+    order, waiting, stats = asyncio.run(scenario())
+    assert waiting == 2
+    assert order == ["c"]
+    assert stats["running"] == 0 and stats["waiting"] == 0
+
+
+class _BusyManager:
+    def __init__(self, error):
+        self.error = error
+
+    async def process_message(self, **kwargs):
+        raise self.error
+
+
+@pytest.mark.parametrize("error, status", [
+    (QueueFullError("research", 7), 429),
+    (QueueTimeoutError("research", 7), 503),
+])
+def test_chat_maps_scheduler_errors_to_http_status(monkeypatch, error, status):
+    monkeypatch.setattr(main, "agent_manager", _BusyManager(error))
+    response = asyncio.run(main.chat(ChatRequest(message="hi")))
+    assert response.status_code == status
+    assert response.headers["Retry-After"] == "7"
+    assert json.loads(response.body)["detail"] == str(error)
+
+
+class _Request:
+    """只实现 chat_stream 用到的 is_disconnected"""
+
+    def __init__(self):
+        self.disconnected = False
+
+    async def is_disconnected(self):
+        return self.disconnected
+
+
+def test_disconnect_cancels_stream_run_and_releases_slot(monkeypatch):
+    started, cancelled = asyncio.Event(), asyncio.Event()
+
+    async def fake_request(self, payload):
+        started.set()
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    monkeypatch.setattr(CustomChatModel, "_arequest", fake_request)
+    monkeypatch.setattr(CustomChatModel, "_astream", BaseChatModel._astream)
+    monkeypatch.setattr(CustomChatModel, "_stream", BaseChatModel._stream)
+
+    async def scenario():
+        manager = DeepAgentManager()
+        manager.disconnect_poll_interval = 0.01
+        monkeypatch.setattr(main, "agent_manager", manager)
+        request = _Request()
+        response = await main.chat_stream(request, "s1", "long question", "research")
+
+        async def consume():
+            return [chunk async for chunk in response.body_iterator]
+
+        body = asyncio.create_task(consume())
+        await asyncio.wait_for(started.wait(), 10)
+        running = manager.scheduler.stats()["research"]["running"]
+        # 客户端关闭页面：下一次轮询发现断开，响应结束
+        request.disconnected = True
+        chunks = await asyncio.wait_for(body, 10)
+        stats = dict(manager.stats)
+        lane = manager.scheduler.stats()["research"]
+        await manager.close()
+        return running, chunks, stats, lane
+
+    running, chunks, stats, lane = asyncio.run(scenario())
+
+    assert running == 1
+    assert json.loads(chunks[0][len("data: "):])["type"] == "start"
+    assert not any('"complete"' in chunk for chunk in chunks)
+    assert cancelled.is_set()
+    assert stats["cancelled_runs"] == 1
+    assert lane["running"] == 0 and lane["waiting"] == 0
@@ -0,0 +1,15 @@
+import backend.search as search
+
+
+def test_cache_key_changes_with_compression_budget(monkeypatch):
+    key = search._cache_key("AI  News", 10, "general", True)
+    assert search._cache_key("ai news", 10, "general", True) == key
+
+    monkeypatch.setattr(search, "SEARCH_TOKEN_BUDGET", search.SEARCH_TOKEN_BUDGET + 1000)
+    assert search._cache_key("ai news", 10, "general", True) != key
+
+
+def test_cache_key_without_raw_content_ignores_budget(monkeypatch):
+    key = search._cache_key("ai news", 10, "general", False)
+    monkeypatch.setattr(search, "SEARCH_TOKEN_BUDGET", 0)
+    assert search._cache_key("ai news", 10, "general", False) == key
@@ -0,0 +1,65 @@
+import asyncio
+import threading
+
+import pytest
+
+from backend.session_store import MemorySessionStore, SessionStore, SQLiteSessionStore
+
+
+def test_session_store_is_abstract():
+    with pytest.raises(TypeError):
+        SessionStore()
+
+
+def test_sqlite_store_keeps_running_count_and_evicts(tmp_path):
+    store = SQLiteSessionStore(db_path=str(tmp_path / "sessions.sqlite3"), max_sessions=3)
+    for session_id in ["a", "b", "c", "d"]:
+        assert store.ensure(session_id)
+    assert store.count() == 3
+    assert not store.exists("a")  # 最久未活动的会话被淘汰
+    store.append_history("b", [{"role": "user", "content": "hi"}])
+    assert store.delete("b")
+    assert store.count() == 2
+    assert store.clear() == 2
+    assert store.count() == 0
+    store.close()
+
+    # 重新打开时计数从表中恢复
+    store = SQLiteSessionStore(db_path=str(tmp_path / "sessions.sqlite3"), max_sessions=3)
+    store.ensure("e")
+    assert store.count() == 1
+    store.close()
+
+
+def test_sqlite_async_methods_run_off_the_event_loop(tmp_path):
+    store = SQLiteSessionStore(db_path=str(tmp_path / "sessions.sqlite3"))
+    threads = []
+    ensure = store.ensure
+
+    def recording_ensure(session_id):
+        threads.append(threading.current_thread())
+        return ensure(session_id)
+
+    store.ensure = recording_ensure
+
+    async def scenario():
+        assert await store.aensure("s")
+        await store.aappend_history("s", [{"role": "user", "content": "q"}])
+        return await store.aget_history("s"), await store.acount()
+
+    history, count = asyncio.run(scenario())
+    assert history == [{"role": "user", "content": "q"}]
+    assert count == 1
+    assert threads and threads[0] is not threading.main_thread()
+    store.close()
+
+
+def test_memory_store_async_methods():
+    store = MemorySessionStore(max_sessions=2)
+
+    async def scenario():
+        await store.aensure("s")
+        await store.aappend_history("s", [{"role": "user", "content": "q"}])
+        return await store.aget_history("s")
+
+    assert asyncio.run(scenario()) == [{"role": "user", "content": "q"}]
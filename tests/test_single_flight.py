@@ -0,0 +1,109 @@
+import asyncio
+
+from langchain_core.language_models import BaseChatModel
+
+from backend.agent_core import DeepAgentManager
+from backend.custom_model import CustomChatModel
+
+ANSWER = "合并请求共享的同一个回答。"
+
+
+def _install_gated_model(monkeypatch):
+    """上游调用计数；在 gate 打开前挂起，保证相同请求在运行期间到达"""
+    calls = []
+    gate = asyncio.Event()
+    started = asyncio.Event()
+
+    async def fake_request(self, payload):
+        calls.append(payload)
+        started.set()
+        await gate.wait()
+        return {"choices": [{"message": {"role": "assistant", "content": ANSWER}}]}
+
+    monkeypatch.setattr(CustomChatModel, "_arequest", fake_request)
+    monkeypatch.setattr(CustomChatModel, "_astream", BaseChatModel._astream)
+    monkeypatch.setattr(CustomChatModel, "_stream", BaseChatModel._stream)
+    return calls, gate, started
+
+
+def test_identical_calls_share_one_upstream_run(monkeypatch):
+    async def scenario():
+        calls, gate, started = _install_gated_model(monkeypatch)
+        manager = DeepAgentManager()
+        leader = asyncio.create_task(manager.process_message("What is LangGraph?", "s1", "research"))
+        await asyncio.wait_for(started.wait(), 10)
+        followers = [
+            asyncio.create_task(manager.process_message("what is  langgraph?", session_id, "research"))
+            for session_id in ("s2", "s3")
+        ]
+        await asyncio.sleep(0.05)
+        gate.set()
+        results = await asyncio.gather(leader, *followers)
+        histories = [await manager.session_store.aget_history(s) for s in ("s1", "s2", "s3")]
+        stats = dict(manager.stats)
+        await manager.close()
+        return calls, results, histories, stats
+
+    calls, results, histories, stats = asyncio.run(scenario())
+
+    assert len(calls) == 1
+    assert [result["message"] for result in results] == [ANSWER] * 3
+    assert stats["coalesced_requests"] == 2
+    # 每个会话都记录了自己的问答
+    assert all(history[-1]["content"] == ANSWER for history in histories)
+
+
+def test_cancelled_follower_does_not_cancel_leader_call(monkeypatch):
+    async def scenario():
+        calls, gate, started = _install_gated_model(monkeypatch)
+        manager = DeepAgentManager()
+        leader = asyncio.create_task(manager.process_message("same question", "s1", "research"))
+        await asyncio.wait_for(started.wait(), 10)
+        follower = asyncio.create_task(manager.process_message("same question", "s2", "research"))
+        await asyncio.sleep(0.05)
+        follower.cancel()
+        await asyncio.gather(follower, return_exceptions=True)
+        gate.set()
+        result = await asyncio.wait_for(leader, 10)
+        running = manager.scheduler.stats()["research"]["running"]
+        await manager.close()
+        return calls, follower, result, running
+
+    calls, follower, result, running = asyncio.run(scenario())
+
+    assert follower.cancelled()
+    assert result["message"] == ANSWER
+    assert len(calls) == 1
+    assert running == 0
+
+
+def test_cancelled_stream_follower_does_not_cancel_leader_stream(monkeypatch):
+    async def scenario():
+        calls, gate, started = _install_gated_model(monkeypatch)
+        manager = DeepAgentManager()
+
+        async def consume(session_id):
+            events = []
+            async for event in manager.stream_message("same question", session_id, "research"):
+                events.append(event)
+            return events
+
+        leader = asyncio.create_task(consume("s1"))
+        await asyncio.wait_for(started.wait(), 10)
+        follower = asyncio.create_task(consume("s2"))
+        await asyncio.sleep(0.05)
+        follower.cancel()
+        await asyncio.gather(follower, return_exceptions=True)
+        gate.set()
+        events = await asyncio.wait_for(leader, 10)
+        stats = dict(manager.stats)
+        await manager.close()
+        return calls, events, stats
+
+    calls, events, stats = asyncio.run(scenario())
+
+    assert len(calls) == 1
+    assert stats["coalesced_requests"] == 1
+    assert stats["cancelled_runs"] == 0
+    complete = [event for event in events if event["type"] == "complete"]
+    assert complete and complete[-1]["content"] == ANSWER
@@ -0,0 +1,37 @@
+import asyncio
+import threading
+
+from langchain_core.messages import AIMessage
+
+import deepagents.sub_agent as sub_agent
+from deepagents.state import DeepAgentState
+
+
+class _FakeGraph:
+    async def ainvoke(self, state, config=None):
+        return {"messages": [AIMessage(content="done")], "files": state["files"]}
+
+
+def test_sub_agents_compile_once_off_the_event_loop(monkeypatch):
+    compiled = []
+
+    def fake_create_react_agent(model, **kwargs):
+        compiled.append(threading.get_ident())
+        return _FakeGraph()
+
+    monkeypatch.setattr(sub_agent, "create_react_agent", fake_create_react_agent)
+    task = sub_agent._create_task_tool(
+        [], "instructions", [{"name": "research-agent", "description": "d", "prompt": "p"}],
+        model=object(), state_schema=DeepAgentState,
+    )
+    state = {"messages": [], "files": {}}
+
+    async def scenario():
+        results = await asyncio.gather(*(
+            task.coroutine("question", "research-agent", state, f"call_{i}") for i in range(3)
+        ))
+        return threading.get_ident(), results
+
+    loop_thread, results = asyncio.run(scenario())
+    assert len(compiled) == 1 and compiled[0] != loop_thread
+    assert all(r.update["messages"][0].content == "done" for r in results)
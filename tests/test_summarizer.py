@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from backend.agent_core import DeepAgentManager
+from backend.custom_model import CustomChatModel
+
+
+def test_manager_starts_degraded_without_model_endpoint(monkeypatch):
+    monkeypatch.delenv("CUSTOM_API_BASE_URL")
+    monkeypatch.setenv("SUMMARY_ENABLED", "True")
+
+    async def scenario():
+        manager = DeepAgentManager()
+        try:
+            return manager.summarizer, await manager.process_message("hello", "s1", "general")
+        finally:
+            await manager.close()
+
+    summarizer, result = asyncio.run(scenario())
+    assert summarizer is None
+    assert "未能正确初始化" in result["message"]
+
+
+ANSWER = "这是一个足够长的回答，" * 30
+
+
+def _install_fake_model(monkeypatch, summary_gate, run_gate, summaries):
+    async def fake_request(self, payload):
+        messages = payload["messages"]
+        if "running summary" in messages[0]["content"]:
+            summaries.append(messages[-1]["content"])
+            await summary_gate.wait()
+            return {"choices": [{"message": {"role": "assistant", "content": f"摘要 v{len(summaries)}"}}]}
+        if messages[-1]["content"] == "third":
+            await run_gate.wait()
+        return {"choices": [{"message": {"role": "assistant", "content": ANSWER}}]}
+
+    monkeypatch.setattr(CustomChatModel, "_arequest", fake_request)
+
+
+async def _settle(summarizer):
+    while summarizer._tasks:
+        await asyncio.gather(*summarizer._tasks.values(), return_exceptions=True)
+
+
+@pytest.mark.parametrize("run_finishes_first", [False, True])
+def test_summary_written_during_a_run_is_not_lost(monkeypatch, run_finishes_first):
+    monkeypatch.setenv("SUMMARY_ENABLED", "True")
+    monkeypatch.setenv("SUMMARY_TRIGGER_TOKENS", "100")
+    monkeypatch.setenv("SUMMARY_KEEP_TURNS", "1")
+
+    async def scenario():
+        summary_gate, run_gate, summaries = asyncio.Event(), asyncio.Event(), []
+        _install_fake_model(monkeypatch, summary_gate, run_gate, summaries)
+        manager = DeepAgentManager()
+        summarizer = manager.summarizer
+        await manager.process_message("first", "s1", "general")
+        await manager.process_message("second", "s1", "general")
+
+        # 第一轮的摘要在第三轮运行期间生成
+        third = asyncio.create_task(manager.process_message("third", "s1", "general"))
+        while len(summaries) < 1 or not summarizer._running:
+            await asyncio.sleep(0.01)
+        if run_finishes_first:
+            run_gate.set()
+            await third
+            summary_gate.set()
+        else:
+            summary_gate.set()
+            while summarizer._tasks:
+                await asyncio.sleep(0.01)
+            run_gate.set()
+            await third
+        await _settle(summarizer)
+
+        agent = await manager.agents.aget("general")
+        state = await agent.aget_state({"configurable": {"thread_id": "s1"}})
+        await manager.close()
+        return summaries, state.values["summary"], summarizer.stats()
+
+    summaries, summary, stats = asyncio.run(scenario())
+    # 每段历史只摘要一次：第一轮，然后是第二轮（在第一版摘要的基础上）
+    assert len(summaries) == 2
+    assert "(none)" in summaries[0] and "摘要 v1" in summaries[1]
+    assert summary["version"] == 2 and summary["text"] == "摘要 v2"
+    assert stats["summaries"] == 2
@@ -0,0 +1,81 @@
+import asyncio
+import threading
+from uuid import uuid4
+
+import pytest
+from fastapi import HTTPException
+
+import backend.main as main
+import backend.tracing as tracing
+from backend.tracing import RunTracer
+
+
+def _run(tracer):
+    root, child = uuid4(), uuid4()
+    tracer.on_chain_start({"name": "agent"}, {}, run_id=root)
+    tracer.on_tool_start({"name": "internet_search"}, "query", run_id=child, parent_run_id=root)
+    tracer.on_tool_end("result", run_id=child)
+    tracer.on_chain_end({}, run_id=root)
+    return str(root)
+
+
+def test_traces_are_serialized_and_written_off_the_calling_thread(tmp_path, monkeypatch):
+    threads = []
+    format_json = tracing._JsonFormatter.format
+
+    def recording_format(self, record):
+        threads.append(threading.get_ident())
+        return format_json(self, record)
+
+    monkeypatch.setattr(tracing._JsonFormatter, "format", recording_format)
+    path = str(tmp_path / "traces.jsonl")
+    tracer = RunTracer(path=path)
+    run_id = _run(tracer)
+    tracer.close()
+
+    assert threads and threading.get_ident() not in threads
+    # 内存中没有时从文件读回
+    trace = RunTracer(path=path, max_runs=0).get_trace(run_id)
+    assert trace["root"]["name"] == "agent"
+    assert [c["name"] for c in trace["root"]["children"]] == ["internet_search"]
+
+    # 关闭后再有追踪时重新启动写入线程
+    second = _run(tracer)
+    tracer.close()
+    assert RunTracer(path=path, max_runs=0).get_trace(second) is not None
+
+
+def test_trace_endpoint_reads_files_off_the_event_loop(tmp_path, monkeypatch):
+    tracer = RunTracer(path=str(tmp_path / "traces.jsonl"))
+    threads = []
+
+    def recording_read(run_id):
+        threads.append(threading.get_ident())
+        return None
+
+    monkeypatch.setattr(tracer, "_read", recording_read)
+    monkeypatch.setattr(main, "tracer", tracer)
+
+    async def scenario():
+        with pytest.raises(HTTPException) as error:
+            await main.get_run_trace(str(uuid4()))
+        return threading.get_ident(), error.value.status_code
+
+    loop_thread, status = asyncio.run(scenario())
+    assert status == 404
+    assert threads and loop_thread not in threads
+
+
+def test_cancelled_run_leaves_no_bookkeeping_behind():
+    tracer = RunTracer()
+    root, hidden, model = uuid4(), uuid4(), uuid4()
+    tracer.on_chain_start({"name": "agent"}, {}, run_id=root)
+    tracer.on_chain_start({"name": "ChannelWrite"}, {}, run_id=hidden, parent_run_id=root, tags=[tracing.HIDDEN_TAG])
+    tracer.on_chat_model_start({"name": "model"}, [[]], run_id=model, parent_run_id=hidden)
+    # 运行被取消：只有根运行收到错误回调，子运行的结束回调不会到达
+    tracer.on_chain_error(asyncio.CancelledError(), run_id=root)
+
+    assert not tracer._root_of and not tracer._alias and not tracer._spans and not tracer._traces
+    trace = tracer.get_trace(str(root))
+    assert trace["root"]["status"] == "error"
+    assert [(c["name"], c["status"]) for c in trace["root"]["children"]] == [("model", "cancelled")]